@@ -0,0 +1 @@
+"""Бенчмарки обработки GPX и дашборда погоды"""
@@ -0,0 +1,42 @@
+"""Синтетические треки и общие фикстуры для бенчмарков"""
+
+import os
+import pytest
+
+from gpx_generator import generate_gpx
+
+# Размеры треков в точках; полный прогон до 1M: BENCH_GPX_POINTS=1000,10000,100000,1000000
+GPX_POINTS = [int(n) for n in os.getenv('BENCH_GPX_POINTS', '1000,10000,100000').split(',') if n.strip()]
+
+# Длина маршрута для дашборда в км (от нее зависит число точек прогноза)
+DASHBOARD_LENGTHS_KM = [60, 150, 300]
+
+# С этого размера функция выполняется один раз за замер - иначе прогон длится часами
+SINGLE_ROUND_POINTS = 100000
+
+
+@pytest.fixture(scope='session')
+def gpx_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp('gpx')
+
+
+@pytest.fixture(scope='session')
+def synthetic_gpx(gpx_dir):
+    """Возвращает функцию, которая создает (один раз за прогон) трек нужного размера"""
+    paths = {}
+
+    def build(points, length_km=150):
+        key = (points, length_km)
+        if key not in paths:
+            paths[key] = generate_gpx(os.path.join(gpx_dir, f'track_{points}_{length_km}.gpx'), length_km,
+                                      points=points, name=f'Synthetic {points}', seed=points)
+        return paths[key]
+
+    return build
+
+
+def measure(benchmark, points, func, *args, **kwargs):
+    """Замеряет функцию; на больших треках - одним прогоном"""
+    if points >= SINGLE_ROUND_POINTS:
+        return benchmark.pedantic(func, args=args, kwargs=kwargs, rounds=1, iterations=1)
+    return benchmark(func, *args, **kwargs)
@@ -0,0 +1,87 @@
+"""Бенчмарки разбора GPX, выборки точек прогноза и отрисовки дашборда"""
+
+import os
+import pytest
+import gpxpy
+import matplotlib
+from datetime import datetime
+
+matplotlib.use('Agg')
+
+import bot
+import weather_dashboard
+from benchmarks.conftest import GPX_POINTS, DASHBOARD_LENGTHS_KM, measure
+
+START_TIME = datetime(2025, 6, 1, 8, 0)
+
+
+def parse_gpx(path):
+    with open(path, 'r') as f:
+        return gpxpy.parse(f)
+
+
+def fake_weather(route_points):
+    """Погода для каждой точки прогноза без запросов к Open-Meteo"""
+    return [{
+        'time': point['time'],
+        'distance_km': point['distance_km'],
+        'temperature': 20 + i % 7,
+        'feels_like': 19 + i % 7,
+        'humidity': 60,
+        'wind_speed': 10 + i % 5,
+        'wind_direction': (i * 37) % 360,
+        'pressure': 1013,
+        'weather_code': [0, 1, 2, 3, 61][i % 5],
+        'precipitation_probability': (i * 13) % 100,
+        'cloud_cover': (i * 17) % 100,
+    } for i, point in enumerate(route_points)]
+
+
+@pytest.mark.parametrize('points', GPX_POINTS)
+class TestGpxParsing:
+    """Разбор GPX файла и подсчет длины и набора высоты"""
+
+    def test_gpxpy_parse(self, benchmark, synthetic_gpx, points):
+        gpx = measure(benchmark, points, parse_gpx, synthetic_gpx(points))
+        assert gpx.get_track_points_no() == points
+
+    def test_extract_route_name(self, benchmark, synthetic_gpx, points):
+        name = measure(benchmark, points, bot.extract_route_name_from_gpx, synthetic_gpx(points))
+        assert name == f'Synthetic {points}'
+
+    def test_length_and_uphill(self, benchmark, synthetic_gpx, points):
+        gpx = parse_gpx(synthetic_gpx(points))
+        length = measure(benchmark, points, lambda: (gpx.length_2d(), gpx.get_uphill_downhill()))[0]
+        assert length > 100000
+
+
+@pytest.mark.parametrize('points', GPX_POINTS)
+class TestRouteSampling:
+    """Чтение точек с временем и выборка точек прогноза каждые 6 км"""
+
+    def test_get_route_points_with_time(self, benchmark, synthetic_gpx, points):
+        route = measure(benchmark, points, weather_dashboard.get_route_points_with_time, synthetic_gpx(points))
+        assert len(route) == points
+
+    def test_calculate_route_time_points(self, benchmark, synthetic_gpx, points):
+        route = weather_dashboard.get_route_points_with_time(synthetic_gpx(points))
+        samples = measure(benchmark, points, weather_dashboard.calculate_route_time_points, route, START_TIME)
+        # 150 км - точка прогноза каждые 6 км
+        assert len(samples) in (24, 25)
+
+
+@pytest.mark.parametrize('length_km', DASHBOARD_LENGTHS_KM)
+class TestDashboardRender:
+    """Отрисовка дашборда по готовым данным о погоде"""
+
+    @pytest.mark.parametrize('dpi', [60, 150])
+    def test_create_weather_dashboard(self, benchmark, synthetic_gpx, tmp_path, length_km, dpi):
+        route = weather_dashboard.get_route_points_with_time(synthetic_gpx(5000, length_km))
+        route_points = weather_dashboard.calculate_route_time_points(route, START_TIME)
+        weather_data = fake_weather(route_points)
+        output = os.path.join(tmp_path, 'dashboard.png')
+
+        success = benchmark.pedantic(weather_dashboard.create_weather_dashboard,
+                                     args=(route_points, weather_data, output, length_km),
+                                     kwargs={'dpi': dpi}, rounds=3, iterations=1)
+        assert success
@@ -1,30 +1,54 @@
 import os
 import re
+import sys
 import json
-import subprocess
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+import functools
+from telegram import Update, Message, InputMediaPhoto, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler
 )
 import logging
 import asyncio
 import glob
-import gpxpy
-import gpxpy.gpx
+import time
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import pytz
 load_dotenv()
-
-# Включаем логирование
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
+from file_id_cache import FileIdCache, read_file_bytes, send_file_cached
+from update_processor import PerChatUpdateProcessor
+from executors import run_blocking, shutdown_executor
+from loop_monitor import LoopLagMonitor
+from metrics import (
+    REGISTRY, EXTERNAL_ERRORS, InstrumentedRequest, MetricsServer, instrument_application, observe_external,
+    track_external
 )
+from tracing import conversation_trace_id, span, trace_env, traced_handler
+from profiler import ProfileController, format_collapsed, top_functions
+from memory_diagnostics import MemorySnapshots, format_memory_report
+from update_recorder import UpdateRecorder
+from webhook import WEBHOOK_URL, run_webhook
+from shared_store import open_store
+from persistence import StorePersistence
+from sessions import CONVERSATION_STATE_TIMEOUTS, SessionManager, parse_state_timeouts, session_key
+from supervisor import PROCESS_OWNER, kill_owned, run_process, run_process_sync
+from weather_summary import format_weather_summary, is_weather_complete, load_weather_data, summarize_weather
+
 logger = logging.getLogger(__name__)
 
 # Состояния для ConversationHandler
 ASK_DATE, ASK_TIME, ASK_KOMOOT_LINK, PROCESS_GPX, ASK_ROUTE_NAME, ASK_START_POINT, ASK_START_LINK, ASK_FINISH_POINT, ASK_FINISH_LINK, ASK_PACE, ASK_COMMENT, ASK_IMAGE, PREVIEW_STEP, SELECT_ROUTE, ASK_MANUAL_ROUTE = range(15)
 
+# Состояния по именам - для настроек вроде CONVERSATION_STATE_TIMEOUTS
+STATES_BY_NAME = {
+    'ASK_DATE': ASK_DATE, 'ASK_TIME': ASK_TIME, 'ASK_KOMOOT_LINK': ASK_KOMOOT_LINK, 'PROCESS_GPX': PROCESS_GPX,
+    'ASK_ROUTE_NAME': ASK_ROUTE_NAME, 'ASK_START_POINT': ASK_START_POINT, 'ASK_START_LINK': ASK_START_LINK,
+    'ASK_FINISH_POINT': ASK_FINISH_POINT, 'ASK_FINISH_LINK': ASK_FINISH_LINK, 'ASK_PACE': ASK_PACE,
+    'ASK_COMMENT': ASK_COMMENT, 'ASK_IMAGE': ASK_IMAGE, 'PREVIEW_STEP': PREVIEW_STEP, 'SELECT_ROUTE': SELECT_ROUTE,
+    'ASK_MANUAL_ROUTE': ASK_MANUAL_ROUTE,
+}
+
 STEP_TO_NAME = {
     ASK_DATE: '📅 Изм. дату',
     ASK_TIME: '⏰ Изм. время',
@@ -38,12 +62,96 @@ STEP_TO_NAME = {
 }
 
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN', 'YOUR_TELEGRAM_BOT_TOKEN')
+# Адрес сервера Bot API без /bot<токен> (пусто - api.telegram.org)
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', '').rstrip('/')
 TIMEZONE = os.getenv('TIMEZONE', 'Europe/Belgrade')
+# Сколько апдейтов разных чатов обрабатывается одновременно
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+# Номер процесса бота за dispatcher.py; фоновое обслуживание кэша выполняет только нулевой
+WORKER_ID = int(os.getenv('WORKER_ID', '0'))
+
+# Telegram ID администраторов через запятую (для /profile и /memory)
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
+
+# Профилирование по умолчанию: следующие N апдейтов или T секунд, но не дольше PROFILE_MAX_SECONDS
+PROFILE_DEFAULT_UPDATES = 20
+PROFILE_DEFAULT_SECONDS = 60
+PROFILE_MAX_SECONDS = 600
 
 # Паттерн для извлечения tour_id из Komoot-ссылки
 KOMOOT_LINK_PATTERN = re.compile(r'(https?://)?(www\.)?komoot\.[^/]+/tour/(\d+)')
 CACHE_DIR = 'cache'
-os.makedirs(CACHE_DIR, exist_ok=True)
+# Адрес Komoot API вместо https://api.komoot.de (пусто - настоящий Komoot)
+KOMOOT_BASE_URL = os.getenv('KOMOOT_BASE_URL', '').rstrip('/')
+KOMOOT_API_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'komoot_api.py')
+
+# Разрешение дашборда: быстрый предпросмотр и полное качество для публикации
+DASHBOARD_PREVIEW_DPI = int(os.getenv('DASHBOARD_PREVIEW_DPI', '60'))
+DASHBOARD_FULL_DPI = int(os.getenv('DASHBOARD_FULL_DPI', '150'))
+# За сколько секунд получить погоду и нарисовать дашборд; точки без прогноза к этому
+# времени рисуются как пропуски
+DASHBOARD_DEADLINE = float(os.getenv('DASHBOARD_DEADLINE', '90'))
+# Запас сверх дедлайна на запуск интерпретатора и импорт matplotlib, с
+DASHBOARD_DEADLINE_GRACE = 15.0
+# Сколько секунд сохраненные данные о погоде считаются свежими (как кэш запросов Open-Meteo)
+WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', '3600'))
+
+# Дашборды, которые рисуются в фоне после сводки погоды: ключ сессии -> задача отрисовки
+DASHBOARD_RENDERS = {}
+# Сводки погоды текстом, прогноз для которых получается в фоне: ключ сессии -> задача
+WEATHER_CAPTIONS = {}
+
+# Погода для дашборда заранее, как только известны маршрут и время старта: off - не получать,
+# weather - только прогноз, dashboard - прогноз и предпросмотр дашборда
+WEATHER_PREFETCH = os.getenv('WEATHER_PREFETCH', 'weather')
+WEATHER_PREFETCH_MODES = ('off', 'weather', 'dashboard')
+# Сколько раз за WEATHER_PREFETCH_WINDOW секунд получать погоду заранее для одного организатора
+WEATHER_PREFETCH_BUDGET = int(os.getenv('WEATHER_PREFETCH_BUDGET', '5'))
+WEATHER_PREFETCH_WINDOW = 3600.0
+# Погода, которая получается заранее: ключ сессии -> (JSON с погодой, задача)
+WEATHER_PREFETCHES = {}
+# Когда организатору получали погоду заранее: user_id -> список time.monotonic()
+WEATHER_PREFETCH_HISTORY = {}
+WEATHER_PREFETCH_RESULTS = REGISTRY.counter(
+    'announce_bot_weather_prefetch_total', 'Заблаговременное получение погоды по результату', ('result',))
+
+# Фоновая задача обслуживания кэша после старта (см. startup_maintenance)
+STARTUP_TASK = None
+
+# Следит за задержкой event loop и сообщает, какой обработчик его блокирует
+LOOP_MONITOR = LoopLagMonitor()
+
+REGISTRY.gauge('announce_bot_event_loop_lag_seconds', 'Последняя измеренная задержка event loop',
+               function=lambda: LOOP_MONITOR.last_lag)
+REGISTRY.gauge('announce_bot_event_loop_max_lag_seconds', 'Максимальная задержка event loop',
+               function=lambda: LOOP_MONITOR.max_lag)
+REGISTRY.gauge('announce_bot_event_loop_stalls', 'Сколько раз обработчики блокировали event loop',
+               function=lambda: LOOP_MONITOR.stalls)
+
+# Кнопки и команды, после которых начатое разговором скачивание или отрисовка больше не нужны
+INTERRUPT_TEXTS = {'❌ Отмена'}
+INTERRUPT_COMMANDS = {'/start', '/quick', '/restart'}
+
+# Брошенные разговоры завершаются, их задачи отменяются (см. sessions.py)
+SESSIONS = SessionManager(state_timeouts=parse_state_timeouts(CONVERSATION_STATE_TIMEOUTS, STATES_BY_NAME))
+
+REGISTRY.gauge('announce_bot_sessions_live', 'Незавершенные разговоры', function=lambda: SESSIONS.live)
+REGISTRY.gauge('announce_bot_sessions_expired', 'Разговоры, завершенные по неактивности',
+               function=lambda: SESSIONS.expired)
+
+# Профилирование по команде /profile
+PROFILER = ProfileController()
+# Запись входящих апдейтов для воспроизведения (включается UPDATE_RECORD_FILE)
+UPDATE_RECORDER = UpdateRecorder()
+
+# Снимки tracemalloc для команды /memory
+MEMORY_SNAPSHOTS = MemorySnapshots()
+
+# Локальный HTTP-сервер с метриками (включается переменной METRICS_PORT)
+METRICS_SERVER = MetricsServer()
+
+# file_id уже загруженных в Telegram дашбордов и GPX, чтобы не загружать их повторно
+FILE_ID_CACHE = FileIdCache(os.path.join(CACHE_DIR, 'file_ids.json'), TELEGRAM_TOKEN)
 
 def load_points_from_file(filename, fallback_points=None):
     """Загружает точки из JSON файла
@@ -114,9 +222,10 @@ def load_finish_points():
     """Загружает точки финиша из JSON файла"""
     return load_points_from_file("finish_points.json")
 
-# Загружаем точки старта и финиша при импорте модуля
-START_POINTS = load_start_points()
-FINISH_POINTS = load_finish_points()
+# Точки старта и финиша, готовые маршруты и ссылки загружаются из файлов в load_config(),
+# до этого действуют точки по умолчанию
+START_POINTS = get_default_points()
+FINISH_POINTS = get_default_points()
 
 # Предустановленные точки старта (заполнишь потом)
 # START_POINTS = [
@@ -177,6 +286,20 @@ def extract_route_name_from_gpx(gpx_path: str) -> str:
         logger.error(f"Ошибка при извлечении названия из GPX: {e}")
         return ""
 
+def analyze_gpx(gpx_path: str) -> tuple[float, float, str]:
+    """Возвращает длину маршрута в км, набор высоты в метрах и название из GPX файла"""
+    # gpxpy нужен только для разбора маршрута, поэтому импортируется при первом вызове
+    import gpxpy
+
+    with span('gpx.analyze') as analyze_span:
+        with open(gpx_path, 'r') as f:
+            gpx = gpxpy.parse(f)
+        length_km = gpx.length_2d() / 1000
+        uphill = gpx.get_uphill_downhill()[0]
+        analyze_span.set('points', gpx.get_track_points_no())
+        analyze_span.set('length_km', round(length_km, 1))
+        return length_km, uphill, extract_route_name_from_gpx(gpx_path)
+
 def parse_date_time(date_time_str: str) -> tuple[datetime, str]:
     """
     Парсит строку даты и времени, возвращает (datetime, error_message)
@@ -241,8 +364,7 @@ def load_ready_routes():
         logger.error(f"Неожиданная ошибка при загрузке готовых маршрутов: {e}")
         return []
 
-# Загружаем готовые маршруты при импорте модуля
-READY_ROUTES = load_ready_routes()
+READY_ROUTES = []
 
 def load_route_comments():
     """Загружает готовые ссылки на маршруты из JSON файла"""
@@ -262,8 +384,19 @@ def load_route_comments():
         logger.error(f"Неожиданная ошибка при загрузке готовых ссылок: {e}")
         return []
 
-# Загружаем готовые ссылки на маршруты при импорте модуля
-ROUTE_COMMENTS = load_route_comments()
+ROUTE_COMMENTS = []
+
+def load_config():
+    """Загружает точки и маршруты из JSON файлов рабочей папки
+
+    Вызывается при создании приложения, а не при импорте модуля, чтобы
+    импорт bot не читал файлы и не писал в лог.
+    """
+    global START_POINTS, FINISH_POINTS, READY_ROUTES, ROUTE_COMMENTS
+    START_POINTS = load_start_points()
+    FINISH_POINTS = load_finish_points()
+    READY_ROUTES = load_ready_routes()
+    ROUTE_COMMENTS = load_route_comments()
 
 async def quick_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для быстрого создания анонса из готового маршрута"""
@@ -363,6 +496,7 @@ async def handle_route_selection(update: Update, context: ContextTypes.DEFAULT_T
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Очищаем все данные пользователя перед началом новой сессии
     context.user_data.clear()
+    logger.info(f"Новый анонс, trace_id: {conversation_trace_id(context.user_data)}")
     
     # Проверяем, есть ли готовый маршрут в команде
     command_args = update.message.text.split()
@@ -439,6 +573,7 @@ async def ask_date_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     context.user_data['date_time'] = date_time_str
     context.user_data['parsed_datetime'] = dt  # Сохраняем распарсенную дату
+    schedule_weather_prefetch(update, context)
 
     # Проверяем быстрый режим
     if context.user_data.get('quick_mode'):
@@ -738,6 +873,7 @@ async def handle_time_selection(update: Update, context: ContextTypes.DEFAULT_TY
     date_time_str = selected_datetime.strftime('%d.%m %H:%M')
     context.user_data['date_time'] = date_time_str
     context.user_data['parsed_datetime'] = selected_datetime
+    schedule_weather_prefetch(update, context)
 
     # Проверяем быстрый режим
     if context.user_data.get('quick_mode'):
@@ -865,39 +1001,34 @@ async def ask_komoot_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Переходим к обработке GPX
     return await process_gpx(update, context)
 
+def komootgpx_command(tour_id):
+    """Команда скачивания GPX тура в кэш; с KOMOOT_BASE_URL komootgpx запускается через komoot_api.py"""
+    args = ['-d', str(tour_id), '-o', CACHE_DIR, '-e', '-n']
+    if KOMOOT_BASE_URL:
+        return [sys.executable, KOMOOT_API_SCRIPT, *args]
+    return ['komootgpx', *args]
+
+@traced_handler
 async def process_gpx(update: Update, context: ContextTypes.DEFAULT_TYPE):
     tour_id = context.user_data['tour_id']
     logger.info(f"Начинаю скачивание GPX для tour_id: {tour_id}")
     
     try:
-        # Используем асинхронный subprocess
-        process = await asyncio.create_subprocess_exec(
-            'komootgpx',
-            '-d', tour_id,
-            '-o', CACHE_DIR,
-            '-e',
-            '-n',
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        logger.info(f"Процесс komootgpx запущен с PID: {process.pid}")
-        
-        # Ждем завершения с таймаутом
-        try:
-            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=60.0)
-            logger.info(f"Процесс komootgpx завершен с кодом: {process.returncode}")
-        except asyncio.TimeoutError:
-            # Если процесс завис, убиваем его
-            logger.warning(f"Процесс komootgpx завис, убиваю PID: {process.pid}")
-            process.kill()
+        # Процесс убивается вместе с группой по таймауту и при отмене разговора
+        with track_external('komootgpx'), span('gpx.download', tour_id=tour_id) as download_span:
+            result = await run_process(komootgpx_command(tour_id), 'komootgpx', timeout=60.0)
+            download_span.set('returncode', result.returncode)
+        logger.info(f"Процесс komootgpx завершен с кодом: {result.returncode}")
+        if result.timed_out:
             await update.message.reply_text('Превышено время ожидания при скачивании GPX. Попробуй другую ссылку на маршрут Komoot:')
             return ASK_KOMOOT_LINK
             
-        if process.returncode != 0:
-            error_msg = stderr.decode() if stderr else "Неизвестная ошибка"
+        if result.returncode != 0:
+            EXTERNAL_ERRORS.inc(call='komootgpx')
+            error_msg = result.stderr or "Неизвестная ошибка"
             logger.error(f"Ошибка komootgpx: {error_msg}")
-            await update.message.reply_text(f'Ошибка при скачивании GPX: {error_msg}. Попробуй другую ссылку на маршрут Komoot:')
+            # Пользователю - только конец вывода, сообщение Telegram ограничено 4096 символами
+            await update.message.reply_text(f'Ошибка при скачивании GPX: {error_msg[-1000:]}. Попробуй другую ссылку на маршрут Komoot:')
             return ASK_KOMOOT_LINK
             
     except Exception as e:
@@ -906,7 +1037,7 @@ async def process_gpx(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ASK_KOMOOT_LINK
         
     # Проверяем, что файл действительно скачался
-    gpx_files = glob.glob(f"{CACHE_DIR}/*-{tour_id}.gpx")
+    gpx_files = await run_blocking(glob.glob, f"{CACHE_DIR}/*-{tour_id}.gpx")
     if not gpx_files:
         logger.warning(f"GPX файл не найден для tour_id: {tour_id}")
         await update.message.reply_text('GPX-файл не найден. Попробуй другую ссылку на маршрут Komoot:')
@@ -917,16 +1048,13 @@ async def process_gpx(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['gpx_path'] = gpx_path
     
     try:
-        with open(gpx_path, 'r') as f:
-            gpx = gpxpy.parse(f)
-        length_km = gpx.length_2d() / 1000
-        uphill = gpx.get_uphill_downhill()[0]
+        # Парсинг GPX занимает заметное время на длинных треках - выполняем вне event loop
+        length_km, uphill, extracted_name = await run_blocking(analyze_gpx, gpx_path)
         context.user_data['length_km'] = round(length_km)
         context.user_data['uphill'] = round(uphill)
         logger.info(f"GPX обработан: длина {length_km} км, набор {uphill} м")
 
         # Автоматически извлекаем название из GPX
-        extracted_name = extract_route_name_from_gpx(gpx_path)
         if extracted_name:
             context.user_data['extracted_name'] = extracted_name
             logger.info(f"Извлечено название из GPX: {extracted_name}")
@@ -939,6 +1067,9 @@ async def process_gpx(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text('Ошибка при обработке GPX-файла. Попробуй другую ссылку на маршрут Komoot:')
         return ASK_KOMOOT_LINK
 
+    # Маршрут и время старта известны - погода для дашборда получается, пока организатор заполняет анонс
+    schedule_weather_prefetch(update, context)
+
     # Создаем клавиатуру для выбора названия
     extracted_name = context.user_data.get('extracted_name')
 
@@ -1259,10 +1390,11 @@ async def ask_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Вы можете:\n"
             "• Прислать свою картинку\n"
             "• Сгенерировать <b>дашборд погоды</b> для маршрута\n"
+            "• Добавить к тексту короткую <b>сводку погоды</b>\n"
             "• Или пропустить этот шаг",
             parse_mode='HTML',
             reply_markup=ReplyKeyboardMarkup([
-                ["🌤️ Сгенерировать дашборд погоды (BETA)"],
+                ["🌤️ Сгенерировать дашборд погоды (BETA)", "📝 Сводка погоды текстом"],
                 ["📷 Прислать картинку"],
                 ["⏭️ Пропустить"],
                 ["❌ Отмена"]
@@ -1270,6 +1402,7 @@ async def ask_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     return ASK_IMAGE
 
+@traced_handler
 async def ask_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает выбор или изменение картинки для анонса"""
     # Проверяем, пришло ли фото
@@ -1277,6 +1410,8 @@ async def ask_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Получаем самое большое фото
         photo = update.message.photo[-1]
         context.user_data['announce_image'] = photo.file_id
+        # Своя картинка вместо дашборда - погода заранее больше не нужна
+        cancel_weather_prefetch(session_key(update))
 
         await update.message.reply_text(
             "✅ <b>Картинка добавлена к анонсу!</b>",
@@ -1307,44 +1442,10 @@ async def ask_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     if text == "🌤️ Сгенерировать дашборд погоды (BETA)":
-        # Генерируем дашборд погоды
-        gpx_path = context.user_data.get('gpx_path')
-        parsed_datetime = context.user_data.get('parsed_datetime')
-
-        if not gpx_path or not parsed_datetime:
-            await update.message.reply_text(
-                "❌ <b>Ошибка:</b> Не найден GPX файл или время старта",
-                parse_mode='HTML'
-            )
-            return await preview_step(update, context)
-
-        await update.message.reply_text(
-            "🌤️ <b>Генерирую дашборд погоды...</b>\n\n"
-            "Это может занять 1-2 минуты ⏳",
-            parse_mode='HTML'
-        )
-
-        # Генерируем дашборд
-        dashboard_path = f"dashboard_{context.user_data.get('tour_id', 'temp')}.png"
-        success = generate_weather_dashboard(gpx_path, parsed_datetime, dashboard_path)
-
-        if success:
-            # Сохраняем путь к дашборду
-            context.user_data['dashboard_path'] = dashboard_path
-            await update.message.reply_text(
-                "✅ <b>Дашборд погоды успешно сгенерирован!</b>\n\n"
-                "Он будет использован в анонсе вместо обычной картинки.",
-                parse_mode='HTML'
-            )
-        else:
-            await update.message.reply_text(
-                "❌ <b>Не удалось сгенерировать дашборд погоды</b>\n\n"
-                "Возможно, проблемы с интернетом или данными.\n"
-                "Продолжаем без дашборда.",
-                parse_mode='HTML'
-            )
+        return await generate_dashboard(update, context)
 
-        return await preview_step(update, context)
+    if text == "📝 Сводка погоды текстом":
+        return await add_weather_caption(update, context)
 
     if text == "📷 Прислать картинку":
         await update.message.reply_text(
@@ -1359,7 +1460,8 @@ async def ask_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ASK_IMAGE
 
     if text == "⏭️ Пропустить":
-        # Пропускаем добавление картинки, переходим к предпросмотру
+        # Пропускаем добавление картинки и дашборда, переходим к предпросмотру
+        cancel_weather_prefetch(session_key(update))
         return await preview_step(update, context)
 
     if text == "🗑️ Удалить картинку":
@@ -1419,9 +1521,17 @@ async def ask_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     return ASK_IMAGE
 
+@traced_handler
 async def preview_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await send_preview(context.bot, update.message.chat_id, context.user_data)
+
+async def send_preview(bot, chat_id, user_data):
+    """Показывает предпросмотр анонса с кнопками; возвращает следующее состояние разговора
+
+    Вызывается и вне обработчиков - когда в фоне дорисован дашборд.
+    """
     # Формируем анонс
-    date_time_str = context.user_data.get('date_time', '-')
+    date_time_str = user_data.get('date_time', '-')
     dt, error_msg = parse_date_time(date_time_str)
     if dt:
         weekday = RU_WEEKDAYS[dt.weekday()]
@@ -1434,26 +1544,26 @@ async def preview_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
         date_part = date_time_str
         time_part = ''
         if error_msg:
-            await update.message.reply_text(error_msg, parse_mode='HTML')
+            await bot.send_message(chat_id, error_msg, parse_mode='HTML')
             return ASK_DATE # Вернуться к запросу даты
-    komoot_link = context.user_data.get('komoot_link', '-')
-    route_name = context.user_data.get('route_name', '-')
-    start_point_name = context.user_data.get('start_point_name', '-')
-    start_point_link = context.user_data.get('start_point_link', '-')
-    finish_point_name = context.user_data.get('finish_point_name')
-    finish_point_link = context.user_data.get('finish_point_link')
-    length_km = context.user_data.get('length_km', '-')
-    uphill = context.user_data.get('uphill', '-')
-    pace = context.user_data.get('pace', '-')
-    comment = context.user_data.get('comment', '-')
-    gpx_path = context.user_data.get('gpx_path', None)
+    komoot_link = user_data.get('komoot_link', '-')
+    route_name = user_data.get('route_name', '-')
+    start_point_name = user_data.get('start_point_name', '-')
+    start_point_link = user_data.get('start_point_link', '-')
+    finish_point_name = user_data.get('finish_point_name')
+    finish_point_link = user_data.get('finish_point_link')
+    length_km = user_data.get('length_km', '-')
+    uphill = user_data.get('uphill', '-')
+    pace = user_data.get('pace', '-')
+    comment = user_data.get('comment', '-')
+    gpx_path = user_data.get('gpx_path', None)
     pace_emoji = pace.split(' ')[0] if pace else '-'
     # Формируем текст анонса
-    no_track = context.user_data.get('no_track', False)
+    no_track = user_data.get('no_track', False)
     
     if no_track:
         # Для маршрутов без трека используем ручное описание
-        manual_description = context.user_data.get('manual_route_description', 'Маршрут без трека')
+        manual_description = user_data.get('manual_route_description', 'Маршрут без трека')
         announce_lines = [
             f"<b>{weekday}, {date_part}, {time_of_day} ({time_part})</b>",
             f"Маршрут: {manual_description}",
@@ -1475,8 +1585,12 @@ async def preview_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif finish_point_name:
         announce_lines.append(f"Финиш: {finish_point_name}")
 
+    announce_lines.append(f"Ожидаемый темп: {pace_emoji}")
+    # Сводка погоды текстом, если организатор ее добавил
+    weather_caption = user_data.get('weather_caption')
+    if weather_caption:
+        announce_lines.extend(["", weather_caption])
     announce_lines.extend([
-        f"Ожидаемый темп: {pace_emoji}",
         "",
         comment,
         "",
@@ -1488,9 +1602,9 @@ async def preview_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
     buttons = [["✅ Отправить"]]
 
     # Добавляем кнопки для управления картинкой или дашбордом (только если есть трек)
-    announce_image = context.user_data.get('announce_image')
-    dashboard_path = context.user_data.get('dashboard_path')
-    no_track = context.user_data.get('no_track', False)
+    announce_image = user_data.get('announce_image')
+    dashboard_path = user_data.get('dashboard_path')
+    no_track = user_data.get('no_track', False)
 
     if no_track:
         # Для маршрутов без трека показываем только картинку
@@ -1499,47 +1613,435 @@ async def preview_step(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             buttons.append(["📷 Добавить картинку"])
     else:
-        # Для маршрутов с треком показываем все опции
+        # Для маршрутов с треком показываем все опции; сводка погоды текстом - рядом с дашбордом
+        weather_button = "🗑️ Убрать сводку погоды" if user_data.get('weather_caption') else "📝 Сводка погоды текстом"
         if announce_image:
             buttons.append(["🗑️ Удалить картинку"])
+            buttons.append([weather_button])
         elif dashboard_path and os.path.exists(dashboard_path):
             buttons.append(["🗑️ Удалить дашборд"])
             buttons.append(["📷 Заменить картинкой"])
+            buttons.append([weather_button])
         else:
             buttons.append(["📷 Добавить картинку"])
-            buttons.append(["🌤️ Сгенерировать дашборд (BETA)"])
+            buttons.append(["🌤️ Сгенерировать дашборд (BETA)", weather_button])
 
     for step, name in STEP_TO_NAME.items():
         buttons.append([name])
 
     # Проверяем, есть ли картинка или дашборд для анонса
-    dashboard_path = context.user_data.get('dashboard_path')
+    dashboard_path = user_data.get('dashboard_path')
+    if not (dashboard_path and os.path.exists(dashboard_path)):
+        dashboard_path = None
+    caption = announce + '\n\nВсё верно?'
+    reply_markup = ReplyKeyboardMarkup(buttons, one_time_keyboard=True, resize_keyboard=True)
+
+    # Если предпросмотр уже показан, обновляем его на месте, а клавиатуру присылаем коротким сообщением
+    changed = await update_preview_message(
+        bot, chat_id, user_data, caption, announce_image, dashboard_path
+    )
+    if changed is not None:
+        await bot.send_message(
+            chat_id,
+            '👆 Предпросмотр обновлен. Всё верно?' if changed else '👆 Всё верно?',
+            reply_markup=reply_markup
+        )
+        return PREVIEW_STEP
+
     if announce_image:
         # Отправляем картинку с caption
-        await update.message.reply_photo(
+        message = await bot.send_photo(
+            chat_id,
             photo=announce_image,
-            caption=announce + '\n\nВсё верно?',
+            caption=caption,
             parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup(buttons, one_time_keyboard=True, resize_keyboard=True)
+            reply_markup=reply_markup
         )
-    elif dashboard_path and os.path.exists(dashboard_path):
+    elif dashboard_path:
         # Отправляем дашборд погоды как картинку
-        await update.message.reply_photo(
-            photo=open(dashboard_path, 'rb'),
-            caption=announce + '\n\nВсё верно?',
+        message = await send_file_cached(
+            FILE_ID_CACHE, functools.partial(bot.send_photo, chat_id), dashboard_path,
+            caption=caption,
             parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup(buttons, one_time_keyboard=True, resize_keyboard=True)
+            reply_markup=reply_markup
         )
     else:
         # Отправляем обычное текстовое сообщение
-        await update.message.reply_text(
-            announce + '\n\nВсё верно?',
+        message = await bot.send_message(
+            chat_id,
+            caption,
             parse_mode='HTML',
-            reply_markup=ReplyKeyboardMarkup(buttons, one_time_keyboard=True, resize_keyboard=True),
+            reply_markup=reply_markup,
             disable_web_page_preview=True
         )
+    remember_preview_message(
+        user_data, message, caption, await preview_media_key(announce_image, dashboard_path)
+    )
     return PREVIEW_STEP
 
+async def preview_media_key(announce_image, dashboard_path):
+    """Возвращает ключ картинки предпросмотра, чтобы понять, изменилась ли она"""
+    if announce_image:
+        return f"image:{announce_image}"
+    if dashboard_path:
+        return f"dashboard:{await run_blocking(FILE_ID_CACHE.content_hash, dashboard_path)}"
+    return None
+
+def remember_preview_message(user_data, message, caption, media_key):
+    """Запоминает отправленный предпросмотр, чтобы потом редактировать его на месте"""
+    if message is None:
+        return
+    user_data['preview_message_id'] = message.message_id
+    user_data['preview_caption'] = caption
+    user_data['preview_media'] = media_key
+
+def forget_preview_message(user_data):
+    """Забывает предпросмотр - следующий будет отправлен новым сообщением"""
+    for key in ('preview_message_id', 'preview_caption', 'preview_media'):
+        user_data.pop(key, None)
+
+async def update_preview_message(bot, chat_id, user_data, caption, announce_image, dashboard_path):
+    """Обновляет уже отправленный предпросмотр на месте, меняя только то, что изменилось
+
+    Возвращает True, если сообщение отредактировано, False, если менять было нечего,
+    и None, если предпросмотр нужно отправить заново (его еще нет, картинка
+    появилась или пропала, или Telegram не дал отредактировать сообщение).
+    """
+    message_id = user_data.get('preview_message_id')
+    if not message_id:
+        return None
+
+    media_key = await preview_media_key(announce_image, dashboard_path)
+    old_media_key = user_data.get('preview_media')
+    if (media_key is None) != (old_media_key is None):
+        # Текстовое сообщение нельзя превратить в фото и наоборот - заменяем его новым
+        try:
+            await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except TelegramError as e:
+            logger.info(f"Не удалось удалить старый предпросмотр {message_id}: {e}")
+        forget_preview_message(user_data)
+        return None
+
+    try:
+        if media_key != old_media_key:
+            if announce_image:
+                media = InputMediaPhoto(media=announce_image, caption=caption, parse_mode='HTML')
+                await bot.edit_message_media(chat_id=chat_id, message_id=message_id, media=media)
+            else:
+                content_hash, file_id = await run_blocking(FILE_ID_CACHE.lookup, dashboard_path)
+                photo = file_id or await run_blocking(read_file_bytes, dashboard_path)
+                media = InputMediaPhoto(media=photo, caption=caption, parse_mode='HTML')
+                message = await bot.edit_message_media(chat_id=chat_id, message_id=message_id, media=media)
+                if not file_id and isinstance(message, Message) and message.photo:
+                    await run_blocking(FILE_ID_CACHE.set, content_hash, message.photo[-1].file_id)
+        elif caption != user_data.get('preview_caption'):
+            if media_key:
+                await bot.edit_message_caption(
+                    chat_id=chat_id, message_id=message_id, caption=caption, parse_mode='HTML'
+                )
+            else:
+                await bot.edit_message_text(
+                    caption, chat_id=chat_id, message_id=message_id, parse_mode='HTML',
+                    disable_web_page_preview=True
+                )
+        else:
+            return False
+    except BadRequest as e:
+        if 'not modified' in str(e).lower():
+            return False
+        logger.info(f"Не удалось отредактировать предпросмотр {message_id}: {e}")
+        forget_preview_message(user_data)
+        return None
+
+    user_data['preview_caption'] = caption
+    user_data['preview_media'] = media_key
+    return True
+
+async def generate_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Дашборд погоды по шагам: сводка - как только получена погода, картинка - когда дорисуется
+
+    Дашборд рисуется в фоне, а предпросмотр с ним приходит сам; организатор
+    тем временем может продолжать.
+    """
+    gpx_path = context.user_data.get('gpx_path')
+    parsed_datetime = context.user_data.get('parsed_datetime')
+
+    if not gpx_path or not parsed_datetime:
+        await update.message.reply_text(
+            "❌ <b>Ошибка:</b> Не найден GPX файл или время старта",
+            parse_mode='HTML'
+        )
+        return await preview_step(update, context)
+
+    key = session_key(update)
+    if key in DASHBOARD_RENDERS:
+        await update.message.reply_text(
+            "⏳ <b>Дашборд уже рисуется</b>\n\nПредпросмотр обновится, когда он будет готов.",
+            parse_mode='HTML'
+        )
+        return await preview_step(update, context)
+
+    await update.message.reply_text("🌤️ <b>Получаю прогноз погоды...</b>", parse_mode='HTML')
+    # Обычно погода уже получена заранее, пока организатор заполнял анонс
+    await wait_weather_prefetch(key)
+    summary = await run_blocking(fetch_preview_weather, context.user_data, key[-1])
+    if summary is None:
+        await update.message.reply_text(
+            "❌ <b>Не удалось сгенерировать дашборд погоды</b>\n\n"
+            "Возможно, проблемы с интернетом или данными.\n"
+            "Продолжаем без дашборда.",
+            parse_mode='HTML'
+        )
+        return await preview_step(update, context)
+
+    await update.message.reply_text(
+        f"🌤️ <b>Погода на маршруте</b>\n\n{format_weather_summary(summary)}\n\n"
+        "🖼 Рисую дашборд - предпросмотр обновится, когда он будет готов",
+        parse_mode='HTML'
+    )
+    start_dashboard_render(context.application, update.effective_chat.id, key, context.user_data)
+    return await preview_step(update, context)
+
+async def add_weather_caption(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Добавляет сводку погоды к тексту анонса - без картинки и отрисовки дашборда
+
+    Если свежая погода уже получена (обычно заранее), сводка добавляется
+    сразу. Иначе прогноз получается в фоне, а сводка появляется в
+    предпросмотре, когда он придет: организатор не ждет Open-Meteo.
+    """
+    if not context.user_data.get('gpx_path') or not context.user_data.get('parsed_datetime'):
+        await update.message.reply_text(
+            "❌ <b>Ошибка:</b> Не найден GPX файл или время старта",
+            parse_mode='HTML'
+        )
+        return await preview_step(update, context)
+
+    key = session_key(update)
+    if key in WEATHER_CAPTIONS:
+        await update.message.reply_text(
+            "⏳ <b>Прогноз погоды уже получается</b>\n\nСводка появится в предпросмотре.",
+            parse_mode='HTML'
+        )
+        return await preview_step(update, context)
+
+    summary = await run_blocking(cached_preview_weather, context.user_data, key[-1])
+    if summary is not None:
+        context.user_data['weather_caption'] = format_weather_summary(summary)
+        return await preview_step(update, context)
+
+    await update.message.reply_text(
+        "🌤️ <b>Получаю прогноз погоды...</b>\n\nСводка появится в предпросмотре, когда он придет",
+        parse_mode='HTML'
+    )
+    start_weather_caption(context.application, update.effective_chat.id, key, context.user_data)
+    return await preview_step(update, context)
+
+def start_weather_caption(application, chat_id, key, user_data):
+    """Получает погоду для сводки в фоне; задача принадлежит сессии и отменяется вместе с ней"""
+    task = asyncio.ensure_future(deliver_weather_caption(application, chat_id, key, user_data))
+    WEATHER_CAPTIONS[key] = task
+
+    def forget(done):
+        if WEATHER_CAPTIONS.get(key) is done:
+            del WEATHER_CAPTIONS[key]
+
+    task.add_done_callback(forget)
+    return SESSIONS.track(key, task)
+
+async def deliver_weather_caption(application, chat_id, key, user_data):
+    """Дожидается прогноза и добавляет сводку погоды в предпросмотр"""
+    # Погода, которая уже получается заранее, второй раз не запрашивается
+    await wait_weather_prefetch(key)
+    try:
+        summary = await run_blocking(fetch_preview_weather, user_data, key[-1])
+    except Exception as e:
+        logger.error(f"Ошибка при получении погоды для сводки: {e}")
+        summary = None
+    # Ждем конца текущего шага разговора, чтобы не отвечать посреди него
+    async with application.update_processor.chat_turn(chat_id):
+        state = SESSIONS.state(key)
+        if state is None:
+            # Анонс уже отправлен или разговор сброшен
+            return
+        if summary is None:
+            await application.bot.send_message(
+                chat_id,
+                "❌ <b>Не удалось получить прогноз погоды</b>\n\n"
+                "Возможно, проблемы с интернетом или данными.\n"
+                "Продолжаем без сводки погоды.",
+                parse_mode='HTML'
+            )
+            return
+        user_data['weather_caption'] = format_weather_summary(summary)
+        if state == PREVIEW_STEP:
+            await send_preview(application.bot, chat_id, user_data)
+        else:
+            await application.bot.send_message(
+                chat_id,
+                "📝 <b>Сводка погоды готова</b> - она появится в предпросмотре",
+                parse_mode='HTML'
+            )
+    application.mark_data_for_update_persistence(user_ids=key[-1])
+
+def cancel_weather_caption(key):
+    """Отменяет получение погоды для сводки - организатор передумал"""
+    task = WEATHER_CAPTIONS.pop(key, None)
+    if task is not None and not task.done():
+        task.cancel()
+
+def start_dashboard_render(application, chat_id, key, user_data):
+    """Запускает отрисовку дашборда в фоне; задачи принадлежат сессии и отменяются вместе с ней"""
+    # Быстрый дашборд для предпросмотра, полное качество - при отправке
+    render = asyncio.ensure_future(run_blocking(generate_preview_dashboard, user_data, key[-1]))
+    DASHBOARD_RENDERS[key] = render
+
+    def forget(done):
+        if DASHBOARD_RENDERS.get(key) is done:
+            del DASHBOARD_RENDERS[key]
+
+    render.add_done_callback(forget)
+    SESSIONS.track(key, render)
+    SESSIONS.track(key, asyncio.create_task(deliver_dashboard(application, chat_id, key, user_data, render)))
+
+async def deliver_dashboard(application, chat_id, key, user_data, render):
+    """Дожидается фоновой отрисовки и показывает дашборд в предпросмотре"""
+    try:
+        dashboard_path = await render
+    except Exception as e:
+        logger.error(f"Ошибка при отрисовке дашборда: {e}")
+        dashboard_path = None
+    # Ждем конца текущего шага разговора, чтобы не отвечать посреди него
+    async with application.update_processor.chat_turn(chat_id):
+        state = SESSIONS.state(key)
+        if state is None:
+            # Анонс уже отправлен или разговор сброшен
+            return
+        if not dashboard_path:
+            await application.bot.send_message(
+                chat_id,
+                "❌ <b>Не удалось нарисовать дашборд погоды</b>\n\nАнонс останется без него.",
+                parse_mode='HTML'
+            )
+        elif state == PREVIEW_STEP:
+            await application.bot.send_message(chat_id, "🖼 <b>Дашборд погоды готов</b>", parse_mode='HTML')
+            await send_preview(application.bot, chat_id, user_data)
+        else:
+            await application.bot.send_message(
+                chat_id,
+                "🖼 <b>Дашборд погоды готов</b> - он появится в предпросмотре",
+                parse_mode='HTML'
+            )
+    application.mark_data_for_update_persistence(user_ids=key[-1])
+
+async def wait_dashboard_render(key):
+    """Дожидается дашборда, который рисуется в фоне, если он есть"""
+    render = DASHBOARD_RENDERS.get(key)
+    if render is not None:
+        await asyncio.wait([render])
+
+def take_prefetch_budget(user_id, now=None):
+    """Списывает заблаговременное получение погоды из бюджета организатора; False - бюджет исчерпан"""
+    now = time.monotonic() if now is None else now
+    # Организаторы, которым погоду заранее не получали дольше окна, забываются,
+    # чтобы история не росла с числом организаторов
+    for other, started in list(WEATHER_PREFETCH_HISTORY.items()):
+        if now - started[-1] >= WEATHER_PREFETCH_WINDOW:
+            del WEATHER_PREFETCH_HISTORY[other]
+    history = [started for started in WEATHER_PREFETCH_HISTORY.get(user_id, ())
+               if now - started < WEATHER_PREFETCH_WINDOW]
+    if len(history) >= WEATHER_PREFETCH_BUDGET:
+        return False
+    history.append(now)
+    WEATHER_PREFETCH_HISTORY[user_id] = history
+    return True
+
+def schedule_weather_prefetch(update, context):
+    """Начинает получать погоду для дашборда в фоне, как только известны маршрут и время старта
+
+    Пока организатор выбирает точки, темп и пишет комментарий, прогноз
+    успевает прийти, и дашборд потом строится без ожидания Open-Meteo.
+    Задача принадлежит сессии и отменяется вместе с ней. Возвращает задачу
+    (она сразу заканчивается, если свежая погода уже есть) или None.
+    """
+    if WEATHER_PREFETCH == 'off':
+        return None
+    # Копия: организатор может поменять маршрут или время, пока погода получается
+    inputs = {name: context.user_data.get(name) for name in ('tour_id', 'gpx_path', 'parsed_datetime')}
+    if not inputs['gpx_path'] or not inputs['parsed_datetime']:
+        return None
+    key = session_key(update)
+    preview_path, _, weather_json = get_dashboard_paths(inputs, key[-1])
+    current = WEATHER_PREFETCHES.get(key)
+    if current is not None:
+        if current[0] == weather_json:
+            return current[1]
+        # Маршрут или время изменились - прежний прогноз больше не нужен
+        cancel_weather_prefetch(key)
+
+    task = asyncio.ensure_future(run_weather_prefetch(key, inputs, preview_path, weather_json))
+    WEATHER_PREFETCHES[key] = (weather_json, task)
+
+    def forget(done):
+        if WEATHER_PREFETCHES.get(key, (None, None))[1] is done:
+            del WEATHER_PREFETCHES[key]
+
+    task.add_done_callback(forget)
+    return SESSIONS.track(key, task)
+
+def is_prefetch_needed(preview_path, weather_json):
+    """Нужно ли получать погоду заранее: свежих данных (и в режиме dashboard - предпросмотра) еще нет"""
+    return not (is_weather_data_fresh(weather_json)
+                and (WEATHER_PREFETCH != 'dashboard' or os.path.exists(preview_path)))
+
+async def run_weather_prefetch(key, inputs, preview_path, weather_json):
+    """Получает погоду (в режиме dashboard - и предпросмотр дашборда) заранее; возвращает успех
+
+    Свежесть сохраненных данных проверяется здесь, в потоке: для этого
+    читается JSON с погодой. Бюджет организатора списывается, только если
+    погоду действительно нужно получать. Процессы принадлежат отдельному
+    владельцу: их можно убить, не трогая шаг разговора, который идет в это время.
+    """
+    if not await run_blocking(is_prefetch_needed, preview_path, weather_json):
+        return True
+    if not take_prefetch_budget(key[-1]):
+        WEATHER_PREFETCH_RESULTS.inc(result='budget')
+        logger.info(f"Бюджет заблаговременного получения погоды исчерпан для {key}")
+        return False
+
+    owner = ('weather_prefetch', key)
+    PROCESS_OWNER.set(owner)
+    prefetch = generate_preview_dashboard if WEATHER_PREFETCH == 'dashboard' else fetch_preview_weather
+    try:
+        with span('weather.prefetch', mode=WEATHER_PREFETCH):
+            # Прогноз с пропусками - тоже неудача: он не должен остаться в общем JSON
+            ok = (await run_blocking(prefetch, inputs, key[-1]) is not None
+                  and await run_blocking(is_weather_data_fresh, weather_json))
+            if not ok:
+                await run_blocking(remove_stale_weather_data, weather_json)
+    except asyncio.CancelledError:
+        # Отмена задачи не останавливает процесс, который ждут в потоке run_blocking
+        kill_owned(owner)
+        WEATHER_PREFETCH_RESULTS.inc(result='cancelled')
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при заблаговременном получении погоды: {e}")
+        ok = False
+    WEATHER_PREFETCH_RESULTS.inc(result='done' if ok else 'failed')
+    return ok
+
+def cancel_weather_prefetch(key):
+    """Отменяет заблаговременное получение погоды - организатор обходится без дашборда"""
+    current = WEATHER_PREFETCHES.pop(key, None)
+    if current is not None and not current[1].done():
+        current[1].cancel()
+
+async def wait_weather_prefetch(key):
+    """Дожидается погоды, которая уже получается заранее, чтобы не запрашивать ее второй раз"""
+    current = WEATHER_PREFETCHES.get(key)
+    if current is not None:
+        await asyncio.wait([current[1]])
+
+@traced_handler
 async def preview_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
     # Отправить — публикуем анонс и GPX
@@ -1600,8 +2102,12 @@ async def preview_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif finish_point_name:
             announce_lines.append(f"Финиш: {finish_point_name}")
 
+        announce_lines.append(f"Ожидаемый темп: {pace_emoji}")
+        # Сводка погоды текстом, если организатор ее добавил
+        weather_caption = context.user_data.get('weather_caption')
+        if weather_caption:
+            announce_lines.extend(["", weather_caption])
         announce_lines.extend([
-            f"Ожидаемый темп: {pace_emoji}",
             "",
             comment,
             "",
@@ -1610,6 +2116,9 @@ async def preview_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         announce = "\n".join(announce_lines)
 
+        # Дашборд, который еще рисуется, дожидаемся: организатор уже видел сводку погоды
+        await wait_dashboard_render(session_key(update))
+
         # Проверяем, есть ли картинка или дашборд для анонса
         announce_image = context.user_data.get('announce_image')
         dashboard_path = context.user_data.get('dashboard_path')
@@ -1622,9 +2131,10 @@ async def preview_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='HTML'
             )
         elif dashboard_path and os.path.exists(dashboard_path):
-            # Отправляем дашборд погоды как картинку
-            await update.message.reply_photo(
-                photo=open(dashboard_path, 'rb'),
+            # Отправляем дашборд погоды в полном качестве
+            await send_file_cached(
+                FILE_ID_CACHE, update.message.reply_photo,
+                await run_blocking(get_publish_dashboard, context.user_data),
                 caption=announce,
                 parse_mode='HTML'
             )
@@ -1634,8 +2144,10 @@ async def preview_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Отправляем GPX файл только если есть трек
         if gpx_path and not no_track:
-            with open(gpx_path, 'rb') as f:
-                await update.message.reply_document(f, filename=os.path.basename(gpx_path))
+            await send_file_cached(
+                FILE_ID_CACHE, update.message.reply_document, gpx_path,
+                kind='document', filename=os.path.basename(gpx_path)
+            )
         
         # Отправляем финальное сообщение
         await update.message.reply_text(
@@ -1670,53 +2182,22 @@ async def preview_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await preview_step(update, context)
 
     if text == "🌤️ Сгенерировать дашборд (BETA)":
-        # Генерируем дашборд погоды
-        gpx_path = context.user_data.get('gpx_path')
-        parsed_datetime = context.user_data.get('parsed_datetime')
+        return await generate_dashboard(update, context)
 
-        if not gpx_path or not parsed_datetime:
-            await update.message.reply_text(
-                "❌ <b>Ошибка:</b> Не найден GPX файл или время старта",
-                parse_mode='HTML'
-            )
-            return await preview_step(update, context)
+    if text == "📝 Сводка погоды текстом":
+        return await add_weather_caption(update, context)
 
+    if text == "🗑️ Убрать сводку погоды":
+        cancel_weather_caption(session_key(update))
+        context.user_data['weather_caption'] = None
         await update.message.reply_text(
-            "🌤️ <b>Генерирую дашборд погоды...</b>\n\n"
-            "Это может занять 1-2 минуты ⏳",
+            "✅ <b>Сводка погоды убрана из анонса!</b>",
             parse_mode='HTML'
         )
-
-        # Генерируем дашборд
-        dashboard_path = f"dashboard_{context.user_data.get('tour_id', 'temp')}.png"
-        success = generate_weather_dashboard(gpx_path, parsed_datetime, dashboard_path)
-
-        if success:
-            # Сохраняем путь к дашборду
-            context.user_data['dashboard_path'] = dashboard_path
-            await update.message.reply_text(
-                "✅ <b>Дашборд погоды успешно сгенерирован!</b>\n\n"
-                "Он будет использован в анонсе вместо обычной картинки.",
-                parse_mode='HTML'
-            )
-        else:
-            await update.message.reply_text(
-                "❌ <b>Не удалось сгенерировать дашборд погоды</b>\n\n"
-                "Возможно, проблемы с интернетом или данными.\n"
-                "Продолжаем без дашборда.",
-                parse_mode='HTML'
-            )
-
         return await preview_step(update, context)
 
     if text == "🗑️ Удалить дашборд":
-        dashboard_path = context.user_data.get('dashboard_path')
-        if dashboard_path and os.path.exists(dashboard_path):
-            try:
-                os.remove(dashboard_path)
-            except:
-                pass
-        context.user_data['dashboard_path'] = None
+        await run_blocking(remove_dashboard_files, context.user_data)
         await update.message.reply_text(
             "✅ <b>Дашборд удален из анонса!</b>",
             parse_mode='HTML'
@@ -1811,17 +2292,13 @@ async def restart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для проверки статуса бота"""
-    cache_files = glob.glob(f"{CACHE_DIR}/*.gpx")
-    cache_size = len(cache_files)
-    
-    # Проверяем размер кэша
-    total_size = 0
-    if cache_files:
-        total_size = sum(os.path.getsize(f) for f in cache_files)
+    cache_size, total_size = await run_blocking(get_gpx_cache_stats)
     
     status_text = f"🤖 <b>Статус бота</b>\n\n"
     status_text += f"📁 Файлов в кэше: {cache_size}\n"
     status_text += f"💾 Размер кэша: {total_size / 1024:.1f} KB\n"
+    status_text += (f"⏱ Задержка event loop: {LOOP_MONITOR.last_lag * 1000:.0f} мс "
+                    f"(макс. {LOOP_MONITOR.max_lag * 1000:.0f} мс, блокировок: {LOOP_MONITOR.stalls})\n")
     try:
         tz = pytz.timezone(TIMEZONE)
     except pytz.exceptions.UnknownTimeZoneError:
@@ -1841,6 +2318,84 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(status_text, parse_mode='HTML')
 
+def is_admin(update: Update) -> bool:
+    """Проверяет, что команду отправил администратор бота"""
+    return bool(update.effective_user and update.effective_user.id in ADMIN_IDS)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Профилирует следующие N апдейтов или T секунд и присылает профиль (только для администраторов)"""
+    if not is_admin(update):
+        await update.message.reply_text("⛔ Команда доступна только администраторам")
+        return
+
+    usage = ("Использование: /profile [апдейтов] [секунд]\n"
+             f"По умолчанию: {PROFILE_DEFAULT_UPDATES} апдейтов или {PROFILE_DEFAULT_SECONDS} секунд")
+    args = context.args or []
+    try:
+        updates = int(args[0]) if len(args) > 0 else PROFILE_DEFAULT_UPDATES
+        seconds = float(args[1]) if len(args) > 1 else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+    if updates <= 0 or seconds <= 0:
+        await update.message.reply_text(usage)
+        return
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+
+    session = PROFILER.begin(updates, seconds, after_update_id=update.update_id)
+    if session is None:
+        await update.message.reply_text("⏳ Профилирование уже идет, дождись его результата")
+        return
+
+    await update.message.reply_text(
+        f"🔬 Профилирую следующие {updates} апдейтов или {seconds:.0f} секунд - что наступит раньше.\n"
+        f"Дашборды погоды за это время тоже попадут в профиль."
+    )
+    # Ждем в фоне, чтобы не держать очередь апдейтов этого чата
+    context.application.create_task(send_profile(context.bot, update.effective_chat.id, session), update=update)
+
+async def send_profile(bot, chat_id, session):
+    """Дожидается конца профилирования и присылает профиль в формате collapsed stacks"""
+    try:
+        await session.wait()
+    finally:
+        stacks = await run_blocking(PROFILER.end)
+
+    if not stacks:
+        await bot.send_message(chat_id, "🔬 Профиль пуст: за это время бот ничего не делал")
+        return
+
+    total = sum(stacks.values())
+    summary = [f"🔬 Профиль готов: апдейтов {session.processed}, снимков стеков {total}", "", "Топ функций:"]
+    for name, count in top_functions(stacks):
+        summary.append(f"{count / total * 100:5.1f}% {name}")
+    await bot.send_document(
+        chat_id,
+        document=format_collapsed(stacks).encode('utf-8'),
+        filename=f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded",
+        caption='\n'.join(summary)[:1024]
+    )
+
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отчет о памяти: рост по снимкам tracemalloc, размер user_data, открытые файлы (только для администраторов)"""
+    if not is_admin(update):
+        await update.message.reply_text("⛔ Команда доступна только администраторам")
+        return
+
+    if context.args and context.args[0] == 'stop':
+        MEMORY_SNAPSHOTS.stop()
+        await update.message.reply_text("🧠 tracemalloc выключен")
+        return
+
+    # Первый вызов включает tracemalloc и сохраняет снимок, следующие - сравнивают с предыдущим
+    top_stats = await run_blocking(MEMORY_SNAPSHOTS.diff)
+    await update.message.reply_text(format_memory_report(context.application, MEMORY_SNAPSHOTS, top_stats))
+
+def get_gpx_cache_stats():
+    """Возвращает количество GPX файлов в кэше и их общий размер в байтах"""
+    cache_files = glob.glob(f"{CACHE_DIR}/*.gpx")
+    return len(cache_files), sum(os.path.getsize(f) for f in cache_files)
+
 def cleanup_old_gpx_files():
     """Автоматически очищает GPX файлы старше 180 дней"""
     try:
@@ -1878,7 +2433,7 @@ def cleanup_old_dashboards():
         except pytz.exceptions.UnknownTimeZoneError:
             tz = pytz.UTC
         current_time = datetime.now(tz)
-        dashboard_files = glob.glob("dashboard_*.png")
+        dashboard_files = glob.glob("dashboard_*.png") + glob.glob(os.path.join(CACHE_DIR, "dashboard_*"))
         deleted_count = 0
 
         for file_path in dashboard_files:
@@ -1923,85 +2478,36 @@ async def preload_ready_routes():
             logger.info(f"Загружаю маршрут '{route_name}' (tour_id: {tour_id})")
             
             # Скачиваем GPX
-            process = await asyncio.create_subprocess_exec(
-                'komootgpx',
-                '-d', tour_id,
-                '-o', CACHE_DIR,
-                '-e',
-                '-n',
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            try:
-                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=60.0)
-                if process.returncode == 0:
-                    logger.info(f"✅ Маршрут '{route_name}' успешно загружен в кеш")
-                else:
-                    error_msg = stderr.decode() if stderr else "Неизвестная ошибка"
-                    logger.error(f"❌ Ошибка при загрузке маршрута '{route_name}': {error_msg}")
-            except asyncio.TimeoutError:
-                logger.warning(f"⏰ Таймаут при загрузке маршрута '{route_name}', убиваю процесс")
-                process.kill()
+            with track_external('komootgpx'):
+                result = await run_process(komootgpx_command(tour_id), 'komootgpx', timeout=60.0)
+            if result.timed_out:
+                logger.warning(f"⏰ Таймаут при загрузке маршрута '{route_name}', процесс убит")
+            elif result.returncode == 0:
+                logger.info(f"✅ Маршрут '{route_name}' успешно загружен в кеш")
+            else:
+                EXTERNAL_ERRORS.inc(call='komootgpx')
+                error_msg = result.stderr or "Неизвестная ошибка"
+                logger.error(f"❌ Ошибка при загрузке маршрута '{route_name}': {error_msg}")
                 
         except Exception as e:
             logger.error(f"❌ Неожиданная ошибка при загрузке маршрута '{route.get('name', 'Unknown')}': {e}")
     
     logger.info("Предварительная загрузка готовых маршрутов завершена")
 
-def preload_ready_routes_sync():
-    """Синхронная версия предзагрузки готовых маршрутов для запуска при старте"""
-    logger.info("Начинаю синхронную предзагрузку готовых маршрутов в кеш...")
-
-    for route in ROUTE_COMMENTS:
-        try:
-            # Извлекаем tour_id из ссылки
-            match = KOMOOT_LINK_PATTERN.search(route['link'])
-            if not match:
-                logger.warning(f"Не удалось извлечь tour_id из ссылки: {route['link']}")
-                continue
-
-            tour_id = match.group(3)
-            route_name = route['name']
-
-            # Проверяем, есть ли уже файл в кеше
-            gpx_files = glob.glob(f"{CACHE_DIR}/*-{tour_id}.gpx")
-            if gpx_files:
-                logger.info(f"Маршрут '{route_name}' уже в кеше, пропускаю")
-                continue
-
-            logger.info(f"Загружаю маршрут '{route_name}' (tour_id: {tour_id})")
-
-            # Скачиваем GPX синхронно
-            import subprocess
-            try:
-                result = subprocess.run(
-                    ['komootgpx', '-d', tour_id, '-o', CACHE_DIR, '-e', '-n'],
-                    capture_output=True,
-                    text=True,
-                    timeout=60
-                )
-
-                if result.returncode == 0:
-                    logger.info(f"✅ Маршрут '{route_name}' успешно загружен в кеш")
-                else:
-                    logger.error(f"❌ Ошибка при загрузке маршрута '{route_name}': {result.stderr}")
-
-            except subprocess.TimeoutExpired:
-                logger.warning(f"⏰ Таймаут при загрузке маршрута '{route_name}'")
-            except FileNotFoundError:
-                logger.error(f"❌ komootgpx не найден в системе")
-                break
-
-        except Exception as e:
-            logger.error(f"❌ Неожиданная ошибка при загрузке маршрута '{route.get('name', 'Unknown')}': {e}")
-
-    logger.info("Синхронная предзагрузка готовых маршрутов завершена")
-
 # Функции для генерации дашборда погоды
 
-def generate_weather_dashboard(gpx_path, start_datetime, output_path="weather_dashboard.png", speed_kmh=27):
-    """Генерирует дашборд погоды для маршрута через внешний модуль"""
+def generate_weather_dashboard(gpx_path, start_datetime, output_path="weather_dashboard.png", speed_kmh=27,
+                               dpi=DASHBOARD_FULL_DPI, weather_json=None, deadline=None, fetch_only=False):
+    """Генерирует дашборд погоды для маршрута через внешний модуль
+
+    Если передан weather_json, внешний модуль сохраняет туда данные о погоде,
+    а при повторном вызове рисует дашборд по ним без запросов в сеть.
+    С fetch_only внешний модуль только получает погоду в weather_json.
+    deadline (по умолчанию DASHBOARD_DEADLINE) - за сколько секунд внешний
+    модуль должен закончить: прогноз, не полученный вовремя, на дашборде
+    отмечается пропуском, а зависший процесс убивается чуть позже дедлайна.
+    """
+    deadline = DASHBOARD_DEADLINE if deadline is None else deadline
     try:
         # Формируем путь к выходному файлу в папке cache
         cache_output_path = os.path.join("cache", output_path)
@@ -2017,14 +2523,28 @@ def generate_weather_dashboard(gpx_path, start_datetime, output_path="weather_da
             '-o', cache_output_path,
             '-s', str(speed_kmh),
             '-d', date_str,
-            '-t', time_str
+            '-t', time_str,
+            '--dpi', str(dpi),
+            '--deadline', f"{deadline:g}"
         ]
+        if weather_json:
+            cmd.extend(['--weather-json', weather_json])
+        if fetch_only:
+            cmd.append('--fetch-only')
         
         print(f"🌤️ Вызываем внешний модуль: {' '.join(cmd)}")
         
-        # Выполняем команду
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd())
+        # Выполняем команду (контекст трассы передается внешнему модулю через окружение)
+        with track_external('dashboard'), span('dashboard.worker', dpi=dpi,
+                                               cached_weather=bool(weather_json and os.path.exists(weather_json))):
+            env = trace_env()
+            env.update(PROFILER.worker_env())
+            result = run_process_sync(cmd, 'dashboard', timeout=deadline + DASHBOARD_DEADLINE_GRACE,
+                                      cwd=os.getcwd(), env=env)
+        record_dashboard_timings(result.stdout)
         
+        if result.returncode == 0 and fetch_only:
+            return bool(weather_json) and os.path.exists(weather_json)
         if result.returncode == 0:
             print(f"✅ Дашборд успешно создан: {cache_output_path}")
             # Копируем файл из cache в корневую папку для совместимости
@@ -2036,6 +2556,7 @@ def generate_weather_dashboard(gpx_path, start_datetime, output_path="weather_da
                 print(f"❌ Файл не найден: {cache_output_path}")
                 return False
         else:
+            EXTERNAL_ERRORS.inc(call='dashboard')
             print(f"❌ Ошибка выполнения внешнего модуля:")
             print(f"STDOUT: {result.stdout}")
             print(f"STDERR: {result.stderr}")
@@ -2045,22 +2566,200 @@ def generate_weather_dashboard(gpx_path, start_datetime, output_path="weather_da
         print(f"❌ Ошибка при вызове внешнего модуля: {e}")
         return False
 
+def record_dashboard_timings(stdout):
+    """Записывает в метрики длительность этапов, которую печатает внешний модуль дашборда"""
+    for line in (stdout or '').splitlines():
+        if not line.startswith('TIMINGS '):
+            continue
+        try:
+            timings = json.loads(line[len('TIMINGS '):])
+        except json.JSONDecodeError:
+            logger.warning(f"Не удалось разобрать длительности дашборда: {line}")
+            continue
+        if 'open_meteo' in timings:
+            observe_external('open_meteo', timings['open_meteo'], failed=timings.get('open_meteo_missing', 0) > 0)
+        if timings.get('open_meteo_deadline'):
+            logger.warning(f"Прогноз получен не для всех точек до дедлайна дашборда, "
+                           f"без прогноза: {timings.get('open_meteo_missing', 0)}")
+        if 'render' in timings:
+            observe_external('render', timings['render'])
+
+def get_dashboard_paths(user_data, owner):
+    """Возвращает пути к предпросмотру, дашборду в полном качестве и JSON с погодой для анонса
+
+    Один маршрут на одно время могут анонсировать несколько организаторов,
+    поэтому картинки у каждого организатора (owner - id пользователя) свои:
+    удаление или сброс анонса одного не трогает файлы другого. JSON с погодой
+    общий - его только читают, а обновляют целиком, когда он устаревает.
+    """
+    parsed_datetime = user_data.get('parsed_datetime')
+    stamp = parsed_datetime.strftime('%Y%m%d%H%M') if parsed_datetime else 'notime'
+    base = f"dashboard_{user_data.get('tour_id') or 'temp'}_{stamp}"
+    own = f"{base}_{owner}"
+    return f"{own}_preview.png", f"{own}.png", os.path.join(CACHE_DIR, f"{base}.json")
+
+def get_full_dashboard_path(preview_path):
+    """Путь к дашборду в полном качестве того же организатора по пути к предпросмотру"""
+    return preview_path.removesuffix('_preview.png') + '.png'
+
+def remove_stale_weather_data(weather_json):
+    """Удаляет устаревший прогноз или прогноз с пропусками, чтобы внешний модуль получил погоду заново
+
+    Файл общий: его мог уже удалить или обновить другой организатор.
+    """
+    if os.path.exists(weather_json) and not is_weather_data_fresh(weather_json):
+        try:
+            os.remove(weather_json)
+        except FileNotFoundError:
+            pass
+
+def is_weather_data_complete(weather_json):
+    """Проверяет, что в сохраненных данных есть прогноз для всех точек маршрута"""
+    try:
+        _, weather_data = load_weather_data(weather_json)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Не удалось прочитать данные о погоде {weather_json}: {e}")
+        return False
+    return is_weather_complete(weather_data)
+
+def is_weather_data_fresh(weather_json):
+    """Проверяет, что сохраненные данные о погоде есть, еще не устарели и без пропусков
+
+    Прогноз с пропусками после ошибки сети или дедлайна свежим не считается:
+    JSON общий для всех организаторов маршрута, и иначе короткий сбой
+    Open-Meteo оставил бы их без погоды на весь WEATHER_CACHE_TTL.
+    """
+    try:
+        if (datetime.now().timestamp() - os.path.getmtime(weather_json)) >= WEATHER_CACHE_TTL:
+            return False
+    except OSError:
+        return False
+    return is_weather_data_complete(weather_json)
+
+def generate_preview_dashboard(user_data, owner):
+    """Генерирует дашборд организатора owner для предпросмотра в низком разрешении
+
+    Данные о погоде сохраняются рядом, чтобы при публикации дорисовать
+    дашборд в полном качестве без новых запросов в сеть. Если свежий
+    предпросмотр для этого маршрута и времени уже есть, он используется повторно.
+    Возвращает путь к картинке или None.
+    """
+    gpx_path = user_data.get('gpx_path')
+    parsed_datetime = user_data.get('parsed_datetime')
+    preview_path, _, weather_json = get_dashboard_paths(user_data, owner)
+
+    if is_weather_data_fresh(weather_json) and os.path.exists(preview_path):
+        logger.info(f"Используем готовый предпросмотр дашборда: {preview_path}")
+    else:
+        remove_stale_weather_data(weather_json)
+        if not generate_weather_dashboard(gpx_path, parsed_datetime, preview_path,
+                                          dpi=DASHBOARD_PREVIEW_DPI, weather_json=weather_json):
+            return None
+
+    user_data['dashboard_path'] = preview_path
+    user_data['dashboard_weather_path'] = weather_json
+    return preview_path
+
+def cached_preview_weather(user_data, owner):
+    """Сводка погоды (summarize_weather) по свежим сохраненным данным или None, без запросов в сеть"""
+    _, _, weather_json = get_dashboard_paths(user_data, owner)
+    if not is_weather_data_fresh(weather_json):
+        return None
+    route_points, weather_data = load_weather_data(weather_json)
+    summary = summarize_weather(route_points, weather_data)
+    if summary is not None:
+        user_data['dashboard_weather_path'] = weather_json
+    return summary
+
+def fetch_preview_weather(user_data, owner):
+    """Получает погоду для дашборда анонса, не рисуя его; возвращает сводку (summarize_weather) или None
+
+    Свежие данные, полученные раньше, используются повторно. Дашборд потом
+    рисуется по сохраненным данным без запросов в сеть.
+    """
+    _, _, weather_json = get_dashboard_paths(user_data, owner)
+    if not is_weather_data_fresh(weather_json):
+        remove_stale_weather_data(weather_json)
+        if not generate_weather_dashboard(user_data.get('gpx_path'), user_data.get('parsed_datetime'),
+                                          weather_json=weather_json, fetch_only=True):
+            return None
+    route_points, weather_data = load_weather_data(weather_json)
+    summary = summarize_weather(route_points, weather_data)
+    if summary is None:
+        return None
+    user_data['dashboard_weather_path'] = weather_json
+    return summary
+
+def get_publish_dashboard(user_data):
+    """Возвращает дашборд в полном качестве для публикации
+
+    Дашборд рисуется по сохраненным при предпросмотре данным о погоде,
+    поэтому запросов в сеть не делает - кроме случая, когда в прогнозе
+    пропуски: тогда внешний модуль получает погоду заново. Если дорисовать
+    не удалось, возвращает картинку предпросмотра.
+    """
+    preview_path = user_data.get('dashboard_path')
+    weather_json = user_data.get('dashboard_weather_path')
+    if not preview_path or not weather_json or not os.path.exists(weather_json):
+        return preview_path
+
+    full_path = get_full_dashboard_path(preview_path)
+    # Дашборд, нарисованный по прогнозу с пропусками, не переиспользуется: внешний
+    # модуль запросит недостающую погоду заново
+    if (os.path.exists(full_path) and os.path.getmtime(full_path) >= os.path.getmtime(weather_json)
+            and is_weather_data_complete(weather_json)):
+        logger.info(f"Используем готовый дашборд в полном качестве: {full_path}")
+        return full_path
+
+    if generate_weather_dashboard(user_data.get('gpx_path'), user_data.get('parsed_datetime'), full_path,
+                                  dpi=DASHBOARD_FULL_DPI, weather_json=weather_json):
+        return full_path
+    logger.warning("Не удалось дорисовать дашборд в полном качестве, публикуем предпросмотр")
+    return preview_path
+
+def remove_dashboard_files(user_data):
+    """Удаляет картинки дашборда анонса и забывает о них
+
+    Общий JSON с погодой остается: по нему могут рисовать дашборды другие
+    организаторы, а устаревшие файлы убирает cleanup_old_dashboards.
+    """
+    preview_path = user_data.get('dashboard_path')
+    paths = []
+    if preview_path:
+        for name in (preview_path, get_full_dashboard_path(preview_path)):
+            # generate_weather_dashboard оставляет копию картинки в кэше
+            paths += [name, os.path.join(CACHE_DIR, os.path.basename(name))]
+    for path in paths:
+        FILE_ID_CACHE.forget(path)
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"Ошибка при удалении {path}: {e}")
+    user_data['dashboard_path'] = None
+    user_data['dashboard_weather_path'] = None
+
+def clear_gpx_cache():
+    """Удаляет все GPX файлы из кэша и возвращает количество удаленных"""
+    # Сначала очищаем старые файлы
+    cleanup_old_gpx_files()
+
+    cache_files = glob.glob(f"{CACHE_DIR}/*.gpx")
+    deleted_count = 0
+
+    for file_path in cache_files:
+        try:
+            os.remove(file_path)
+            logger.info(f"Удален файл кэша: {file_path}")
+            deleted_count += 1
+        except Exception as e:
+            logger.error(f"Ошибка при удалении {file_path}: {e}")
+    return deleted_count
+
 async def clear_cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для очистки кэша"""
     try:
-        # Сначала очищаем старые файлы
-        cleanup_old_gpx_files()
-        
-        cache_files = glob.glob(f"{CACHE_DIR}/*.gpx")
-        deleted_count = 0
-        
-        for file_path in cache_files:
-            try:
-                os.remove(file_path)
-                logger.info(f"Удален файл кэша: {file_path}")
-                deleted_count += 1
-            except Exception as e:
-                logger.error(f"Ошибка при удалении {file_path}: {e}")
+        deleted_count = await run_blocking(clear_gpx_cache)
         
         if deleted_count == 0:
             await update.message.reply_text("🗑️ Кэш уже пуст!")
@@ -2071,29 +2770,124 @@ async def clear_cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         logger.error(f"Ошибка при очистке кэша: {e}")
         await update.message.reply_text(f"❌ Ошибка при очистке кэша: {str(e)}")
 
-if __name__ == '__main__':
-    # Логируем информацию о временной зоне
+async def expire_session(key, user_data):
+    """Освобождает файлы брошенного анонса и предупреждает организатора"""
+    await run_blocking(remove_dashboard_files, user_data)
     try:
-        tz = pytz.timezone(TIMEZONE)
-        logger.info(f"Используемая временная зона: {TIMEZONE}")
-        logger.info(f"Текущее время: {datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S %Z')}")
-    except pytz.exceptions.UnknownTimeZoneError:
-        logger.warning(f"Неизвестная временная зона: {TIMEZONE}, используем UTC")
-        TIMEZONE = 'UTC'
+        await SESSIONS.application.bot.send_message(
+            key[0],
+            "⌛ Анонс не был закончен и сброшен из-за неактивности.\n\n"
+            "Используй /start, чтобы начать заново.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+    except TelegramError as e:
+        logger.warning(f"Не удалось предупредить о завершении сессии {key}: {e}")
 
-    # Автоматически очищаем старые GPX файлы и дашборды при запуске
-    cleanup_old_gpx_files()
-    cleanup_old_dashboards()
+def is_interrupt(update):
+    """Апдейт отменяет текущую работу разговора: кнопка отмены, /restart или новый /start"""
+    message = update.effective_message if isinstance(update, Update) else None
+    text = (message.text or '').strip() if message else ''
+    if text in INTERRUPT_TEXTS:
+        return True
+    return text.startswith('/') and text.split()[0].split('@')[0] in INTERRUPT_COMMANDS
 
-    # Предварительно загружаем все готовые маршруты в кеш
-    preload_ready_routes_sync()
+def interrupt_session(update):
+    """Отменяет скачивание и отрисовку, которые еще идут в разговоре, до того как апдейт встанет в очередь чата
 
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    Возвращает корутину, которая дожидается отмененных задач, или None.
+    """
+    if not is_interrupt(update):
+        return None
+    key = session_key(update)
+    if key is None:
+        return None
+    tasks = SESSIONS.cancel_nowait(key)
+    if not tasks:
+        return None
+    logger.info(f"Работа разговора {key} отменена: {update.effective_message.text}")
+    return SESSIONS.wait_cancelled(key, tasks)
+
+async def startup_maintenance():
+    """Очистка старых файлов и предзагрузка готовых маршрутов после старта бота"""
+    try:
+        await run_blocking(cleanup_old_gpx_files)
+        await run_blocking(cleanup_old_dashboards)
+        await preload_ready_routes()
+    except asyncio.CancelledError:
+        logger.info("Предзагрузка готовых маршрутов прервана остановкой бота")
+        raise
+
+async def post_init(application, maintenance=False):
+    """Запускается после инициализации приложения, до получения апдейтов"""
+    global STARTUP_TASK
+    LOOP_MONITOR.start()
+    SESSIONS.start()
+    await METRICS_SERVER.start()
+    if maintenance:
+        # Обслуживание кэша идет в фоне, чтобы бот сразу начал получать апдейты
+        STARTUP_TASK = asyncio.create_task(startup_maintenance())
+
+async def post_shutdown(application):
+    """Освобождает ресурсы после остановки приложения"""
+    global STARTUP_TASK
+    if STARTUP_TASK and not STARTUP_TASK.done():
+        STARTUP_TASK.cancel()
+        await asyncio.gather(STARTUP_TASK, return_exceptions=True)
+    STARTUP_TASK = None
+    await SESSIONS.stop()
+    if PROFILER.active:
+        PROFILER.end()
+    await METRICS_SERVER.stop()
+    await LOOP_MONITOR.stop()
+    shutdown_executor()
+    # Persistence уже сохранена при остановке приложения, хранилище можно закрыть
+    if application.persistence:
+        application.persistence.store.close()
+
+def build_application(token=TELEGRAM_TOKEN, base_url=TELEGRAM_BASE_URL, maintenance=False, store=None):
+    """Создает приложение бота со всеми обработчиками
+
+    base_url позволяет направить бота на другой сервер Bot API, например
+    на локальную заглушку в нагрузочных тестах. С maintenance после старта
+    в фоне чистятся старые файлы и предзагружаются готовые маршруты.
+    С store (shared_store.py) разговоры, user_data и кэш file_id хранятся
+    в общем хранилище и переживают перезапуск.
+    """
+    load_config()
+    # Апдейты разных чатов обрабатываются параллельно, шаги одного разговора - по очереди
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .concurrent_updates(
+            PerChatUpdateProcessor(
+                MAX_CONCURRENT_UPDATES,
+                on_processed=PROFILER.update_processed,
+                on_received=UPDATE_RECORDER.record if UPDATE_RECORDER.enabled else None,
+                interrupt=interrupt_session,
+            )
+        )
+        .post_init(functools.partial(post_init, maintenance=maintenance))
+        .post_shutdown(post_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    persistence = None
+    if store is not None:
+        persistence = StorePersistence(store)
+        builder = builder.persistence(persistence)
+        FILE_ID_CACHE.store = store
+    app = builder.build()
+    if persistence:
+        # Состояние пользователя поднимается из хранилища раньше всех обработчиков
+        app.add_handler(persistence.restore_handler(), group=-2)
     
     # Добавляем команды статуса и очистки кэша
     app.add_handler(CommandHandler('status', status_command))
     app.add_handler(CommandHandler('clear_cache', clear_cache_command))
     app.add_handler(CommandHandler('help', help_command))
+    app.add_handler(CommandHandler('profile', profile_command))
+    app.add_handler(CommandHandler('memory', memory_command))
 
 
     
@@ -2119,7 +2913,47 @@ if __name__ == '__main__':
             SELECT_ROUTE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_route_selection)],
         },
         fallbacks=[CommandHandler('restart', restart_command)],
+        name='announce',
+        persistent=store is not None,
     )
     app.add_handler(conv_handler)
+    SESSIONS.on_expire = expire_session
+    SESSIONS.attach(app, conv_handler)
+    # Замеряем длительность и ошибки всех обработчиков, включая состояния разговора
+    instrument_application(app)
+    return app
+
+def main():
+    global TIMEZONE, WEATHER_PREFETCH
+    # Включаем логирование
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
+    )
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    # Логируем информацию о временной зоне
+    try:
+        tz = pytz.timezone(TIMEZONE)
+        logger.info(f"Используемая временная зона: {TIMEZONE}")
+        logger.info(f"Текущее время: {datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S %Z')}")
+    except pytz.exceptions.UnknownTimeZoneError:
+        logger.warning(f"Неизвестная временная зона: {TIMEZONE}, используем UTC")
+        TIMEZONE = 'UTC'
+
+    if WEATHER_PREFETCH not in WEATHER_PREFETCH_MODES:
+        logger.warning(f"Неизвестный режим WEATHER_PREFETCH: {WEATHER_PREFETCH} "
+                       f"(возможные: {', '.join(WEATHER_PREFETCH_MODES)}), используем weather")
+        WEATHER_PREFETCH = 'weather'
+
+    if UPDATE_RECORDER.enabled:
+        logger.info(f"Входящие апдейты записываются в {UPDATE_RECORDER.path}")
+
+    app = build_application(maintenance=WORKER_ID == 0, store=open_store())
     print('Bot started...')
-    app.run_polling() 
\ No newline at end of file
+    if WEBHOOK_URL:
+        run_webhook(app)
+    else:
+        app.run_polling()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""
+Диспетчер: несколько процессов бота за одним вебхуком
+
+Принимает апдейты от Telegram на вебхук (те же настройки WEBHOOK_*, что и у
+bot.py), запускает BOT_WORKERS процессов bot.py в режиме вебхука на
+локальных портах и передает каждый апдейт процессу по хешу ID чата. Все
+апдейты одного чата попадают в один процесс, поэтому ConversationHandler
+работает как в одном процессе, а процессы занимают разные ядра.
+
+Разговоры, user_data и кэш file_id процессы хранят в общем хранилище
+(SHARED_STORE, см. shared_store.py), поэтому перезапуск процесса или
+изменение их числа не теряет начатые анонсы. Фоновое обслуживание кэша
+выполняет только процесс 0. Упавший процесс перезапускается; пока он
+поднимается, диспетчер отвечает Telegram 503, и тот повторяет апдейт.
+
+Пример:
+    BOT_WORKERS=4 SHARED_STORE=sqlite:///cache/state.db WEBHOOK_URL=https://bot.example.com python3 dispatcher.py
+"""
+
+import os
+import sys
+import hmac
+import json
+import zlib
+import socket
+import signal
+import asyncio
+import logging
+import argparse
+import secrets
+from collections import Counter
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+
+from webhook import (
+    SECRET_HEADER, WEBHOOK_LISTEN, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WEBHOOK_SELF_SIGNED, WEBHOOK_TLS_CERT, WEBHOOK_TLS_KEY, WEBHOOK_URL, register_webhook, ssl_context
+)
+
+logger = logging.getLogger(__name__)
+
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '2'))
+# Порт процесса i - WORKER_BASE_PORT + i; 0 - любые свободные порты
+WORKER_BASE_PORT = int(os.getenv('WORKER_BASE_PORT', '8450'))
+# Сколько ждать, пока процесс бота примет переданный апдейт, с
+FORWARD_TIMEOUT = float(os.getenv('FORWARD_TIMEOUT', '10'))
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+WORKER_PATH = '/telegram'
+
+
+def update_chat_id(update):
+    """ID чата апдейта (или пользователя, если чата нет), None для апдейтов без них"""
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+    return None
+
+
+def shard_for(update, workers):
+    """Номер процесса для апдейта: одинаковый для всех апдейтов одного чата"""
+    chat_id = update_chat_id(update)
+    if chat_id is None:
+        return update.get('update_id', 0) % workers
+    return zlib.crc32(str(chat_id).encode('utf-8')) % workers
+
+
+def free_ports(count, host='127.0.0.1'):
+    """Свободные порты (порт может занять кто-то другой до запуска процесса, но для тестов хватает)"""
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.socket()
+            sock.bind((host, 0))
+            sockets.append(sock)
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+class Dispatcher:
+    """HTTP-сервер вебхука, который передает апдейты процессам бота по хешу чата"""
+
+    def __init__(self, worker_urls, worker_secret, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 secret=WEBHOOK_SECRET, tls_cert=WEBHOOK_TLS_CERT, tls_key=WEBHOOK_TLS_KEY,
+                 forward_timeout=FORWARD_TIMEOUT):
+        self.worker_urls = list(worker_urls)
+        self.worker_secret = worker_secret
+        self.listen = listen
+        self.port = int(port)
+        self.path = path
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.tls_cert = tls_cert
+        self.tls_key = tls_key
+        self.forward_timeout = forward_timeout
+        self.draining = False
+        self.forwarded = Counter()
+        self.failed = Counter()
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._session = None
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"{'https' if self.tls_cert else 'http'}://{self.listen}:{self.port}{self.path}"
+
+    async def _handle_update(self, request):
+        if self.draining:
+            return web.Response(status=503, headers={'Retry-After': '1'}, text='Shutting down')
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            logger.warning(f"Запрос к вебхуку без верного секрета с {request.remote}")
+            return web.Response(status=403)
+
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            body = await request.read()
+            try:
+                update = json.loads(body)
+            except ValueError:
+                return web.Response(status=400)
+            if not isinstance(update, dict):
+                return web.Response(status=400)
+            return await self._forward(shard_for(update, len(self.worker_urls)), body)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def _forward(self, index, body):
+        try:
+            async with self._session.post(self.worker_urls[index], data=body,
+                                          headers={SECRET_HEADER: self.worker_secret,
+                                                   'Content-Type': 'application/json'}) as response:
+                if response.status == 200:
+                    self.forwarded[index] += 1
+                else:
+                    self.failed[index] += 1
+                # Ошибку процесса (например, 503 при его остановке) Telegram увидит и повторит апдейт
+                return web.Response(status=response.status)
+        except (ClientError, asyncio.TimeoutError) as e:
+            self.failed[index] += 1
+            logger.warning(f"Процесс бота {index} недоступен: {e!r}")
+            return web.Response(status=503, headers={'Retry-After': '1'})
+
+    async def _handle_health(self, request):
+        if self.draining:
+            return web.Response(status=503, text='draining')
+        return web.Response(text='ok')
+
+    async def start(self):
+        self._session = ClientSession(timeout=ClientTimeout(total=self.forward_timeout))
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get('/healthz', self._handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port, ssl_context=ssl_context(self.tls_cert, self.tls_key))
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Диспетчер слушает {self.listen}:{self.port}{self.path}, процессов: {len(self.worker_urls)}")
+        return self
+
+    async def drain(self):
+        """Перестает принимать апдейты и ждет, пока принятые будут переданы процессам"""
+        self.draining = True
+        await self._idle.wait()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class WorkerPool:
+    """Процессы bot.py в режиме вебхука на локальных портах, с перезапуском упавших"""
+
+    def __init__(self, count=BOT_WORKERS, base_port=WORKER_BASE_PORT, bot_path=BOT_SCRIPT, env=None,
+                 restart_delay=1.0):
+        self.count = count
+        self.ports = free_ports(count) if not base_port else [base_port + i for i in range(count)]
+        self.bot_path = bot_path
+        self.env = env or {}
+        self.secret = secrets.token_urlsafe(32)
+        self.restart_delay = restart_delay
+        self.restarts = Counter()
+        self.processes = [None] * count
+        self._watchers = []
+        self._stopping = False
+
+    @property
+    def urls(self):
+        return [f"http://127.0.0.1:{port}{WORKER_PATH}" for port in self.ports]
+
+    def worker_env(self, index):
+        env = dict(os.environ)
+        env.update(self.env)
+        env.update({
+            'WORKER_ID': str(index),
+            'WEBHOOK_URL': f"http://127.0.0.1:{self.ports[index]}",
+            'WEBHOOK_LISTEN': '127.0.0.1',
+            'WEBHOOK_PORT': str(self.ports[index]),
+            'WEBHOOK_PATH': WORKER_PATH,
+            'WEBHOOK_SECRET': self.secret,
+            'WEBHOOK_REGISTER': '0',
+            'WEBHOOK_TLS_CERT': '',
+            'WEBHOOK_TLS_KEY': '',
+        })
+        # У каждого процесса свой порт метрик
+        if env.get('METRICS_PORT'):
+            env['METRICS_PORT'] = str(int(env['METRICS_PORT']) + index)
+        return env
+
+    async def _spawn(self, index):
+        self.processes[index] = await asyncio.create_subprocess_exec(sys.executable, self.bot_path,
+                                                                     env=self.worker_env(index))
+        logger.info(f"Запущен процесс бота {index} (pid {self.processes[index].pid}, порт {self.ports[index]})")
+
+    async def _watch(self, index):
+        while not self._stopping:
+            returncode = await self.processes[index].wait()
+            if self._stopping:
+                return
+            logger.error(f"Процесс бота {index} завершился с кодом {returncode}, перезапускаем")
+            self.restarts[index] += 1
+            await asyncio.sleep(self.restart_delay)
+            if not self._stopping:
+                await self._spawn(index)
+
+    async def start(self, ready_timeout=60.0):
+        for index in range(self.count):
+            await self._spawn(index)
+        self._watchers = [asyncio.create_task(self._watch(index)) for index in range(self.count)]
+        await asyncio.wait_for(self._wait_ready(), ready_timeout)
+        return self
+
+    async def _wait_ready(self):
+        """Ждет, пока все процессы начнут отвечать на /healthz"""
+        async with ClientSession(timeout=ClientTimeout(total=1)) as session:
+            for port in self.ports:
+                while True:
+                    try:
+                        async with session.get(f"http://127.0.0.1:{port}/healthz") as response:
+                            if response.status == 200:
+                                break
+                    except (ClientError, asyncio.TimeoutError):
+                        pass
+                    await asyncio.sleep(0.1)
+
+    async def stop(self, timeout=30.0):
+        """Останавливает процессы по SIGTERM: каждый дообрабатывает принятые апдейты"""
+        self._stopping = True
+        for process in self.processes:
+            if process and process.returncode is None:
+                process.send_signal(signal.SIGTERM)
+        for process in self.processes:
+            if not process:
+                continue
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        for watcher in self._watchers:
+            watcher.cancel()
+        await asyncio.gather(*self._watchers, return_exceptions=True)
+
+
+async def serve(workers=BOT_WORKERS, bot_path=BOT_SCRIPT, register=True):
+    """Запускает процессы бота и диспетчер и работает до SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    pool = WorkerPool(workers, bot_path=bot_path)
+    dispatcher = Dispatcher(pool.urls, pool.secret)
+    try:
+        await pool.start()
+        await dispatcher.start()
+        if register and WEBHOOK_URL:
+            from telegram import Bot
+            base_url = os.getenv('TELEGRAM_BASE_URL', '').rstrip('/')
+            token = os.getenv('TELEGRAM_TOKEN', '')
+            bot = Bot(token, base_url=f"{base_url}/bot") if base_url else Bot(token)
+            async with bot:
+                await register_webhook(bot, f"{WEBHOOK_URL}{dispatcher.path}", dispatcher.secret,
+                                       WEBHOOK_MAX_CONNECTIONS, WEBHOOK_TLS_CERT if WEBHOOK_SELF_SIGNED else None)
+        await stop.wait()
+        logger.info("Останавливаемся: передаем принятые апдейты и останавливаем процессы бота")
+        await dispatcher.drain()
+    finally:
+        await pool.stop()
+        await dispatcher.stop()
+    logger.info(f"Диспетчер остановлен, передано апдейтов по процессам: {dict(dispatcher.forwarded)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Несколько процессов бота за одним вебхуком')
+    parser.add_argument('--workers', type=int, default=BOT_WORKERS, help='Число процессов бота')
+    parser.add_argument('--bot', default=BOT_SCRIPT, help='Путь к bot.py')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    if not os.getenv('SHARED_STORE'):
+        logger.warning("SHARED_STORE не задан: разговоры не переживут перезапуск процесса бота")
+    asyncio.run(serve(args.workers, args.bot))
+
+
+if __name__ == '__main__':
+    main()
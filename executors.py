@@ -0,0 +1,42 @@
+"""
+Ограниченный пул потоков для блокирующей работы внутри обработчиков
+"""
+
+import os
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Сколько блокирующих операций (парсинг GPX, файлы, внешние процессы) выполняется одновременно
+BLOCKING_WORKERS = int(os.getenv('BLOCKING_WORKERS', '8'))
+
+_executor = None
+
+
+def get_executor():
+    """Возвращает общий пул потоков, создавая его при первом обращении"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix='blocking')
+    return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполняет блокирующую функцию в пуле потоков, не останавливая event loop
+
+    Как и asyncio.to_thread, переносит contextvars в поток, но пул ограничен
+    BLOCKING_WORKERS: лишние задачи ждут своей очереди, а не плодят потоки.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+def shutdown_executor(wait=True):
+    """Останавливает пул потоков"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=True)
+        _executor = None
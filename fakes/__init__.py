@@ -0,0 +1 @@
+"""Локальные заглушки внешних сервисов для нагрузочных тестов и бенчмарков"""
@@ -0,0 +1,112 @@
+"""
+Общая часть локальных заглушек внешних сервисов: запуск сервера и помехи
+
+Заглушка может отвечать с задержкой (latency ± jitter), возвращать ошибку
+5xx с заданной вероятностью (error_rate) и ограничивать частоту запросов
+(rate_limit запросов в секунду, сверх лимита - 429), как настоящие сервисы.
+Случайность задается seed, поэтому прогоны повторяемы.
+"""
+
+import time
+import random
+import asyncio
+import logging
+from collections import Counter
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class FakeServer:
+    """Базовый класс заглушки на aiohttp; наследники добавляют маршруты в add_routes"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None,
+                 seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.calls = Counter()
+        self.faults = Counter()
+        self._random = random.Random(seed)
+        self._tokens = float(rate_limit or 0)
+        self._refilled = time.monotonic()
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def add_routes(self, app):
+        raise NotImplementedError
+
+    async def start(self):
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        self.add_routes(app)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # При port=0 система выбирает свободный порт
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def delay(self):
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _rate_limited(self):
+        """Ведро токенов: rate_limit запросов в секунду с запасом на одну секунду"""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        self._tokens = min(float(self.rate_limit), self._tokens + (now - self._refilled) * self.rate_limit)
+        self._refilled = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    def fault(self):
+        """Возвращает (статус, описание), если запрос должен завершиться ошибкой, иначе None"""
+        if self._rate_limited():
+            self.faults[429] += 1
+            return 429, 'Too Many Requests'
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.faults[503] += 1
+            return 503, 'Service Unavailable'
+        return None
+
+
+def add_fault_arguments(parser):
+    """Общие параметры командной строки для запуска заглушки отдельно"""
+    parser.add_argument('--host', default='127.0.0.1', help='Адрес (по умолчанию: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=0, help='Порт (по умолчанию: любой свободный)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа, с')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Разброс задержки, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 503, от 0 до 1')
+    parser.add_argument('--rate-limit', type=float, help='Запросов в секунду, сверх лимита - 429')
+    parser.add_argument('--seed', type=int, default=0, help='Зерно генератора случайных чисел')
+
+
+def fault_options(args):
+    return {'host': args.host, 'port': args.port, 'latency': args.latency, 'jitter': args.jitter,
+            'error_rate': args.error_rate, 'rate_limit': args.rate_limit, 'seed': args.seed}
+
+
+async def serve_forever(server):
+    """Запускает заглушку и работает до прерывания (Ctrl+C)"""
+    await server.start()
+    print(f"✅ {type(server).__name__} слушает {server.url}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
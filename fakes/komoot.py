@@ -0,0 +1,150 @@
+"""
+Локальная заглушка Komoot API для офлайн тестов и бенчмарков
+
+Отвечает на запрос тура, который делает komootgpx
+(/v007/tours/{tour_id}), в формате Komoot: метаданные тура и координаты
+с высотой и временем. Если в папке gpx_dir есть записанный GPX тура
+(*-{tour_id}.gpx, как их сохраняет komootgpx), отдается он; иначе трек
+генерируется gpx_generator.py, одинаковый для одного tour_id.
+
+Бот направляется сюда через KOMOOT_BASE_URL:
+    python3 -m fakes.komoot --port 8082 --gpx-dir cache
+    KOMOOT_BASE_URL=http://127.0.0.1:8082 python3 bot.py
+"""
+
+import os
+import glob
+import math
+import asyncio
+import argparse
+from datetime import datetime, timezone
+
+import gpxpy
+from aiohttp import web
+
+from fakes.base import FakeServer, add_fault_arguments, fault_options, serve_forever
+from gpx_generator import generate_track
+
+METERS_PER_DEGREE = 111320
+
+
+def recorded_points(path):
+    """Точки записанного GPX: (широта, долгота, высота, время) и название трека"""
+    with open(path, 'r', encoding='utf-8') as f:
+        gpx = gpxpy.parse(f)
+    points = [(p.latitude, p.longitude, p.elevation, p.time)
+              for track in gpx.tracks for segment in track.segments for p in segment.points]
+    return points, gpx.name or (gpx.tracks[0].name if gpx.tracks else None)
+
+
+def tour_json(tour_id, points, name):
+    """Тур в формате ответа Komoot API, из которого komootgpx собирает GPX"""
+    start_time = next((t for *_, t in points if t is not None), None) or datetime(2025, 6, 1, 8, 0)
+    if start_time.tzinfo is None:
+        start_time = start_time.replace(tzinfo=timezone.utc)
+
+    items, distance, up, down = [], 0.0, 0.0, 0.0
+    previous = None
+    for lat, lon, ele, point_time in points:
+        item = {'lat': lat, 'lng': lon}
+        if ele is not None:
+            item['alt'] = ele
+        if point_time is not None:
+            if point_time.tzinfo is None:
+                point_time = point_time.replace(tzinfo=timezone.utc)
+            # Komoot передает время точки в миллисекундах от старта
+            item['t'] = int((point_time - start_time).total_seconds() * 1000)
+        items.append(item)
+        if previous is not None:
+            d_north = (lat - previous[0]) * METERS_PER_DEGREE
+            d_east = (lon - previous[1]) * METERS_PER_DEGREE * math.cos(math.radians(lat))
+            distance += (d_north ** 2 + d_east ** 2) ** 0.5
+            if ele is not None and previous[2] is not None:
+                up += max(0.0, ele - previous[2])
+                down += max(0.0, previous[2] - ele)
+        previous = (lat, lon, ele)
+
+    duration = items[-1].get('t', 0) / 1000 if items else 0
+    return {
+        'id': int(tour_id),
+        'type': 'tour_planned',
+        'name': name or f"Tour {tour_id}",
+        'date': start_time.strftime('%Y-%m-%dT%H:%M:%S.000%z'),
+        'distance': round(distance, 1),
+        'duration': int(duration),
+        'elevation_up': round(up),
+        'elevation_down': round(down),
+        'difficulty': {'grade': 'moderate'},
+        '_embedded': {
+            'creator': {'display_name': 'Fake Komoot', 'username': '0'},
+            'coordinates': {'items': items},
+        },
+    }
+
+
+class FakeKomootAPI(FakeServer):
+    """Сервер, отдающий туры Komoot из записанных GPX или синтетические
+
+    length_km и points_per_km задают синтетические треки для туров без записи.
+    """
+
+    def __init__(self, gpx_dir=None, length_km=80.0, points_per_km=50, **options):
+        super().__init__(**options)
+        self.gpx_dir = gpx_dir
+        self.length_km = length_km
+        self.points_per_km = points_per_km
+        self._tours = {}
+
+    def add_routes(self, app):
+        app.router.add_get('/v007/tours/{tour_id}', self._tour)
+
+    def _recorded(self, tour_id):
+        if not self.gpx_dir:
+            return None
+        files = glob.glob(os.path.join(self.gpx_dir, f"*-{tour_id}.gpx")) or \
+            glob.glob(os.path.join(self.gpx_dir, f"{tour_id}.gpx"))
+        return files[0] if files else None
+
+    def _build_tour(self, tour_id):
+        path = self._recorded(tour_id)
+        if path:
+            points, name = recorded_points(path)
+        else:
+            lats, lons, elevations, times = generate_track(self.length_km, points_per_km=self.points_per_km,
+                                                           seed=int(tour_id) % 2 ** 32)
+            points = list(zip(lats.tolist(), lons.tolist(), elevations.tolist(), times))
+            name = f"Fake tour {tour_id}"
+        return tour_json(tour_id, points, name)
+
+    async def _tour(self, request):
+        tour_id = request.match_info['tour_id']
+        self.calls['tour'] += 1
+        await self.delay()
+        fault = self.fault()
+        if fault:
+            status, description = fault
+            # komootgpx печатает тело ошибки как JSON, поэтому отвечаем JSON
+            return web.json_response({'status': status, 'error': description}, status=status)
+        if not tour_id.isdigit():
+            return web.json_response({'status': 404, 'error': 'Not Found'}, status=404)
+        if tour_id not in self._tours:
+            # Сборка тура - разбор GPX или генерация трека - не должна блокировать сервер
+            self._tours[tour_id] = await asyncio.get_running_loop().run_in_executor(None, self._build_tour, tour_id)
+        return web.json_response(self._tours[tour_id])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная заглушка Komoot API')
+    add_fault_arguments(parser)
+    parser.add_argument('--gpx-dir', help='Папка с записанными GPX (*-{tour_id}.gpx)')
+    parser.add_argument('--length', type=float, default=80.0, help='Длина синтетических туров, км')
+    args = parser.parse_args()
+    server = FakeKomootAPI(args.gpx_dir, args.length, **fault_options(args))
+    try:
+        asyncio.run(serve_forever(server))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Локальная заглушка Open-Meteo для офлайн тестов и бенчмарков
+
+Отвечает на /v1/forecast в формате FlatBuffers, который запрашивает
+openmeteo_requests. Ответ берется из записи (папка recordings, файл на
+каждый набор параметров запроса); если записи нет, погода генерируется:
+суточный ход температуры, ветер и облачность, одинаковые для одних и тех же
+координат и дат. С upstream недостающие ответы один раз берутся у
+настоящего Open-Meteo и сохраняются в recordings.
+
+Внешний модуль дашборда направляется сюда через OPEN_METEO_URL:
+    python3 -m fakes.open_meteo --port 8083 --recordings tests/open_meteo
+    OPEN_METEO_URL=http://127.0.0.1:8083 python3 weather_dashboard.py route.gpx -d 01.06.2025 -t 08:00
+"""
+
+import os
+import math
+import zlib
+import asyncio
+import hashlib
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import flatbuffers
+import numpy as np
+from aiohttp import ClientSession, web
+from openmeteo_sdk.Unit import Unit
+from openmeteo_sdk.Variable import Variable
+
+from fakes.base import FakeServer, add_fault_arguments, fault_options, serve_forever
+
+# Переменные почасового прогноза, которые умеет генерировать заглушка: (переменная, единица)
+HOURLY_VARIABLES = {
+    'temperature_2m': (Variable.temperature, Unit.celsius),
+    'apparent_temperature': (Variable.apparent_temperature, Unit.celsius),
+    'relative_humidity_2m': (Variable.relative_humidity, Unit.percentage),
+    'wind_speed_10m': (Variable.wind_speed, Unit.kilometres_per_hour),
+    'wind_direction_10m': (Variable.wind_direction, Unit.degree_direction),
+    'pressure_msl': (Variable.pressure_msl, Unit.hectopascal),
+    'weather_code': (Variable.weather_code, Unit.wmo_code),
+    'precipitation_probability': (Variable.precipitation_probability, Unit.percentage),
+    'cloud_cover': (Variable.cloud_cover, Unit.percentage),
+}
+
+# Параметры, которые не влияют на ответ и не входят в ключ записи
+IGNORED_PARAMS = ('format',)
+
+
+def request_key(items):
+    """Имя файла записи для набора параметров запроса (пары ключ-значение, ключи могут повторяться)"""
+    items = sorted((key, value) for key, value in items if key not in IGNORED_PARAMS)
+    return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
+
+def synthetic_hourly(name, lat, lon, hours, seed=0):
+    """Значения переменной по часам: суточный ход и шум, повторяемые для одних координат"""
+    rng = np.random.default_rng(zlib.crc32(f"{name}:{lat:.3f}:{lon:.3f}:{seed}".encode('utf-8')))
+    hour_of_day = (hours / 3600 + lon / 15) % 24
+    daily = np.sin((hour_of_day - 9) / 24 * 2 * math.pi)
+    noise = rng.normal(0, 1, len(hours))
+    if name == 'temperature_2m':
+        values = 22 - abs(lat - 45) * 0.5 + 6 * daily + noise * 0.5
+    elif name == 'apparent_temperature':
+        values = 21 - abs(lat - 45) * 0.5 + 7 * daily + noise * 0.7
+    elif name == 'relative_humidity_2m':
+        values = np.clip(60 - 20 * daily + noise * 3, 20, 100)
+    elif name == 'wind_speed_10m':
+        values = np.clip(12 + 5 * daily + noise * 2, 0, None)
+    elif name == 'wind_direction_10m':
+        values = (rng.uniform(0, 360) + np.cumsum(noise * 5)) % 360
+    elif name == 'pressure_msl':
+        values = 1013 + np.cumsum(noise * 0.2)
+    elif name == 'weather_code':
+        values = rng.choice([0, 1, 2, 3, 61], size=len(hours), p=[0.4, 0.25, 0.15, 0.15, 0.05])
+    elif name == 'precipitation_probability':
+        values = np.clip(15 - 10 * daily + noise * 5, 0, 100).round()
+    elif name == 'cloud_cover':
+        values = np.clip(40 - 30 * daily + noise * 10, 0, 100).round()
+    else:
+        values = noise
+    return np.asarray(values, dtype=np.float32)
+
+
+def _variable(builder, variable, unit, values):
+    values_vector = builder.CreateNumpyVector(values)
+    builder.StartObject(4)
+    builder.PrependUint8Slot(0, variable, 0)
+    builder.PrependUint8Slot(1, unit, 0)
+    builder.PrependUOffsetTRelativeSlot(3, values_vector, 0)
+    return builder.EndObject()
+
+
+def encode_forecast(lat, lon, start, end, hourly, seed=0):
+    """Собирает ответ WeatherApiResponse с почасовыми данными (с префиксом длины, как у Open-Meteo)"""
+    builder = flatbuffers.Builder(1024)
+    interval = 3600
+    hours = np.arange(start, end, interval, dtype=np.int64)
+    variables = []
+    for name in hourly:
+        variable, unit = HOURLY_VARIABLES.get(name, (Variable.undefined, Unit.undefined))
+        variables.append(_variable(builder, variable, unit, synthetic_hourly(name, lat, lon, hours, seed)))
+
+    builder.StartVector(4, len(variables), 4)
+    for offset in reversed(variables):
+        builder.PrependUOffsetTRelative(offset)
+    variables_vector = builder.EndVector()
+
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, int(start), 0)
+    builder.PrependInt64Slot(1, int(end), 0)
+    builder.PrependInt32Slot(2, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables_vector, 0)
+    hourly_table = builder.EndObject()
+
+    timezone_name = builder.CreateString('GMT')
+    builder.StartObject(12)
+    builder.PrependFloat32Slot(0, lat, 0.0)
+    builder.PrependFloat32Slot(1, lon, 0.0)
+    builder.PrependFloat32Slot(2, 100.0, 0.0)
+    builder.PrependFloat32Slot(3, 0.1, 0.0)
+    builder.PrependUOffsetTRelativeSlot(7, timezone_name, 0)
+    builder.PrependUOffsetTRelativeSlot(8, timezone_name, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly_table, 0)
+    builder.FinishSizePrefixed(builder.EndObject())
+    return bytes(builder.Output())
+
+
+def forecast_range(query):
+    """Начало и конец почасового ряда (Unix время) по start_date/end_date или forecast_days"""
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if query.get('start_date'):
+        start = datetime.strptime(query['start_date'], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        end = datetime.strptime(query.get('end_date') or query['start_date'], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    else:
+        start = today
+        end = today + timedelta(days=int(query.get('forecast_days') or 7) - 1)
+    if end < start:
+        raise ValueError('end_date раньше start_date')
+    return int(start.timestamp()), int((end + timedelta(days=1)).timestamp())
+
+
+class FakeOpenMeteo(FakeServer):
+    """Сервер, отвечающий на запросы прогноза Open-Meteo"""
+
+    def __init__(self, recordings=None, upstream=None, **options):
+        super().__init__(**options)
+        self.recordings = recordings
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.seed = options.get('seed', 0)
+
+    def add_routes(self, app):
+        app.router.add_get('/v1/forecast', self._forecast)
+
+    def _recording_path(self, request):
+        if not self.recordings:
+            return None
+        return os.path.join(self.recordings, f"{request_key(request.query.items())}.fb")
+
+    async def _from_upstream(self, request, path):
+        async with ClientSession() as session:
+            async with session.get(f"{self.upstream}/v1/forecast", params=request.query) as response:
+                body = await response.read()
+                if response.status != 200:
+                    return web.Response(body=body, status=response.status, content_type=response.content_type)
+        if path:
+            os.makedirs(self.recordings, exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(body)
+        self.calls['upstream'] += 1
+        return web.Response(body=body, content_type='application/octet-stream')
+
+    async def _forecast(self, request):
+        self.calls['forecast'] += 1
+        await self.delay()
+        fault = self.fault()
+        if fault:
+            status, description = fault
+            return web.json_response({'error': True, 'reason': description}, status=status)
+
+        path = self._recording_path(request)
+        if path and os.path.exists(path):
+            self.calls['recorded'] += 1
+            with open(path, 'rb') as f:
+                return web.Response(body=f.read(), content_type='application/octet-stream')
+        if self.upstream:
+            return await self._from_upstream(request, path)
+
+        query = dict(request.query)
+        try:
+            latitudes = [float(value) for value in query['latitude'].split(',')]
+            longitudes = [float(value) for value in query['longitude'].split(',')]
+            if len(latitudes) != len(longitudes):
+                raise ValueError('latitude и longitude разной длины')
+            start, end = forecast_range(query)
+        except (KeyError, ValueError) as e:
+            return web.json_response({'error': True, 'reason': f"Parameter error: {e}"}, status=400)
+        # Список переменных приходит через запятую или повторяющимся параметром
+        hourly = [name for value in request.query.getall('hourly', []) for name in value.split(',') if name]
+        # Несколько координат - несколько сообщений подряд, как у настоящего API
+        body = b''.join(encode_forecast(lat, lon, start, end, hourly, self.seed)
+                        for lat, lon in zip(latitudes, longitudes))
+        return web.Response(body=body, content_type='application/octet-stream')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная заглушка Open-Meteo (FlatBuffers)')
+    add_fault_arguments(parser)
+    parser.add_argument('--recordings', help='Папка с записанными ответами')
+    parser.add_argument('--upstream', help='Записывать недостающие ответы с этого адреса, '
+                                           'например https://api.open-meteo.com')
+    args = parser.parse_args()
+    server = FakeOpenMeteo(args.recordings, args.upstream, **fault_options(args))
+    try:
+        asyncio.run(serve_forever(server))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
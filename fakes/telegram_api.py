@@ -0,0 +1,259 @@
+"""
+Локальная заглушка Telegram Bot API для нагрузочных тестов
+
+Бот подключается к ней через TELEGRAM_BASE_URL и работает как с настоящим
+Telegram: забирает апдейты через getUpdates (или получает их на вебхук после
+setWebhook) и отправляет сообщения, картинки и файлы. Тест кладет сообщения пользователей через push_message
+и читает ответы бота из очереди чата (inbox).
+"""
+
+import json
+import time
+import asyncio
+import logging
+
+from aiohttp import ClientError, ClientSession, web
+
+from fakes.base import FakeServer
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {
+    'id': 1000000001,
+    'is_bot': True,
+    'first_name': 'Announce Bot',
+    'username': 'announce_test_bot',
+    'can_join_groups': True,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+
+class FakeTelegramAPI(FakeServer):
+    """Сервер, отвечающий на методы Bot API, которые использует бот
+
+    Задержка и ошибки (см. FakeServer) применяются ко всем методам, кроме
+    getUpdates, чтобы приблизить поведение к настоящему Telegram. После
+    setWebhook апдейты доставляются POST-запросами на адрес бота по одному,
+    по порядку, с повторами при ошибках, как это делает Telegram.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, seed=0, **faults):
+        super().__init__(host, port, latency, jitter, seed=seed, **faults)
+        self.polling = asyncio.Event()
+        # Бот готов получать апдейты: вызвал getUpdates или setWebhook
+        self.connected = asyncio.Event()
+        self.webhook = None
+        self._deliveries = asyncio.Queue()
+        self._delivery_task = None
+        self._updates = []
+        self._new_update = asyncio.Event()
+        self._update_id = 0
+        self._message_id = 0
+        self._file_id = 0
+        self._inboxes = {}
+
+    def add_routes(self, app):
+        app.router.add_route('*', '/bot{token}/{method}', self._handle)
+
+    def inbox(self, chat_id):
+        """Очередь сообщений, которые бот отправил в чат"""
+        return self._inboxes.setdefault(chat_id, asyncio.Queue())
+
+    def push_update(self, update):
+        self._update_id += 1
+        update = dict(update, update_id=self._update_id)
+        if self.webhook:
+            self._deliveries.put_nowait(update)
+        else:
+            self._updates.append(update)
+            self._new_update.set()
+        return update
+
+    async def stop(self):
+        if self._delivery_task:
+            self._delivery_task.cancel()
+            await asyncio.gather(self._delivery_task, return_exceptions=True)
+            self._delivery_task = None
+        await super().stop()
+
+    async def _deliver_updates(self):
+        async with ClientSession() as session:
+            while True:
+                update = await self._deliveries.get()
+                attempt = 0
+                while self.webhook:
+                    attempt += 1
+                    self.calls['webhook_delivery'] += 1
+                    headers = {}
+                    if self.webhook['secret_token']:
+                        headers['X-Telegram-Bot-Api-Secret-Token'] = self.webhook['secret_token']
+                    try:
+                        async with session.post(self.webhook['url'], json=update, headers=headers) as response:
+                            if response.status == 200:
+                                break
+                            self.faults[f"webhook_{response.status}"] += 1
+                    except ClientError:
+                        self.faults['webhook_connection'] += 1
+                    # Telegram повторяет доставку с нарастающей паузой
+                    await asyncio.sleep(min(0.1 * attempt, 2.0))
+
+    def push_message(self, user_id, text, first_name='Организатор'):
+        """Сообщение пользователя боту в личном чате"""
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': first_name},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': first_name},
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return self.push_update({'message': message})
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        params, files = await self._read_params(request)
+        if method != 'getUpdates':
+            await self.delay()
+            fault = self.fault()
+            if fault:
+                status, description = fault
+                return web.json_response({'ok': False, 'error_code': status, 'description': description,
+                                          'parameters': {'retry_after': 1} if status == 429 else {}},
+                                         status=status)
+
+        handler = getattr(self, f"_method_{method}", None)
+        if handler is None:
+            return web.json_response({'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'},
+                                     status=404)
+        try:
+            result = await handler(params, files)
+        except (KeyError, ValueError) as e:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'},
+                                     status=400)
+        return web.json_response({'ok': True, 'result': result})
+
+    @staticmethod
+    async def _read_params(request):
+        if request.content_type == 'application/json':
+            return await request.json(), {}
+        params, files = {}, {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, web.FileField):
+                files[key] = value
+            else:
+                params[key] = value
+        return params, files
+
+    @staticmethod
+    def _json_param(params, key):
+        value = params.get(key)
+        return json.loads(value) if isinstance(value, str) else value
+
+    def _next_file_id(self, prefix):
+        self._file_id += 1
+        return f"{prefix}-{self._file_id}", f"unique-{self._file_id}"
+
+    def _photo(self, value):
+        if isinstance(value, str):
+            # Повторная отправка по file_id
+            file_id, unique_id = value, f"unique-{value}"
+        else:
+            file_id, unique_id = self._next_file_id('photo')
+        return [{'file_id': file_id, 'file_unique_id': unique_id, 'width': 1000, 'height': 1000}]
+
+    def _document(self, value):
+        if isinstance(value, str):
+            return {'file_id': value, 'file_unique_id': f"unique-{value}"}
+        file_id, unique_id = self._next_file_id('document')
+        return {'file_id': file_id, 'file_unique_id': unique_id, 'file_name': value.filename}
+
+    def _message(self, params, **content):
+        chat_id = int(params['chat_id'])
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            **content,
+        }
+        reply_markup = self._json_param(params, 'reply_markup')
+        # Обычную клавиатуру Telegram в ответе не возвращает, а тесту она нужна, чтобы нажимать кнопки
+        self.inbox(chat_id).put_nowait(dict(message, reply_markup=reply_markup) if reply_markup else message)
+        if reply_markup and 'inline_keyboard' in reply_markup:
+            message['reply_markup'] = reply_markup
+        return message
+
+    async def _method_getMe(self, params, files):
+        return BOT_USER
+
+    async def _method_setWebhook(self, params, files):
+        self.webhook = {'url': params['url'], 'secret_token': params.get('secret_token') or ''}
+        # Апдейты, которые еще не забрали через getUpdates, уходят на вебхук
+        for update in self._updates:
+            self._deliveries.put_nowait(update)
+        self._updates = []
+        if self._delivery_task is None:
+            self._delivery_task = asyncio.create_task(self._deliver_updates())
+        self.connected.set()
+        return True
+
+    async def _method_deleteWebhook(self, params, files):
+        self.webhook = None
+        return True
+
+    async def _method_getWebhookInfo(self, params, files):
+        return {'url': self.webhook['url'] if self.webhook else '', 'has_custom_certificate': False,
+                'pending_update_count': self._deliveries.qsize() if self.webhook else len(self._updates)}
+
+    async def _method_setMyCommands(self, params, files):
+        return True
+
+    async def _method_getUpdates(self, params, files):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+        self.polling.set()
+        self.connected.set()
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def _method_sendMessage(self, params, files):
+        return self._message(params, text=params['text'])
+
+    async def _method_sendPhoto(self, params, files):
+        photo = files.get('photo') or params['photo']
+        return self._message(params, photo=self._photo(photo), caption=params.get('caption', ''))
+
+    async def _method_sendDocument(self, params, files):
+        document = files.get('document') or params['document']
+        return self._message(params, document=self._document(document), caption=params.get('caption', ''))
+
+    async def _method_editMessageText(self, params, files):
+        return self._message(params, text=params['text'], message_id=int(params['message_id']))
+
+    async def _method_editMessageCaption(self, params, files):
+        return self._message(params, caption=params.get('caption', ''), photo=self._photo('edited'),
+                             message_id=int(params['message_id']))
+
+    async def _method_editMessageMedia(self, params, files):
+        media = self._json_param(params, 'media')
+        source = media['media']
+        if source.startswith('attach://'):
+            source = files[source[len('attach://'):]]
+        return self._message(params, photo=self._photo(source), caption=media.get('caption', ''),
+                             message_id=int(params['message_id']))
+
+    async def _method_deleteMessage(self, params, files):
+        return True
@@ -0,0 +1,179 @@
+"""
+Кэш file_id Telegram для уже загруженных файлов
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from telegram.error import BadRequest
+
+from executors import run_blocking
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних файлов помнят свой хеш; файлы дашбордов уникальны для
+# каждого анонса, поэтому без лимита память росла бы все время работы бота
+HASH_CACHE_SIZE = 1024
+
+
+def read_file_bytes(path):
+    """Читает файл целиком"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def file_sha256(path):
+    """Считает sha256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileIdCache:
+    """Постоянный кэш: хеш содержимого файла -> file_id
+
+    После первой загрузки Telegram возвращает file_id, по которому тот же файл
+    можно отправлять повторно без загрузки байтов. file_id действителен только
+    для бота, который его получил, поэтому записи хранятся отдельно для каждого
+    токена (в файле лежит хеш токена, а не сам токен).
+
+    Если задано общее хранилище (store, см. shared_store.py), записи читаются
+    и пишутся в нем, а не в файле, чтобы кэш был общим для процессов бота.
+
+    Методы делают файловый ввод-вывод и вызываются через run_blocking,
+    поэтому защищены блокировкой.
+    """
+
+    def __init__(self, path, token, store=None):
+        self.path = path
+        self.namespace = hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]
+        self.store = store
+        self._data = None
+        # путь -> (mtime, размер, хеш), чтобы не перечитывать неизменившиеся файлы;
+        # давно не нужные файлы вытесняются (LRU, не больше HASH_CACHE_SIZE)
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entries(self):
+        if self._data is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f)
+            except FileNotFoundError:
+                self._data = {}
+            except (json.JSONDecodeError, OSError) as e:
+                logger.error(f"Ошибка при чтении кэша file_id {self.path}: {e}")
+                self._data = {}
+        return self._data.setdefault(self.namespace, {})
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Ошибка при сохранении кэша file_id {self.path}: {e}")
+
+    def content_hash(self, path):
+        """Возвращает хеш содержимого файла, пересчитывая его только при изменении файла"""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._hashes.get(key)
+            if cached is not None and cached[:2] == version:
+                self._hashes.move_to_end(key)
+                return cached[2]
+        content_hash = file_sha256(path)
+        with self._lock:
+            self._hashes[key] = (*version, content_hash)
+            self._hashes.move_to_end(key)
+            while len(self._hashes) > HASH_CACHE_SIZE:
+                self._hashes.popitem(last=False)
+        return content_hash
+
+    def forget(self, path):
+        """Забывает хеш удаленного файла"""
+        with self._lock:
+            self._hashes.pop(os.path.abspath(path), None)
+
+    def lookup(self, path):
+        """Возвращает хеш содержимого файла и сохраненный для него file_id (или None)"""
+        content_hash = self.content_hash(path)
+        return content_hash, self.get(content_hash)
+
+    @property
+    def _store_namespace(self):
+        return f"file_ids:{self.namespace}"
+
+    def get(self, content_hash):
+        if self.store is not None:
+            value = self.store.get(self._store_namespace, content_hash)
+            return value.decode('utf-8') if value is not None else None
+        with self._lock:
+            return self._entries().get(content_hash)
+
+    def set(self, content_hash, file_id):
+        if self.store is not None:
+            self.store.set(self._store_namespace, content_hash, file_id.encode('utf-8'))
+            return
+        with self._lock:
+            entries = self._entries()
+            if entries.get(content_hash) != file_id:
+                entries[content_hash] = file_id
+                self._save()
+
+    def discard(self, content_hash):
+        if self.store is not None:
+            self.store.delete(self._store_namespace, content_hash)
+            return
+        with self._lock:
+            if self._entries().pop(content_hash, None) is not None:
+                self._save()
+
+
+def _sent_file_id(message, kind):
+    """Достает file_id из отправленного сообщения"""
+    if message is None:
+        return None
+    if kind == 'photo':
+        return message.photo[-1].file_id if message.photo else None
+    attachment = getattr(message, kind, None)
+    return attachment.file_id if attachment else None
+
+
+async def send_file_cached(cache, send, path, kind='photo', **kwargs):
+    """Отправляет файл через send (например, message.reply_photo), используя file_id из кэша
+
+    kind - имя параметра с файлом у send ('photo' или 'document').
+    Если Telegram не принял сохраненный file_id, файл загружается заново.
+    """
+    with span(f'telegram.send_{kind}') as send_span:
+        content_hash, file_id = await run_blocking(cache.lookup, path)
+        if file_id:
+            # Имя файла задается только при загрузке, для file_id оно не нужно
+            file_kwargs = {key: value for key, value in kwargs.items() if key != 'filename'}
+            try:
+                message = await send(**{kind: file_id}, **file_kwargs)
+                send_span.set('uploaded', False)
+                return message
+            except BadRequest as e:
+                logger.warning(f"file_id для {path} не принят Telegram ({e}), загружаем файл заново")
+                await run_blocking(cache.discard, content_hash)
+
+        data = await run_blocking(read_file_bytes, path)
+        send_span.set('uploaded', True)
+        send_span.set('bytes', len(data))
+        message = await send(**{kind: data}, **kwargs)
+        sent_file_id = _sent_file_id(message, kind)
+        if sent_file_id:
+            await run_blocking(cache.set, content_hash, sent_file_id)
+        return message
@@ -0,0 +1,204 @@
+"""
+Генератор синтетических GPX треков для бенчмарков и нагрузочных тестов
+
+Пишет GPX в формате экспорта Komoot (метаданные с описанием, ссылкой на
+тур и автором, время и высота у каждой точки) заданной длины и плотности
+точек. Форма маршрута - кольцо, "туда и обратно" или маршрут из точки в
+точку; высота - холмы с шумом, время - движение с неровной скоростью.
+
+Пример:
+    python3 gpx_generator.py track.gpx --length 150 --points 100000 --shape out-and-back --seed 1
+"""
+
+import sys
+import math
+import zlib
+import argparse
+from xml.sax.saxutils import escape
+from datetime import datetime, timedelta
+
+import numpy as np
+
+SHAPES = ('loop', 'out-and-back', 'point-to-point')
+
+# Нови-Сад - старт по умолчанию, как у большинства маршрутов бота
+DEFAULT_START = (45.2671, 19.8335)
+
+METERS_PER_DEGREE = 111320
+
+
+def _loop_path(rng, vertices):
+    """Замкнутый контур: окружность с искажениями от нескольких гармоник"""
+    theta = np.linspace(0, 2 * math.pi, vertices)
+    radius = np.ones(vertices)
+    for k in range(2, 7):
+        radius += rng.uniform(0, 0.25 / k) * np.cos(k * theta + rng.uniform(0, 2 * math.pi))
+    # Кольцо начинается и заканчивается в старте (точка (0, 0))
+    return radius * np.sin(theta), radius[0] - radius * np.cos(theta)
+
+
+def _random_walk(rng, vertices):
+    """Извилистая дорога: направление плавно меняется на каждом шаге"""
+    heading = rng.uniform(0, 2 * math.pi) + np.cumsum(rng.normal(0, 0.15, vertices - 1))
+    x = np.concatenate(([0.0], np.cumsum(np.cos(heading))))
+    y = np.concatenate(([0.0], np.cumsum(np.sin(heading))))
+    return x, y
+
+
+def _shape_path(shape, rng, vertices):
+    if shape == 'loop':
+        return _loop_path(rng, vertices)
+    if shape == 'out-and-back':
+        # Та же дорога в обе стороны: путь туда и он же в обратном порядке
+        x, y = _random_walk(rng, vertices // 2 + 1)
+        return np.concatenate((x, x[-2::-1])), np.concatenate((y, y[-2::-1]))
+    if shape == 'point-to-point':
+        return _random_walk(rng, vertices)
+    raise ValueError(f"Неизвестная форма маршрута: {shape} (доступны: {', '.join(SHAPES)})")
+
+
+def generate_track(length_km=100.0, points=None, points_per_km=50, shape='loop', seed=0, start=DEFAULT_START,
+                   start_time=None, speed_kmh=25.0, elevation_m=80.0, hills_m=40.0, noise_m=1.5):
+    """Генерирует точки трека
+
+    Количество точек задается явно (points) или плотностью (points_per_km).
+    Возвращает массивы широт, долгот, высот и список времени точек.
+    """
+    if length_km <= 0:
+        raise ValueError("Длина маршрута должна быть больше нуля")
+    points = int(points or max(2, round(length_km * points_per_km)))
+    if points < 2:
+        raise ValueError("В треке должно быть хотя бы 2 точки")
+    rng = np.random.default_rng(seed)
+    length_m = length_km * 1000
+
+    # Форма маршрута в условных единицах, затем масштабируем до нужной длины
+    x, y = _shape_path(shape, rng, max(200, int(length_km * 10)))
+    distances = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+    scale = length_m / distances[-1]
+
+    # Равномерно расставляем точки по длине маршрута
+    along = np.linspace(0, length_m, points)
+    east = np.interp(along, distances * scale, x * scale)
+    north = np.interp(along, distances * scale, y * scale)
+    lat0, lon0 = start
+    lats = lat0 + north / METERS_PER_DEGREE
+    lons = lon0 + east / (METERS_PER_DEGREE * math.cos(math.radians(lat0)))
+
+    # Холмы разного масштаба плюс шум барометра
+    elevations = np.full(points, float(elevation_m))
+    for wavelength_m, share in ((20000, 0.6), (5000, 0.3), (1000, 0.1)):
+        elevations += hills_m * share * np.sin(2 * math.pi * along / wavelength_m + rng.uniform(0, 2 * math.pi))
+    elevations += rng.normal(0, noise_m, points)
+
+    # Скорость меняется от точки к точке, но в среднем равна speed_kmh
+    start_time = start_time or datetime(2025, 6, 1, 8, 0, 0)
+    step_seconds = (length_m / (points - 1)) / (speed_kmh / 3.6)
+    offsets = np.concatenate(([0.0], np.cumsum(step_seconds * rng.uniform(0.7, 1.3, points - 1))))
+    times = [start_time + timedelta(seconds=float(offset)) for offset in offsets]
+    return lats, lons, elevations, times
+
+
+def _split(count, parts):
+    """Границы частей: соседние части делят общую точку, как сегменты Komoot"""
+    bounds = np.linspace(0, count - 1, parts + 1).round().astype(int)
+    return [(int(bounds[i]), int(bounds[i + 1]) + 1) for i in range(parts)]
+
+
+def write_gpx(path, lats, lons, elevations, times, name='Synthetic route', tour_id=None, tracks=1, segments=1):
+    """Пишет трек в GPX, разбивая его на tracks треков по segments сегментов
+
+    Соседние треки и сегменты начинаются с последней точки предыдущего, поэтому
+    при разбиении в файле на tracks * segments - 1 точек больше.
+    """
+    tour_id = tour_id or zlib.crc32(f"{name}:{len(lats)}".encode('utf-8'))
+    tour_link = f"https://www.komoot.com/tour/{tour_id}"
+    distance_km = float(np.sum(np.hypot(
+        np.diff(lats) * METERS_PER_DEGREE,
+        np.diff(lons) * METERS_PER_DEGREE * np.cos(np.radians(lats[:-1]))
+    ))) / 1000
+    climbs = np.diff(elevations)
+    duration_h = (times[-1] - times[0]).total_seconds() / 3600
+    name = escape(name)
+    desc = (f"Distance: {distance_km:.3f}km, Estimated duration: {duration_h:.2f}h, "
+            f"Elevation up: {float(climbs[climbs > 0].sum())}m, Elevation down: {float(-climbs[climbs < 0].sum())}m, "
+            f"Grade: moderate")
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<gpx xmlns="http://www.topografix.com/GPX/1/1" '
+                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd" '
+                'version="1.1" creator="gpx_generator">\n'
+                '  <metadata>\n'
+                f'    <name>{name}</name>\n'
+                f'    <desc>{desc}</desc>\n'
+                '    <author>\n'
+                '      <name>Synthetic</name>\n'
+                '    </author>\n'
+                f'    <link href="{tour_link}">\n'
+                '      <text>View tour on Komoot</text>\n'
+                '    </link>\n'
+                '  </metadata>\n')
+        for track_number, (track_start, track_end) in enumerate(_split(len(lats), tracks), 1):
+            track_name = name if tracks == 1 else f"{name} ({track_number})"
+            f.write('  <trk>\n'
+                    f'    <name>{track_name}</name>\n'
+                    f'    <desc>{desc}</desc>\n'
+                    f'    <link href="{tour_link}">\n'
+                    '      <text>View tour on Komoot</text>\n'
+                    '    </link>\n')
+            for seg_start, seg_end in _split(track_end - track_start, segments):
+                f.write('    <trkseg>\n')
+                f.writelines(
+                    f'      <trkpt lat="{lats[i]:.6f}" lon="{lons[i]:.6f}">\n'
+                    f'        <ele>{elevations[i]:.1f}</ele>\n'
+                    f'        <time>{times[i].strftime("%Y-%m-%dT%H:%M:%S.%fZ")}</time>\n'
+                    '      </trkpt>\n'
+                    for i in range(track_start + seg_start, track_start + seg_end)
+                )
+                f.write('    </trkseg>\n')
+            f.write('  </trk>\n')
+        f.write('</gpx>\n')
+    return path
+
+
+def generate_gpx(path, length_km=100.0, points=None, points_per_km=50, shape='loop', tracks=1, segments=1,
+                 seed=0, name=None, tour_id=None, **track_options):
+    """Генерирует трек и сразу пишет его в GPX файл"""
+    lats, lons, elevations, times = generate_track(length_km, points, points_per_km, shape, seed, **track_options)
+    name = name or f"Synthetic {shape} {length_km:g} km"
+    return write_gpx(path, lats, lons, elevations, times, name, tour_id, tracks, segments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор синтетических GPX треков в стиле Komoot')
+    parser.add_argument('output', help='Путь к GPX файлу')
+    parser.add_argument('-l', '--length', type=float, default=100.0, help='Длина маршрута в км (по умолчанию: 100)')
+    density = parser.add_mutually_exclusive_group()
+    density.add_argument('-p', '--points', type=int, help='Количество точек трека')
+    density.add_argument('--density', type=float, default=50, help='Точек на километр (по умолчанию: 50)')
+    parser.add_argument('--shape', choices=SHAPES, default='loop', help='Форма маршрута (по умолчанию: loop)')
+    parser.add_argument('--tracks', type=int, default=1, help='Количество треков в файле (по умолчанию: 1)')
+    parser.add_argument('--segments', type=int, default=1, help='Сегментов в каждом треке (по умолчанию: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Зерно генератора случайных чисел (по умолчанию: 0)')
+    parser.add_argument('--name', help='Название маршрута в метаданных')
+    parser.add_argument('--tour-id', help='ID тура Komoot в ссылке')
+    parser.add_argument('--speed', type=float, default=25.0, help='Средняя скорость в км/ч (по умолчанию: 25)')
+    parser.add_argument('--start-time', help='Время старта в формате ГГГГ-ММ-ДДTЧЧ:ММ')
+
+    args = parser.parse_args()
+    if args.tracks < 1 or args.segments < 1:
+        parser.error('Треков и сегментов должно быть хотя бы по одному')
+    try:
+        start_time = datetime.strptime(args.start_time, '%Y-%m-%dT%H:%M') if args.start_time else None
+        generate_gpx(args.output, args.length, args.points, args.density, args.shape, args.tracks, args.segments,
+                     args.seed, args.name, args.tour_id, start_time=start_time, speed_kmh=args.speed)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"✅ GPX записан: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Запись JSON lines из фонового потока
+
+Строки копятся в очереди и дописываются в файл фоновым потоком, поэтому
+event loop не ждет файловой системы. Накопившиеся строки пишутся одним
+вызовом write в режиме добавления, поэтому несколько процессов могут
+писать в один файл одновременно. Используется для трасс (tracing.py) и
+записи апдейтов (update_recorder.py).
+"""
+
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class JsonLinesWriter:
+    """Дописывает записи в файл по одному JSON на строку из фонового потока
+
+    Поток запускается при первой записи; при выходе из процесса очередь
+    дописывается (flush). kind - что пишется, для сообщений об ошибках.
+    """
+
+    def __init__(self, path, thread_name='jsonl-writer', kind='записи'):
+        self.path = path
+        self.thread_name = thread_name
+        self.kind = kind
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = 0
+        self._written = threading.Condition(self._lock)
+
+    def write(self, record):
+        """Ставит запись в очередь на запись в файл"""
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            self._pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        self._queue.put(line)
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(''.join(lines))
+            with self._lock:
+                self._pending -= len(lines)
+                self._written.notify_all()
+
+    def _write(self, data):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(data)
+        except OSError as e:
+            logger.error(f"Ошибка при записи {self.kind} в {self.path}: {e}")
+
+    def flush(self, timeout=5.0):
+        """Дожидается записи всего, что стоит в очереди; False - не дождались за timeout"""
+        with self._lock:
+            return self._written.wait_for(lambda: self._pending == 0, timeout)
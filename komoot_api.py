@@ -0,0 +1,38 @@
+"""
+Запуск komootgpx с другим адресом Komoot API
+
+komootgpx обращается к https://api.komoot.de напрямую и не позволяет его
+поменять. Этот модуль подставляет вместо него KOMOOT_BASE_URL (например,
+локальную заглушку fakes/komoot.py) и запускает komootgpx с теми же
+аргументами. Бот использует его сам, если задан KOMOOT_BASE_URL.
+
+Пример:
+    KOMOOT_BASE_URL=http://127.0.0.1:8082 python3 komoot_api.py -d 123456 -o cache -e -n
+"""
+
+import os
+import sys
+
+KOMOOT_API_URL = 'https://api.komoot.de'
+KOMOOT_BASE_URL = os.getenv('KOMOOT_BASE_URL', '').rstrip('/')
+
+
+def rewrite_url(url, base_url=KOMOOT_BASE_URL):
+    """Заменяет адрес Komoot API в URL запроса на base_url"""
+    if base_url and url.startswith(KOMOOT_API_URL):
+        return base_url + url[len(KOMOOT_API_URL):]
+    return url
+
+
+def main():
+    from komootgpx import api, komootgpx
+
+    # komootgpx делает все запросы через requests.get в модуле api
+    original_get = api.requests.get
+    api.requests.get = lambda url, *args, **kwargs: original_get(rewrite_url(url), *args, **kwargs)
+    sys.argv[0] = 'komootgpx'
+    return komootgpx.entrypoint()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Воспроизведение записанных апдейтов (update_recorder.py) против заглушки Bot API
+
+Запускает bot.py отдельным процессом, как loadtest.run, и подает ему апдейты
+из записи с исходными паузами, деленными на --speed. Все исходящие вызовы
+бота принимают заглушки Bot API, Komoot и Open-Meteo. Для каждого апдейта
+замеряется время до первого ответа бота в том же чате; в конце печатаются
+перцентили, процессорное время и пиковая память бота. С --compare
+результаты сравниваются с прошлым запуском, например со старой версией
+бота. С --webhook бот работает в режиме вебхука, и заглушка отправляет ему
+апдейты POST-запросами, как Telegram.
+
+Пример:
+    python3 -m loadtest.replay logs/updates.jsonl --speed 10 --json new.json --compare old.json
+    python3 -m loadtest.replay logs/updates.jsonl --bot ../announce_bot_old/bot.py --json old.json
+    python3 -m loadtest.replay logs/updates.jsonl --webhook
+"""
+
+import os
+import json
+import time
+import shutil
+import asyncio
+import argparse
+
+from loadtest.run import (
+    ROOT, FakeServices, percentile, prepare_workdir, process_usage, start_bot, stop_bot, webhook_env
+)
+from update_recorder import read_records
+
+# Содержимое апдейта, в котором бывает сообщение с чатом и временем отправки
+MESSAGE_KEYS = ('message', 'edited_message', 'channel_post', 'edited_channel_post')
+# Бот считается закончившим работу, если столько секунд не присылал сообщений
+QUIET_SECONDS = 2.0
+
+
+def update_chat_id(update):
+    for key in MESSAGE_KEYS:
+        if key in update:
+            return update[key].get('chat', {}).get('id')
+    callback = update.get('callback_query')
+    if callback:
+        return (callback.get('message') or {}).get('chat', {}).get('id') or callback.get('from', {}).get('id')
+    return None
+
+
+def refresh_dates(update):
+    """Ставит сообщениям текущее время: в записи его нет, а Bot API его требует"""
+    now = int(time.time())
+    for key in MESSAGE_KEYS:
+        if key in update:
+            update[key] = dict(update[key], date=now)
+    callback = update.get('callback_query')
+    if callback and callback.get('message'):
+        update['callback_query'] = dict(callback, message=dict(callback['message'], date=now))
+    return update
+
+
+class ReplyTracker:
+    """Сопоставляет ответы бота с апдейтами
+
+    Ответ засчитывается последнему отправленному в чат апдейту, на который
+    еще не было ответа. При воспроизведении в 1x это точно; при сильном
+    ускорении апдейты одного чата могут догнать друг друга, и часть ответов
+    достанется более позднему апдейту.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.latencies = []
+        self.sent = 0
+        self.last_reply = time.perf_counter()
+        self._last = {}
+        self._watchers = {}
+
+    def pushed(self, chat_id):
+        self.sent += 1
+        if chat_id is None:
+            return
+        self._last[chat_id] = [time.perf_counter(), False]
+        if chat_id not in self._watchers:
+            self._watchers[chat_id] = asyncio.create_task(self._watch(chat_id))
+
+    async def _watch(self, chat_id):
+        inbox = self.api.inbox(chat_id)
+        while True:
+            await inbox.get()
+            self.last_reply = time.perf_counter()
+            last = self._last.get(chat_id)
+            if last and not last[1]:
+                last[1] = True
+                self.latencies.append(time.perf_counter() - last[0])
+
+    @property
+    def waiting(self):
+        return sum(1 for _, answered in self._last.values() if not answered)
+
+    async def close(self):
+        for task in self._watchers.values():
+            task.cancel()
+        await asyncio.gather(*self._watchers.values(), return_exceptions=True)
+
+
+async def replay(records, speed=1.0, max_gap=None, drain_seconds=30.0, bot_path=os.path.join(ROOT, 'bot.py'),
+                 keep_workdir=False, startup_timeout=60.0, webhook=False):
+    """Воспроизводит записи и возвращает словарь с результатами"""
+    services = await FakeServices().start()
+    api = services.telegram
+    workdir = prepare_workdir(os.path.dirname(os.path.abspath(bot_path)))
+    log_path = os.path.join(workdir, 'bot.log')
+    process = start_bot(services, workdir, log_path, webhook_env() if webhook else None, bot_path=bot_path)
+    tracker = ReplyTracker(api)
+    try:
+        try:
+            await asyncio.wait_for(api.connected.wait(), startup_timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"Бот не начал получать апдейты за {startup_timeout:.0f} с, лог: {log_path}")
+
+        started = time.perf_counter()
+        tracker.last_reply = started
+        for gap, update in records:
+            if max_gap is not None:
+                gap = min(gap, max_gap)
+            if gap:
+                await asyncio.sleep(gap / speed)
+            api.push_update(refresh_dates(dict(update)))
+            tracker.pushed(update_chat_id(update))
+        pushed_all = time.perf_counter()
+
+        # Ждем ответов на последние апдейты и окончания фоновой работы бота
+        deadline = time.perf_counter() + drain_seconds
+        while time.perf_counter() < deadline:
+            if not tracker.waiting and time.perf_counter() - tracker.last_reply > QUIET_SECONDS:
+                break
+            await asyncio.sleep(0.1)
+        duration = max(pushed_all, tracker.last_reply) - started
+        usage = process_usage(process.pid)
+    finally:
+        await tracker.close()
+        stop_bot(process)
+        await services.stop()
+        if keep_workdir:
+            print(f"📁 Рабочая папка бота: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = tracker.latencies
+    return {
+        'bot': bot_path,
+        'speed': speed,
+        'mode': 'webhook' if webhook else 'polling',
+        'updates': tracker.sent,
+        'answered': len(latencies),
+        'duration_s': round(duration, 3),
+        'p50_s': percentile(latencies, 50),
+        'p95_s': percentile(latencies, 95),
+        'p99_s': percentile(latencies, 99),
+        'max_s': max(latencies) if latencies else None,
+        'api_calls': services.calls(),
+        **usage,
+    }
+
+
+COMPARED = (
+    ('answered', 'ответов', 1),
+    ('p50_s', 'p50, мс', 1000),
+    ('p95_s', 'p95, мс', 1000),
+    ('p99_s', 'p99, мс', 1000),
+    ('cpu_seconds', 'CPU, с', 1),
+    ('peak_rss_bytes', 'пик RSS, МБ', 1 / (1024 * 1024)),
+)
+
+
+def format_report(result, baseline=None):
+    """Таблица результатов; с baseline - рядом значения прошлого запуска и разница"""
+    lines = [f"Апдейтов: {result['updates']}, за {result['duration_s']:.1f} с"]
+    header = f"{'':<14} {'сейчас':>10}"
+    if baseline:
+        header += f" {'было':>10} {'разница':>9}"
+    lines += [header, '-' * len(header)]
+    for key, title, scale in COMPARED:
+        value = result.get(key)
+        line = f"{title:<14} {value * scale if value is not None else float('nan'):>10.1f}"
+        if baseline:
+            old = baseline.get(key)
+            line += f" {old * scale if old is not None else float('nan'):>10.1f}"
+            if value is not None and old:
+                line += f" {(value - old) / old:>+9.1%}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанных апдейтов против заглушки Bot API')
+    parser.add_argument('record', help='Файл записи (UPDATE_RECORD_FILE)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Во сколько раз сократить паузы между апдейтами (по умолчанию: 1)')
+    parser.add_argument('--max-gap', type=float, help='Ограничить паузу между апдейтами, с (до ускорения)')
+    parser.add_argument('--drain', type=float, default=30.0, help='Сколько ждать ответов в конце, с')
+    parser.add_argument('--bot', default=os.path.join(ROOT, 'bot.py'), help='Путь к bot.py проверяемой версии')
+    parser.add_argument('--json', help='Сохранить результаты в JSON')
+    parser.add_argument('--compare', help='JSON прошлого запуска для сравнения')
+    parser.add_argument('--keep-workdir', action='store_true', help='Не удалять рабочую папку бота с логом')
+    parser.add_argument('--webhook', action='store_true', help='Доставлять апдейты на вебхук бота вместо getUpdates')
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        parser.error('--speed должен быть больше нуля')
+    records = read_records(args.record)
+    if not records:
+        parser.error(f"В {args.record} нет апдейтов")
+    result = asyncio.run(replay(records, args.speed, args.max_gap, args.drain, os.path.abspath(args.bot),
+                                args.keep_workdir, webhook=args.webhook))
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print(format_report(result, baseline))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Результаты сохранены: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
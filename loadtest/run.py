@@ -0,0 +1,289 @@
+"""
+Нагрузочный тест: N организаторов одновременно создают анонсы
+
+Запускает настоящий bot.py отдельным процессом против локальных заглушек
+Bot API, Komoot и Open-Meteo, прогоняет сценарий от /start до отправки
+анонса (со скачиванием GPX и дашбордом погоды) для каждого уровня нагрузки
+и печатает пропускную способность, p50/p95/p99 времени шага и долю ошибок.
+
+Пример:
+    python3 -m loadtest.run --users 1,10,50 --json loadtest.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+
+from fakes.komoot import FakeKomootAPI
+from fakes.open_meteo import FakeOpenMeteo
+from fakes.telegram_api import FakeTelegramAPI
+from loadtest.scenario import ANNOUNCE_SCENARIO, NO_DASHBOARD_SCENARIO, SimulatedUser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_FILES = ('start_points.json', 'finish_points.json', 'routes.json', 'ready_routes.json')
+TOKEN = '123456:LOADTEST'
+
+# ID пользователей и туров нагрузочного теста не пересекаются с настоящими
+FIRST_USER_ID = 900000000
+FIRST_TOUR_ID = 9000000000
+DISPATCHER_PATH = os.path.join(ROOT, 'dispatcher.py')
+
+
+def percentile(values, q):
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class LevelStats:
+    """Результаты одного уровня нагрузки"""
+
+    def __init__(self, users):
+        self.users = users
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(list)
+        self.completed = 0
+        self.duration = 0.0
+
+    def observe(self, step, seconds):
+        self.latencies[step].append(seconds)
+
+    def error(self, step, reason):
+        self.errors[step].append(reason)
+
+    def summary(self):
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        error_count = sum(len(reasons) for reasons in self.errors.values())
+        attempted = len(all_latencies) + error_count
+        return {
+            'users': self.users,
+            'completed': self.completed,
+            'duration_s': round(self.duration, 3),
+            'steps': len(all_latencies),
+            'throughput_steps_per_s': round(len(all_latencies) / self.duration, 2) if self.duration else 0,
+            'announces_per_min': round(self.completed / self.duration * 60, 2) if self.duration else 0,
+            'p50_s': percentile(all_latencies, 50),
+            'p95_s': percentile(all_latencies, 95),
+            'p99_s': percentile(all_latencies, 99),
+            'error_rate': round(error_count / attempted, 4) if attempted else 0,
+            'steps_detail': {
+                step: {'p50_s': percentile(values, 50), 'p95_s': percentile(values, 95), 'count': len(values)}
+                for step, values in self.latencies.items()
+            },
+            'errors': {step: reasons[:5] for step, reasons in self.errors.items()},
+        }
+
+
+def prepare_workdir(source=ROOT):
+    """Рабочая папка бота: настройки из репозитория и отдельный кэш, чтобы не трогать настоящий"""
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    for name in CONFIG_FILES:
+        if os.path.exists(os.path.join(source, name)):
+            shutil.copy2(os.path.join(source, name), workdir)
+    # Бот запускает внешний модуль дашборда по относительному пути
+    os.symlink(os.path.join(source, 'weather_dashboard.py'), os.path.join(workdir, 'weather_dashboard.py'))
+    return workdir
+
+
+def process_usage(pid):
+    """Процессорное время (с) и пиковая резидентная память (байты) процесса из /proc
+
+    Работает только в Linux; в остальных системах возвращает None вместо значений.
+    """
+    cpu_seconds = peak_rss = None
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            # Имя процесса в скобках может содержать пробелы, поэтому поля считаем после ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    peak_rss = int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return {'cpu_seconds': cpu_seconds, 'peak_rss_bytes': peak_rss}
+
+
+class FakeServices:
+    """Заглушки Telegram, Komoot и Open-Meteo, с которыми работает бот под нагрузкой"""
+
+    def __init__(self, telegram_latency=0.0, komoot_latency=0.0, open_meteo_latency=0.0, seed=0):
+        self.telegram = FakeTelegramAPI(latency=telegram_latency, jitter=telegram_latency / 2, seed=seed)
+        self.komoot = FakeKomootAPI(latency=komoot_latency, jitter=komoot_latency / 2, seed=seed)
+        self.open_meteo = FakeOpenMeteo(latency=open_meteo_latency, jitter=open_meteo_latency / 2, seed=seed)
+
+    async def start(self):
+        for server in (self.telegram, self.komoot, self.open_meteo):
+            await server.start()
+        return self
+
+    async def stop(self):
+        for server in (self.telegram, self.komoot, self.open_meteo):
+            await server.stop()
+
+    def bot_env(self):
+        return {
+            'TELEGRAM_TOKEN': TOKEN,
+            'TELEGRAM_BASE_URL': self.telegram.url,
+            'KOMOOT_BASE_URL': self.komoot.url,
+            'OPEN_METEO_URL': self.open_meteo.url,
+        }
+
+    def calls(self):
+        return {'telegram': dict(self.telegram.calls), 'komoot': dict(self.komoot.calls),
+                'open_meteo': dict(self.open_meteo.calls)}
+
+
+def webhook_env():
+    """Переменные окружения, с которыми бот получает апдейты на вебхук на свободном локальном порту"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return {'WEBHOOK_URL': f"http://127.0.0.1:{port}", 'WEBHOOK_LISTEN': '127.0.0.1', 'WEBHOOK_PORT': str(port),
+            'WEBHOOK_SECRET': f"loadtest-{port}"}
+
+
+def start_bot(services, workdir, log_path, extra_env=None, bot_path=os.path.join(ROOT, 'bot.py')):
+    env = dict(os.environ)
+    env.update(services.bot_env())
+    env['PYTHONUNBUFFERED'] = '1'
+    env.update(extra_env or {})
+    log = open(log_path, 'w')
+    try:
+        return subprocess.Popen([sys.executable, bot_path], cwd=workdir, env=env,
+                                stdout=log, stderr=subprocess.STDOUT)
+    finally:
+        log.close()
+
+
+def stop_bot(process, timeout=15):
+    if process.poll() is not None:
+        return
+    # run_polling корректно завершается по SIGINT
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def run_level(api, users, level, scenario=ANNOUNCE_SCENARIO, step_timeout=120.0, think_time=0.0,
+                    ramp_seconds=0.0):
+    """Прогоняет сценарий для users одновременных пользователей"""
+    stats = LevelStats(users)
+    base = FIRST_USER_ID + level * 100000
+
+    async def one_user(i):
+        if ramp_seconds:
+            await asyncio.sleep(ramp_seconds * i / users)
+        user = SimulatedUser(api, base + i, FIRST_TOUR_ID + base + i, step_timeout, think_time)
+        if await user.run(scenario, stats):
+            stats.completed += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_user(i) for i in range(users)))
+    stats.duration = time.perf_counter() - started
+    return stats
+
+
+def format_report(summaries):
+    header = f"{'users':>6} {'done':>5} {'time, s':>8} {'steps/s':>8} {'ann/min':>8} " \
+             f"{'p50, ms':>8} {'p95, ms':>8} {'p99, ms':>8} {'errors':>7}"
+    lines = [header, '-' * len(header)]
+
+    def ms(value):
+        return f"{value * 1000:8.0f}" if value is not None else f"{'-':>8}"
+
+    for s in summaries:
+        lines.append(f"{s['users']:>6} {s['completed']:>5} {s['duration_s']:>8.1f} "
+                     f"{s['throughput_steps_per_s']:>8.1f} {s['announces_per_min']:>8.1f} "
+                     f"{ms(s['p50_s'])} {ms(s['p95_s'])} {ms(s['p99_s'])} {s['error_rate']:>7.1%}")
+    return '\n'.join(lines)
+
+
+async def run(levels, step_timeout=120.0, think_time=0.0, ramp_seconds=0.0, telegram_latency=0.0,
+              komoot_latency=0.0, open_meteo_latency=0.0, keep_workdir=False, startup_timeout=60.0,
+              scenario=ANNOUNCE_SCENARIO, webhook=False, workers=0):
+    services = await FakeServices(telegram_latency, komoot_latency, open_meteo_latency).start()
+    api = services.telegram
+    workdir = prepare_workdir()
+    log_path = os.path.join(workdir, 'bot.log')
+    if workers:
+        # Несколько процессов бота за dispatcher.py с общим хранилищем в рабочей папке
+        env = dict(webhook_env(), BOT_WORKERS=str(workers), WORKER_BASE_PORT='0',
+                   SHARED_STORE=f"sqlite:///{os.path.join(workdir, 'state.db')}")
+        process = start_bot(services, workdir, log_path, env, bot_path=DISPATCHER_PATH)
+    else:
+        process = start_bot(services, workdir, log_path, webhook_env() if webhook else None)
+    summaries = []
+    try:
+        try:
+            await asyncio.wait_for(api.connected.wait(), startup_timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"Бот не начал получать апдейты за {startup_timeout:.0f} с, лог: {log_path}")
+
+        for level, users in enumerate(levels):
+            stats = await run_level(api, users, level, scenario, step_timeout, think_time, ramp_seconds)
+            summary = stats.summary()
+            summaries.append(summary)
+            print(f"✅ {users} пользователей: завершили {summary['completed']}, "
+                  f"p95 {summary['p95_s'] or 0:.2f} с, ошибок {summary['error_rate']:.1%}", flush=True)
+        usage = process_usage(process.pid)
+    finally:
+        stop_bot(process)
+        await services.stop()
+        if keep_workdir:
+            print(f"📁 Рабочая папка бота: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {'levels': summaries, 'api_calls': services.calls(), 'bot_process': usage}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота против локальной заглушки Bot API')
+    parser.add_argument('--users', default='1,5,10,25',
+                        help='Уровни нагрузки через запятую (по умолчанию: 1,5,10,25)')
+    parser.add_argument('--step-timeout', type=float, default=120.0, help='Сколько ждать ответа на шаг, с')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Пауза пользователя между шагами, с')
+    parser.add_argument('--ramp', type=float, default=0.0, help='За сколько секунд подключаются все пользователи')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='Задержка ответа Bot API, с')
+    parser.add_argument('--komoot-latency', type=float, default=0.0, help='Задержка ответа Komoot API, с')
+    parser.add_argument('--open-meteo-latency', type=float, default=0.0, help='Задержка ответа Open-Meteo, с')
+    parser.add_argument('--no-dashboard', action='store_true', help='Пропустить шаг с дашбордом погоды')
+    parser.add_argument('--webhook', action='store_true', help='Бот получает апдейты на вебхук вместо getUpdates')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Запустить столько процессов бота за dispatcher.py (вебхук и общее хранилище)')
+    parser.add_argument('--json', help='Сохранить результаты в JSON')
+    parser.add_argument('--keep-workdir', action='store_true', help='Не удалять рабочую папку бота с логом')
+    args = parser.parse_args()
+
+    levels = [int(users) for users in args.users.split(',') if users.strip()]
+    result = asyncio.run(run(levels, args.step_timeout, args.think_time, args.ramp, args.telegram_latency,
+                             args.komoot_latency, args.open_meteo_latency, args.keep_workdir,
+                             scenario=NO_DASHBOARD_SCENARIO if args.no_dashboard else ANNOUNCE_SCENARIO,
+                             webhook=args.webhook, workers=args.workers))
+    print()
+    print(format_report(result['levels']))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Результаты сохранены: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
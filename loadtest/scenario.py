@@ -0,0 +1,104 @@
+"""
+Сценарий организатора для нагрузочного теста: от /start до отправки анонса
+"""
+
+import time
+import asyncio
+from collections import namedtuple
+
+# Шаг сценария: имя для отчета, что отправить (строка, функция от кнопок клавиатуры или None -
+# только ждать ответа) и часть текста ответа бота, после которой шаг считается выполненным
+Step = namedtuple('Step', ['name', 'message', 'expect'])
+
+# Ответы бота, после которых продолжать сценарий нет смысла
+ERROR_MARKERS = ('❌', 'Ошибка', 'Превышено время ожидания')
+
+
+def button(predicate):
+    """Выбирает первую кнопку клавиатуры, подходящую под условие"""
+    def choose(user, buttons):
+        for text in buttons:
+            if predicate(text):
+                return text
+        raise StepError(f"нет подходящей кнопки среди {buttons}")
+    return choose
+
+
+ANNOUNCE_SCENARIO = [
+    Step('start', '/start', 'Выбери дату старта'),
+    Step('date', button(lambda text: 'Завтра' in text), 'Выбери время старта'),
+    Step('time', '☀️ 08:00', 'Теперь пришли'),
+    Step('komoot_link', lambda user, buttons: f"https://www.komoot.com/tour/{user.tour_id}",
+         'Название маршрута из GPX'),
+    Step('route_name', '✅ Оставить извлеченное', 'Выбери точку старта'),
+    Step('start_point', button(lambda text: text != 'Своя точка'), 'Укажи точку финиша'),
+    Step('finish_point', '🏁 Не нужно', 'Выбери ожидаемый темп'),
+    Step('pace', button(lambda text: True), 'комментарий'),
+    Step('comment', 'Нагрузочный тест: едем спокойно, ждем всех на подъемах', 'Хотите добавить картинку'),
+    # Сводка погоды приходит сразу, дашборд дорисовывается в фоне
+    Step('weather', '🌤️ Сгенерировать дашборд погоды (BETA)', 'Погода на маршруте'),
+    Step('dashboard', None, 'Дашборд погоды готов'),
+    Step('send', '✅ Отправить', 'Анонс создан'),
+]
+
+# Тот же сценарий без дашборда погоды: только работа с Telegram и Komoot
+NO_DASHBOARD_SCENARIO = [
+    step if step.name != 'weather' else Step('image', '⏭️ Пропустить', 'Всё верно?')
+    for step in ANNOUNCE_SCENARIO if step.name != 'dashboard'
+]
+
+
+class StepError(Exception):
+    """Шаг сценария не выполнен: бот ответил ошибкой или не ответил вовремя"""
+
+
+def message_text(message):
+    return message.get('text') or message.get('caption') or ''
+
+
+def keyboard_buttons(message):
+    keyboard = (message.get('reply_markup') or {}).get('keyboard') or []
+    return [item['text'] if isinstance(item, dict) else item for row in keyboard for item in row]
+
+
+class SimulatedUser:
+    """Организатор, который проходит сценарий, дожидаясь ответа бота на каждый шаг"""
+
+    def __init__(self, api, user_id, tour_id, step_timeout=120.0, think_time=0.0):
+        self.api = api
+        self.user_id = user_id
+        self.tour_id = tour_id
+        self.step_timeout = step_timeout
+        self.think_time = think_time
+        self.inbox = api.inbox(user_id)
+
+    async def _wait_for(self, expect, buttons):
+        while True:
+            message = await self.inbox.get()
+            text = message_text(message)
+            buttons[:] = keyboard_buttons(message) or buttons
+            if expect in text:
+                return
+            if text.startswith(ERROR_MARKERS):
+                raise StepError(text.splitlines()[0])
+
+    async def run(self, scenario, stats):
+        """Проходит сценарий и записывает время каждого шага; возвращает True, если дошел до конца"""
+        buttons = []
+        for step in scenario:
+            if self.think_time:
+                await asyncio.sleep(self.think_time)
+            started = time.perf_counter()
+            try:
+                text = step.message(self, buttons) if callable(step.message) else step.message
+                if text is not None:
+                    self.api.push_message(self.user_id, text)
+                await asyncio.wait_for(self._wait_for(step.expect, buttons), self.step_timeout)
+            except asyncio.TimeoutError:
+                stats.error(step.name, 'нет ответа')
+                return False
+            except StepError as e:
+                stats.error(step.name, str(e))
+                return False
+            stats.observe(step.name, time.perf_counter() - started)
+        return True
@@ -0,0 +1,102 @@
+"""
+Замер времени запуска бота
+
+Два числа, от которых зависит, как быстро бот оживает после перезапуска
+контейнера и как быстро собираются тесты:
+- время import bot в чистом процессе (и какие тяжелые модули он подтянул);
+- время от запуска bot.py до первого запроса getUpdates (с --webhook -
+  setWebhook) к заглушке Bot API.
+
+Бюджеты ниже проверяет tests/test_startup.py; на медленной машине их можно
+поднять переменными STARTUP_IMPORT_BUDGET и STARTUP_FIRST_UPDATES_BUDGET.
+
+Пример:
+    python3 -m loadtest.startup --runs 5
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+from loadtest.run import ROOT, FakeServices, prepare_workdir, start_bot, stop_bot, webhook_env
+
+# Бюджеты времени запуска, с
+IMPORT_BUDGET = float(os.getenv('STARTUP_IMPORT_BUDGET', '1.0'))
+FIRST_UPDATES_BUDGET = float(os.getenv('STARTUP_FIRST_UPDATES_BUDGET', '3.0'))
+
+# Модули, которые нужны только для разбора GPX и дашборда и не должны загружаться при импорте бота
+HEAVY_MODULES = ('gpxpy', 'numpy', 'matplotlib', 'PIL', 'pandas', 'openmeteo_requests', 'requests_cache')
+
+IMPORT_SCRIPT = f"""
+import sys, json, time
+started = time.perf_counter()
+import bot
+seconds = time.perf_counter() - started
+print(json.dumps({{'seconds': seconds, 'heavy_modules': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(cwd=ROOT):
+    """Время import bot в новом процессе и список загруженных тяжелых модулей"""
+    result = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=cwd, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=ROOT), timeout=60)
+    if result.returncode != 0:
+        raise RuntimeError(f"import bot завершился с ошибкой:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+async def measure_first_updates(timeout=60.0, bot_path=os.path.join(ROOT, 'bot.py'), webhook=False):
+    """Время от запуска bot.py до первого getUpdates (с webhook - до setWebhook), с
+
+    Бот запускается во временной папке против заглушек, как в нагрузочном тесте,
+    поэтому предзагрузка готовых маршрутов тоже идет в заглушку Komoot.
+    """
+    services = await FakeServices().start()
+    workdir = prepare_workdir()
+    log_path = os.path.join(workdir, 'bot.log')
+    started = time.perf_counter()
+    process = start_bot(services, workdir, log_path, extra_env=webhook_env() if webhook else None,
+                        bot_path=bot_path)
+    try:
+        try:
+            await asyncio.wait_for(services.telegram.connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+                raise RuntimeError(f"Бот не начал получать апдейты за {timeout:.0f} с:\n{f.read()}")
+        return time.perf_counter() - started
+    finally:
+        stop_bot(process)
+        await services.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер времени запуска бота')
+    parser.add_argument('--runs', type=int, default=5, help='Сколько раз повторить замеры')
+    parser.add_argument('--bot', default=os.path.join(ROOT, 'bot.py'), help='Путь к bot.py для замера до getUpdates')
+    parser.add_argument('--webhook', action='store_true', help='Бот получает апдейты на вебхук вместо getUpdates')
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    first_updates = [asyncio.run(measure_first_updates(bot_path=args.bot, webhook=args.webhook))
+                     for _ in range(args.runs)]
+    import_median = statistics.median(item['seconds'] for item in imports)
+    first_median = statistics.median(first_updates)
+
+    print(f"import bot:        медиана {import_median * 1000:6.0f} мс (бюджет {IMPORT_BUDGET * 1000:.0f} мс)")
+    print(f"первый getUpdates: медиана {first_median * 1000:6.0f} мс (бюджет {FIRST_UPDATES_BUDGET * 1000:.0f} мс)")
+    heavy = sorted({name for item in imports for name in item['heavy_modules']})
+    if heavy:
+        print(f"⚠️ При импорте загружены тяжелые модули: {', '.join(heavy)}")
+    if import_median > IMPORT_BUDGET or first_median > FIRST_UPDATES_BUDGET or heavy:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Мониторинг задержки event loop
+"""
+
+import os
+import sys
+import time
+import asyncio
+import inspect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Как часто измерять задержку планирования и с какой задержки считать loop заблокированным (секунды)
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.25'))
+
+
+def running_coroutine_name(frame):
+    """Находит в стеке потока самую вложенную корутину и возвращает ее имя"""
+    while frame is not None:
+        code = frame.f_code
+        if code.co_flags & (inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE | inspect.CO_ASYNC_GENERATOR):
+            module = frame.f_globals.get('__name__', '?')
+            return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+        frame = frame.f_back
+    return None
+
+
+class LoopLagMonitor:
+    """Измеряет, насколько позже запланированного просыпается event loop
+
+    Задача внутри loop каждые interval секунд засыпает и отмечает, насколько
+    опоздала. Отдельный поток-сторож следит за этими отметками: если loop не
+    отвечает дольше threshold, значит какой-то обработчик заблокировал его, и
+    сторож прямо во время блокировки смотрит стек потока loop и пишет в лог
+    имя корутины, которая его держит.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.samples = 0
+        self.stalls = 0
+        self.last_offender = None
+        self._heartbeat = time.monotonic()
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+        self._loop_thread_id = None
+
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.samples += 1
+            if lag > self.threshold:
+                logger.warning(f"Event loop опоздал на {lag * 1000:.0f} мс "
+                               f"(последний виновник: {self.last_offender or 'неизвестен'})")
+
+    def _watch(self):
+        reported = False
+        while not self._stopped.wait(self.threshold / 2):
+            blocked_for = time.monotonic() - self._heartbeat - self.interval
+            if blocked_for <= self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            # Loop сейчас заблокирован - смотрим, что именно он выполняет
+            frame = sys._current_frames().get(self._loop_thread_id)
+            offender = running_coroutine_name(frame) or 'неизвестная функция'
+            self.last_offender = offender
+            self.stalls += 1
+            reported = True
+            logger.warning(f"Event loop заблокирован дольше {self.threshold * 1000:.0f} мс: {offender}")
+
+    def start(self):
+        """Запускает мониторинг в текущем event loop"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample(), name='loop-lag-monitor')
+        self._watchdog = threading.Thread(target=self._watch, name='loop-lag-watchdog', daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        """Останавливает мониторинг"""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
@@ -0,0 +1,175 @@
+"""
+Диагностика памяти бота: снимки tracemalloc, размер данных пользователей, открытые файлы
+"""
+
+import os
+import sys
+import logging
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Глубина стека, которую запоминает tracemalloc для каждого выделения памяти
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', '1'))
+
+
+def deep_sizeof(obj, seen=None):
+    """Приблизительный размер объекта вместе с вложенными словарями, списками и строками"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def user_data_sizes(user_data):
+    """Возвращает список (user_id, размер в байтах) от самых больших данных к меньшим"""
+    sizes = [(user_id, deep_sizeof(data)) for user_id, data in user_data.items()]
+    return sorted(sizes, key=lambda item: item[1], reverse=True)
+
+
+def live_conversations(application):
+    """Количество незавершенных разговоров во всех ConversationHandler приложения"""
+    count = 0
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            # В PTB нет публичного API для списка разговоров, поэтому читаем внутренний словарь
+            conversations = getattr(handler, '_conversations', None)
+            if conversations:
+                count += sum(1 for state in conversations.values() if state is not None)
+    return count
+
+
+def open_files(fd_dir='/proc/self/fd', limit=5):
+    """Возвращает число открытых дескрипторов и самые частые файлы среди них
+
+    Работает только в Linux; в остальных системах возвращает (None, []).
+    """
+    try:
+        fds = os.listdir(fd_dir)
+    except OSError:
+        return None, []
+    targets = Counter()
+    for fd in fds:
+        try:
+            target = os.readlink(os.path.join(fd_dir, fd))
+        except OSError:
+            continue
+        # Сокеты, каналы и служебные дескрипторы группируем по типу
+        if ':' in target and not target.startswith('/'):
+            target = target.split(':', 1)[0]
+        targets[target] += 1
+    return len(fds), targets.most_common(limit)
+
+
+def rss_bytes(status_path='/proc/self/status'):
+    """Текущий объем резидентной памяти процесса (VmRSS) или None"""
+    try:
+        with open(status_path, 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def open_figures():
+    """Количество незакрытых фигур matplotlib, если он загружен в процесс бота"""
+    pyplot = sys.modules.get('matplotlib.pyplot')
+    return len(pyplot.get_fignums()) if pyplot is not None else None
+
+
+class MemorySnapshots:
+    """Снимки tracemalloc: каждый новый снимок сравнивается с предыдущим
+
+    tracemalloc замедляет выделение памяти, поэтому включается только по
+    команде и выключается командой stop.
+    """
+
+    def __init__(self, frames=TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self.previous = None
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.previous = self._take()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.previous = None
+
+    @staticmethod
+    def _take():
+        # Выделения памяти самого tracemalloc в отчете не нужны
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+
+    def diff(self, limit=10):
+        """Снимает новый снимок и возвращает места, где память выросла сильнее всего"""
+        if self.previous is None:
+            self.start()
+            return []
+        snapshot = self._take()
+        stats = snapshot.compare_to(self.previous, 'lineno')
+        self.previous = snapshot
+        return [stat for stat in stats if stat.size_diff > 0][:limit]
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def format_memory_report(application, snapshots, top_stats, limit=5):
+    """Собирает текст отчета о памяти для команды /memory"""
+    lines = ["🧠 Память бота", ""]
+    rss = rss_bytes()
+    if rss is not None:
+        lines.append(f"RSS: {format_size(rss)}")
+    traced = tracemalloc.get_traced_memory()[0] if snapshots.tracing else None
+    if traced is not None:
+        lines.append(f"Отслеживается tracemalloc: {format_size(traced)}")
+
+    sizes = user_data_sizes(application.user_data)
+    lines.append(f"Незавершенных разговоров: {live_conversations(application)}")
+    lines.append(f"user_data: {len(sizes)} пользователей, {format_size(sum(size for _, size in sizes))}")
+    for user_id, size in sizes[:limit]:
+        lines.append(f"  {user_id}: {format_size(size)}")
+
+    fd_count, targets = open_files()
+    if fd_count is not None:
+        lines.append(f"Открытых дескрипторов: {fd_count}")
+        for target, count in targets:
+            lines.append(f"  {count} × {target}")
+    figures = open_figures()
+    if figures is not None:
+        lines.append(f"Открытых фигур matplotlib: {figures}")
+
+    lines.append("")
+    if top_stats:
+        lines.append("Рост памяти с прошлого снимка:")
+        for stat in top_stats:
+            frame = stat.traceback[0]
+            lines.append(f"  +{format_size(stat.size_diff)} ({stat.count_diff:+d} блоков) "
+                         f"{os.path.basename(frame.filename)}:{frame.lineno}")
+    elif snapshots.tracing:
+        lines.append("Снимок tracemalloc сохранен, повтори /memory позже, чтобы увидеть рост")
+    return '\n'.join(lines)
@@ -0,0 +1,314 @@
+"""
+Метрики бота в текстовом формате Prometheus
+"""
+
+import os
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Адрес HTTP-сервера с метриками; пустой METRICS_PORT - сервер не запускается
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = os.getenv('METRICS_PORT', '')
+
+# Версия текстового формата Prometheus передается в Content-Type
+EXPOSITION_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Значение, которое может расти и уменьшаться
+
+    Если передана function, значение вычисляется в момент чтения метрик.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (для задержек)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # ключ меток -> [счетчики по корзинам, сумма, количество]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self):
+        lines = []
+        for key, (bucket_counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик, который отдается одним текстом"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_DURATION = REGISTRY.histogram(
+    'announce_bot_handler_duration_seconds', 'Длительность обработчиков апдейтов', ('handler',))
+HANDLER_ERRORS = REGISTRY.counter(
+    'announce_bot_handler_errors_total', 'Исключения в обработчиках апдейтов', ('handler',))
+HANDLER_IN_FLIGHT = REGISTRY.gauge(
+    'announce_bot_handler_in_flight', 'Обработчики, выполняющиеся прямо сейчас', ('handler',))
+EXTERNAL_DURATION = REGISTRY.histogram(
+    'announce_bot_external_call_duration_seconds', 'Длительность внешних вызовов', ('call',))
+EXTERNAL_ERRORS = REGISTRY.counter(
+    'announce_bot_external_call_errors_total', 'Ошибки внешних вызовов', ('call',))
+EXTERNAL_IN_FLIGHT = REGISTRY.gauge(
+    'announce_bot_external_call_in_flight', 'Внешние вызовы, выполняющиеся прямо сейчас', ('call',))
+SUBPROCESS_DURATION = REGISTRY.histogram(
+    'announce_bot_subprocess_duration_seconds', 'Длительность внешних процессов', ('name',))
+SUBPROCESS_EXITS = REGISTRY.counter(
+    'announce_bot_subprocess_exits_total', 'Завершения внешних процессов: ok, error, killed, timeout',
+    ('name', 'status'))
+SUBPROCESS_PEAK_RSS = REGISTRY.histogram(
+    'announce_bot_subprocess_peak_rss_bytes', 'Пиковая резидентная память внешних процессов', ('name',),
+    buckets=tuple(mb * 1024 * 1024 for mb in (16, 32, 64, 128, 256, 512, 1024, 2048)))
+
+
+@contextmanager
+def track(duration, errors, in_flight, **labels):
+    """Замеряет длительность блока кода, считает ошибки и выполняющиеся вызовы"""
+    in_flight.inc(**labels)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors.inc(**labels)
+        raise
+    finally:
+        duration.observe(time.perf_counter() - started, **labels)
+        in_flight.dec(**labels)
+
+
+def track_external(call):
+    """Замеряет внешний вызов: komootgpx, Open-Meteo, отрисовку дашборда, Telegram"""
+    return track(EXTERNAL_DURATION, EXTERNAL_ERRORS, EXTERNAL_IN_FLIGHT, call=call)
+
+
+def instrument_callback(callback, name=None):
+    """Оборачивает асинхронный обработчик, замеряя его длительность и ошибки"""
+    handler_name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with track(HANDLER_DURATION, HANDLER_ERRORS, HANDLER_IN_FLIGHT, handler=handler_name):
+            return await callback(update, context)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _instrument_handler(handler):
+    # ConversationHandler сам не вызывает callback - оборачиваем вложенные обработчики
+    nested = getattr(handler, 'entry_points', None)
+    if nested is not None:
+        for child in handler.entry_points + handler.fallbacks:
+            _instrument_handler(child)
+        for state_handlers in handler.states.values():
+            for child in state_handlers:
+                _instrument_handler(child)
+        return
+    callback = getattr(handler, 'callback', None)
+    if callback is not None and not getattr(callback, 'instrumented', False):
+        handler.callback = instrument_callback(callback)
+
+
+def instrument_application(application):
+    """Добавляет метрики ко всем обработчикам приложения, включая состояния ConversationHandler"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+
+
+def observe_external(call, seconds, failed=False):
+    """Записывает внешний вызов, длительность которого измерена в другом месте"""
+    EXTERNAL_DURATION.observe(seconds, call=call)
+    if failed:
+        EXTERNAL_ERRORS.inc(call=call)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """Запросы к Bot API с замером длительности по имени метода"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        with track_external(f"telegram.{url.rsplit('/', 1)[-1]}"):
+            return await super().do_request(url, method, *args, **kwargs)
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер, отдающий метрики на /metrics
+
+    Метрики считаются только при запросе, поэтому без скрейпера сервер
+    ничего не делает.
+    """
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT, registry=REGISTRY):
+        self.host = host
+        self.port = int(port) if port else None
+        self.registry = registry
+        self._runner = None
+
+    async def _handle(self, request):
+        from aiohttp import web
+        return web.Response(body=self.registry.render().encode('utf-8'),
+                            headers={'Content-Type': EXPOSITION_CONTENT_TYPE})
+
+    async def start(self):
+        if self.port is None or self._runner is not None:
+            return
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,325 @@
+"""
+Сохранение разговоров и user_data в общем хранилище (shared_store.py)
+
+Состояние ConversationHandler и данные пользователя переживают перезапуск
+процесса и доступны любому процессу бота за dispatcher.py. Включается
+переменной SHARED_STORE.
+
+Записи копятся в памяти и раз в PERSISTENCE_INTERVAL секунд уходят в
+хранилище одной транзакцией, причем только строки, которые действительно
+изменились. При старте ничего не читается: состояние пользователя
+поднимается из хранилища при его первом апдейте (restore_handler).
+Значения хранятся компактным JSON; даты со временем, пути, кортежи и байты
+кодируются тегами, другие типы не сохраняются (TypeError). pickle из
+хранилища (строки старого формата) распаковывается только для типов из
+PICKLE_ALLOWED: хранилище общее, и в него пишут другие процессы.
+"""
+
+import io
+import os
+import json
+import base64
+import pickle
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import date, datetime
+from pathlib import Path, PurePath
+
+import pytz
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput, TypeHandler
+
+from executors import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Как часто изменения разговоров и user_data записываются в хранилище, с.
+# Это же окно изменений теряется при аварийном завершении процесса
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '2'))
+
+USER_DATA_NAMESPACE = 'user_data'
+
+# Сколько строк и пользователей помнит StorePersistence: память не растет с
+# числом пользователей, а забытые строки просто записываются или читаются лишний раз
+KNOWN_ROWS_LIMIT = 10000
+
+# Классы, которые можно распаковать из pickle старого формата
+PICKLE_ALLOWED = {
+    ('builtins', 'set'), ('builtins', 'frozenset'), ('builtins', 'bytes'), ('builtins', 'bytearray'),
+    ('datetime', 'datetime'), ('datetime', 'date'), ('datetime', 'time'), ('datetime', 'timedelta'),
+    ('datetime', 'timezone'), ('pytz', '_p'), ('pytz', '_UTC'),
+    ('pathlib', 'Path'), ('pathlib', 'PosixPath'), ('pathlib', 'WindowsPath'),
+    ('pathlib', 'PurePosixPath'), ('pathlib', 'PureWindowsPath'),
+}
+
+_MISSING = object()
+
+
+def conversation_namespace(name):
+    return f"conversation:{name}"
+
+
+def conversation_key(key):
+    """Ключ разговора PTB (кортеж ID) в строку для хранилища"""
+    return json.dumps(list(key))
+
+
+def _encode(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        # Словарь из одного ключа на $ не отличить от тега - такие пишем парами
+        if all(isinstance(key, str) for key in value) and not (len(value) == 1 and next(iter(value)).startswith('$')):
+            return {key: _encode(item) for key, item in value.items()}
+        return {'$dict': [[_encode(key), _encode(item)] for key, item in value.items()]}
+    if isinstance(value, datetime):
+        # Имя зоны нужно, чтобы после восстановления работали переходы на летнее время
+        zone = getattr(value.tzinfo, 'zone', None) or getattr(value.tzinfo, 'key', None)
+        return {'$dt': [value.isoformat(), zone]}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    if isinstance(value, PurePath):
+        return {'$path': str(value)}
+    if isinstance(value, tuple):
+        return {'$tuple': [_encode(item) for item in value]}
+    if isinstance(value, (set, frozenset)):
+        return {'$set': [_encode(item) for item in value]}
+    if isinstance(value, bytes):
+        return {'$b64': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f"Значение типа {type(value).__name__} нельзя сохранить в общем хранилище")
+
+
+class _AllowlistUnpickler(pickle.Unpickler):
+    """Распаковывает только классы из PICKLE_ALLOWED"""
+
+    def find_class(self, module, name):
+        if (module, name) not in PICKLE_ALLOWED:
+            raise pickle.UnpicklingError(f"Класс {module}.{name} не разрешен для распаковки")
+        return super().find_class(module, name)
+
+
+def _unpickle(data):
+    return _AllowlistUnpickler(io.BytesIO(data)).load()
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        tag, data = next(iter(value.items()))
+        if tag == '$dict':
+            return {_decode(key): _decode(item) for key, item in data}
+        if tag == '$dt':
+            moment = datetime.fromisoformat(data[0])
+            return moment.astimezone(pytz.timezone(data[1])) if data[1] else moment
+        if tag == '$date':
+            return date.fromisoformat(data)
+        if tag == '$path':
+            return Path(data)
+        if tag == '$tuple':
+            return tuple(_decode(item) for item in data)
+        if tag == '$set':
+            return {_decode(item) for item in data}
+        if tag == '$b64':
+            return base64.b64decode(data)
+        if tag == '$pickle':
+            return _unpickle(base64.b64decode(data))
+    return {key: _decode(item) for key, item in value.items()}
+
+
+def encode(value):
+    """Значение в байты для хранилища"""
+    return json.dumps(_encode(value), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def decode(data):
+    """Байты из хранилища в значение"""
+    # Строки, записанные до перехода на JSON, - pickle (начинаются с байта протокола)
+    if data[:1] == b'\x80':
+        return _unpickle(data)
+    return _decode(json.loads(data))
+
+
+class StorePersistence(BasePersistence):
+    """Persistence для PTB поверх общего хранилища
+
+    Сохраняются только разговоры и user_data - chat_data и bot_data бот
+    не использует. PTB раз в update_interval передает данные пользователей
+    и разговоров, затронутых апдейтами; в хранилище уходят только те, чье
+    закодированное значение изменилось с последней записи.
+    """
+
+    def __init__(self, store, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self.writes = 0
+        self.batches = 0
+        # (пространство имен, ключ) -> байты или None для удаления
+        self._pending = {}
+        # То, что сейчас лежит в хранилище, - чтобы не писать неизменившееся
+        # (последние KNOWN_ROWS_LIMIT строк)
+        self._written = OrderedDict()
+        # Пользователи, чье состояние уже поднято из хранилища (последние KNOWN_ROWS_LIMIT)
+        self._restored_users = OrderedDict()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+
+    def _stage(self, namespace, key, value):
+        entry = (namespace, key)
+        if entry not in self._pending and self._written.get(entry, _MISSING) == value:
+            return
+        self._pending[entry] = value
+        # PTB вызывает update_* для всех затронутых строк подряд, без пауз;
+        # запись запускается после них и забирает все изменения одной транзакцией
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_logged())
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояние разговоров: {e}")
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await run_blocking(self.store.write_batch,
+                                   [(namespace, key, value) for (namespace, key), value in batch.items()])
+            except BaseException:
+                # Более новые изменения тех же строк важнее неудавшихся
+                for entry, value in batch.items():
+                    self._pending.setdefault(entry, value)
+                raise
+            for entry, value in batch.items():
+                if value is None:
+                    self._written.pop(entry, None)
+                else:
+                    self._remember(entry, value)
+            self.writes += len(batch)
+            self.batches += 1
+
+    def _remember(self, entry, value):
+        self._written[entry] = value
+        self._written.move_to_end(entry)
+        if len(self._written) > KNOWN_ROWS_LIMIT:
+            self._written.popitem(last=False)
+
+    async def _load(self, namespace, key):
+        entry = (namespace, key)
+        if entry in self._pending:
+            # Еще не записанное изменение новее того, что лежит в хранилище
+            return self._pending[entry]
+        data = await run_blocking(self.store.get, namespace, key)
+        if data is not None:
+            self._remember(entry, data)
+        return data
+
+    async def load_user_data(self, user_id):
+        """user_data пользователя из хранилища или None"""
+        data = await self._load(USER_DATA_NAMESPACE, str(user_id))
+        return decode(data) if data is not None else None
+
+    async def load_conversation(self, name, key):
+        """Состояние разговора из хранилища или None"""
+        data = await self._load(conversation_namespace(name), conversation_key(key))
+        return decode(data) if data is not None else None
+
+    async def restore(self, update, context):
+        """Поднимает из хранилища user_data и разговоры пользователя при его первом апдейте"""
+        user = update.effective_user
+        if user is None:
+            return
+        if user.id in self._restored_users:
+            self._restored_users.move_to_end(user.id)
+            return
+        self._restored_users[user.id] = True
+        if len(self._restored_users) > KNOWN_ROWS_LIMIT:
+            # Забытый пользователь поднимется еще раз: setdefault не трогает
+            # данные в памяти, а идущие разговоры пропускаются
+            self._restored_users.popitem(last=False)
+
+        stored = await self.load_user_data(user.id)
+        if stored:
+            for key, value in stored.items():
+                context.user_data.setdefault(key, value)
+
+        for handlers in context.application.handlers.values():
+            for handler in handlers:
+                if not (isinstance(handler, ConversationHandler) and handler.persistent):
+                    continue
+                # Ключ и словарь разговоров - внутренности PTB: публичного способа
+                # подложить состояние одного разговора после initialize нет
+                try:
+                    key = handler._get_key(update)
+                except RuntimeError:
+                    continue
+                if key in handler._conversations:
+                    continue
+                state = await self.load_conversation(handler.name, key)
+                if state is not None and state != ConversationHandler.END:
+                    handler._conversations.update_no_track({key: state})
+
+    def restore_handler(self):
+        """Обработчик для группы -1: восстанавливает состояние раньше обработчиков бота"""
+        return TypeHandler(Update, self.restore)
+
+    async def get_user_data(self):
+        # Данные пользователей поднимаются лениво, в restore
+        return {}
+
+    async def update_user_data(self, user_id, data):
+        self._stage(USER_DATA_NAMESPACE, str(user_id), encode(data))
+
+    async def drop_user_data(self, user_id):
+        self._restored_users.pop(user_id, None)
+        self._stage(USER_DATA_NAMESPACE, str(user_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def get_conversations(self, name):
+        # Разговоры поднимаются лениво, в restore
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        value = None if new_state is None else encode(new_state)
+        self._stage(conversation_namespace(name), conversation_key(key), value)
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
@@ -0,0 +1,213 @@
+"""
+Сэмплирующий профилировщик для профилирования бота в продакшене
+
+Поток-сэмплер периодически снимает стеки всех потоков процесса и считает
+одинаковые стеки. Результат сохраняется в формате collapsed stacks
+(строка "функция;функция;... количество"), который понимают flamegraph.pl
+и speedscope. Внешний модуль дашборда профилирует себя сам, если в его
+окружении задана переменная PROFILE_OUTPUT.
+"""
+
+import os
+import sys
+import uuid
+import shutil
+import asyncio
+import logging
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Интервал между снимками стеков (секунды)
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+
+# Переменная окружения с файлом, куда дочерний процесс пишет свой профиль
+PROFILE_OUTPUT_ENV = 'PROFILE_OUTPUT'
+
+# Функции, в которых потоки простаивают: такие стеки не попадают в профиль
+IDLE_FRAMES = {
+    ('selectors', '_PollLikeSelector.select'),
+    ('selectors', 'KqueueSelector.select'),
+    ('selectors', 'SelectSelector.select'),
+    ('concurrent.futures.thread', '_worker'),
+    ('threading', 'Condition.wait'),
+}
+
+
+def frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    return module, getattr(code, 'co_qualname', code.co_name)
+
+
+def collapse_stack(frame, thread_name):
+    """Превращает стек потока в строку collapsed stacks или None для простаивающего потока"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    if not labels or labels[0] in IDLE_FRAMES:
+        return None
+    labels.reverse()
+    return ';'.join([thread_name] + [f"{module}.{name}" for module, name in labels])
+
+
+class SamplingProfiler:
+    """Снимает стеки всех потоков процесса каждые interval секунд"""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = collapse_stack(frame, names.get(thread_id, f'thread-{thread_id}'))
+            if stack:
+                self.stacks[stack] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+        return self.stacks
+
+
+def format_collapsed(stacks):
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+def read_collapsed(path, prefix=''):
+    """Читает файл collapsed stacks, добавляя prefix к каждому стеку"""
+    stacks = Counter()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                stacks[prefix + stack] += int(count)
+    return stacks
+
+
+def top_functions(stacks, limit=10):
+    """Функции, на которых чаще всего останавливался сэмплер (собственное время)"""
+    own = Counter()
+    for stack, count in stacks.items():
+        own[stack.rsplit(';', 1)[-1]] += count
+    return own.most_common(limit)
+
+
+@contextmanager
+def profile_from_env():
+    """Профилирует блок кода, если задан PROFILE_OUTPUT (используется во внешнем модуле)"""
+    output = os.environ.get(PROFILE_OUTPUT_ENV)
+    if not output:
+        yield
+        return
+    profiler = SamplingProfiler()
+    profiler.start()
+    try:
+        yield
+    finally:
+        stacks = profiler.stop()
+        try:
+            with open(output, 'w', encoding='utf-8') as f:
+                f.write(format_collapsed(stacks))
+        except OSError as e:
+            print(f"❌ Не удалось сохранить профиль: {e}")
+
+
+class ProfileSession:
+    """Профилирование следующих N апдейтов или T секунд - что наступит раньше"""
+
+    def __init__(self, updates, seconds, after_update_id=None, interval=PROFILE_INTERVAL):
+        self.updates = updates
+        self.seconds = seconds
+        self.after_update_id = after_update_id
+        self.processed = 0
+        self.profiler = SamplingProfiler(interval)
+        self.worker_dir = tempfile.mkdtemp(prefix='profile_')
+        self._done = asyncio.Event()
+
+    def start(self):
+        self.profiler.start()
+
+    def update_processed(self, update):
+        # Апдейт с самой командой /profile не считаем
+        update_id = getattr(update, 'update_id', None)
+        if self.after_update_id is not None and update_id is not None and update_id <= self.after_update_id:
+            return
+        self.processed += 1
+        if self.processed >= self.updates:
+            self._done.set()
+
+    def worker_env(self):
+        return {PROFILE_OUTPUT_ENV: os.path.join(self.worker_dir, f"{uuid.uuid4().hex}.folded")}
+
+    async def wait(self):
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout=self.seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def finish(self):
+        """Останавливает сэмплер и объединяет профиль бота с профилями внешних модулей"""
+        stacks = Counter(self.profiler.stop())
+        for name in sorted(os.listdir(self.worker_dir)):
+            try:
+                stacks.update(read_collapsed(os.path.join(self.worker_dir, name), 'weather_dashboard;'))
+            except OSError as e:
+                logger.error(f"Не удалось прочитать профиль внешнего модуля {name}: {e}")
+        shutil.rmtree(self.worker_dir, ignore_errors=True)
+        return stacks
+
+
+class ProfileController:
+    """Держит текущую сессию профилирования (одновременно - не больше одной)"""
+
+    def __init__(self):
+        self.session = None
+
+    @property
+    def active(self):
+        return self.session is not None
+
+    def begin(self, updates, seconds, after_update_id=None):
+        if self.session is not None:
+            return None
+        self.session = ProfileSession(updates, seconds, after_update_id)
+        self.session.start()
+        return self.session
+
+    def end(self):
+        session, self.session = self.session, None
+        return session.finish() if session is not None else Counter()
+
+    def update_processed(self, update):
+        if self.session is not None:
+            self.session.update_processed(update)
+
+    def worker_env(self):
+        """Переменные окружения, чтобы внешний модуль тоже попал в профиль"""
+        return self.session.worker_env() if self.session is not None else {}
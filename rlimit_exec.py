@@ -0,0 +1,51 @@
+"""
+Запуск команды с лимитами ресурсов
+
+Лимиты ставятся в самом процессе до exec, поэтому действуют с первой
+инструкции команды: prlimit снаружи после запуска опаздывает, а
+preexec_fn небезопасен в процессе с потоками. Если лимит поставить не
+удалось, команда не запускается.
+
+    python3 -S rlimit_exec.py <память, МБ> <CPU, с> -- команда [аргументы...]
+
+0 в лимите - без лимита. Запускается из supervisor.py.
+"""
+
+import os
+import sys
+import resource
+
+# Коды выхода как у shell: не удалось подготовить запуск или найти команду
+EXIT_LIMITS_FAILED = 126
+EXIT_NOT_FOUND = 127
+
+
+def apply_limits(memory_limit_mb, cpu_limit):
+    """Ставит лимит адресного пространства (МБ) и процессорного времени (с) текущему процессу"""
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if cpu_limit:
+        # Мягкий лимит присылает SIGXCPU, жесткий через секунду - SIGKILL
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+
+
+def main(argv):
+    if len(argv) < 5 or argv[3] != '--':
+        sys.stderr.write("Использование: rlimit_exec.py <память, МБ> <CPU, с> -- команда [аргументы...]\n")
+        return EXIT_LIMITS_FAILED
+    command = argv[4:]
+    try:
+        apply_limits(int(argv[1]), int(argv[2]))
+    except (ValueError, OSError) as e:
+        sys.stderr.write(f"rlimit_exec: не удалось ограничить ресурсы для {command[0]}: {e}\n")
+        return EXIT_LIMITS_FAILED
+    try:
+        os.execvp(command[0], command)
+    except OSError as e:
+        sys.stderr.write(f"rlimit_exec: не удалось запустить {command[0]}: {e}\n")
+        return EXIT_NOT_FOUND
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,196 @@
+"""
+Сессии организаторов: завершение брошенных разговоров и их задачи
+
+Разговор, в котором организатор не пишет дольше CONVERSATION_TIMEOUT
+секунд (для отдельных состояний - CONVERSATION_STATE_TIMEOUTS), завершается:
+выполняющиеся задачи разговора отменяются, его файлы освобождаются, а
+состояние разговора и user_data удаляются из памяти и из persistence.
+Проверка идет раз в SESSION_SWEEP_INTERVAL секунд.
+
+Сессия - ключ ConversationHandler (ID чата, ID пользователя).
+"""
+
+import os
+import time
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+from supervisor import PROCESS_OWNER, kill_owned
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд без сообщений разговор считается брошенным
+CONVERSATION_TIMEOUT = float(os.getenv('CONVERSATION_TIMEOUT', '3600'))
+# Свой таймаут для отдельных состояний: "PREVIEW_STEP=7200,ASK_KOMOOT_LINK=900"
+CONVERSATION_STATE_TIMEOUTS = os.getenv('CONVERSATION_STATE_TIMEOUTS', '')
+# Как часто искать брошенные разговоры, с
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', '60'))
+# Сколько ждать завершения отмененных задач сессии, с
+SESSION_CANCEL_TIMEOUT = 5.0
+
+
+def parse_state_timeouts(spec, states):
+    """Разбирает CONVERSATION_STATE_TIMEOUTS в {состояние: секунды}; states - {имя: состояние}"""
+    timeouts = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, _, seconds = item.partition('=')
+        name = name.strip()
+        if name not in states:
+            raise ValueError(f"Неизвестное состояние разговора в CONVERSATION_STATE_TIMEOUTS: {name}")
+        timeouts[states[name]] = float(seconds)
+    return timeouts
+
+
+def session_key(update):
+    """Ключ сессии апдейта (как у ConversationHandler по умолчанию) или None"""
+    if not isinstance(update, Update) or update.effective_chat is None or update.effective_user is None:
+        return None
+    return update.effective_chat.id, update.effective_user.id
+
+
+class SessionManager:
+    """Следит за активностью разговоров и задачами, которые они запустили
+
+    Каждый апдейт отмечает время активности сессии, а задача, в которой он
+    обрабатывается, считается задачей сессии, как и внешние процессы,
+    запущенные из нее (supervisor.py). on_expire(key, user_data)
+    вызывается перед удалением user_data брошенной сессии - чтобы удалить ее
+    файлы и предупредить организатора.
+    """
+
+    def __init__(self, timeout=CONVERSATION_TIMEOUT, state_timeouts=None, sweep_interval=SESSION_SWEEP_INTERVAL,
+                 on_expire=None):
+        self.timeout = timeout
+        self.state_timeouts = dict(state_timeouts or {})
+        self.sweep_interval = sweep_interval
+        self.on_expire = on_expire
+        self.expired = 0
+        self.application = None
+        self.conversation = None
+        self._last_seen = {}
+        self._tasks = {}
+        self._sweeper = None
+
+    def attach(self, application, conversation, group=-1):
+        """Подключает к приложению: апдейты отмечаются в group до обработчиков разговора"""
+        self.application = application
+        self.conversation = conversation
+        self._last_seen.clear()
+        self._tasks.clear()
+        application.add_handler(TypeHandler(Update, self._on_update), group=group)
+
+    async def _on_update(self, update, context):
+        key = session_key(update)
+        if key is not None:
+            self._last_seen[key] = time.monotonic()
+            self.track(key, asyncio.current_task())
+            PROCESS_OWNER.set(key)
+
+    @property
+    def live(self):
+        """Количество незавершенных разговоров"""
+        # Словарь разговоров - внутренности PTB, публичного способа их перечислить нет
+        return len(self.conversation._conversations) if self.conversation is not None else 0
+
+    def state(self, key):
+        """Состояние разговора сессии или None, если разговор закончен"""
+        return self.conversation._conversations.get(key) if self.conversation is not None else None
+
+    def timeout_for(self, state):
+        return self.state_timeouts.get(state, self.timeout)
+
+    def track(self, key, task):
+        """Привязывает задачу к сессии; завершившаяся задача отвязывается сама"""
+        tasks = self._tasks.setdefault(key, set())
+        tasks.add(task)
+
+        def forget(done):
+            tasks.discard(done)
+            if not tasks and self._tasks.get(key) is tasks:
+                del self._tasks[key]
+
+        task.add_done_callback(forget)
+        return task
+
+    def running(self, key):
+        """Незавершенные задачи сессии"""
+        return [task for task in self._tasks.get(key, ()) if not task.done()]
+
+    def cancel_nowait(self, key):
+        """Отменяет задачи сессии (кроме текущей), не дожидаясь их; возвращает отмененные задачи"""
+        current = asyncio.current_task()
+        tasks = [task for task in self.running(key) if task is not current]
+        for task in tasks:
+            task.cancel()
+        # Отмена задачи не останавливает процесс, который ждут в потоке run_blocking
+        kill_owned(key)
+        return tasks
+
+    async def wait_cancelled(self, key, tasks):
+        """Дожидается задач, отмененных cancel_nowait, но не дольше SESSION_CANCEL_TIMEOUT"""
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=SESSION_CANCEL_TIMEOUT)
+            if pending:
+                logger.warning(f"Задачи сессии {key} не завершились после отмены: {len(pending)}")
+
+    async def cancel(self, key):
+        """Отменяет задачи сессии (кроме текущей) и ждет их завершения; возвращает число отмененных"""
+        tasks = self.cancel_nowait(key)
+        await self.wait_cancelled(key, tasks)
+        return len(tasks)
+
+    async def expire(self, key):
+        """Завершает сессию: отменяет задачи, освобождает файлы, удаляет состояние"""
+        cancelled = await self.cancel(key)
+        # pop отмечает разговор для persistence - он удалится и из хранилища
+        self.conversation._conversations.pop(key, None)
+        user_id = key[-1]
+        user_data = self.application.user_data.get(user_id)
+        if self.on_expire is not None:
+            try:
+                await self.on_expire(key, user_data or {})
+            except Exception as e:
+                logger.error(f"Ошибка при завершении сессии {key}: {e}")
+        self.application.drop_user_data(user_id)
+        self._last_seen.pop(key, None)
+        self.expired += 1
+        logger.info(f"Сессия {key} завершена по неактивности, отменено задач: {cancelled}")
+
+    async def sweep(self, now=None):
+        """Завершает брошенные разговоры; возвращает их количество"""
+        now = time.monotonic() if now is None else now
+        conversations = self.conversation._conversations
+        expired = 0
+        for key, state in list(conversations.items()):
+            # Разговор, восстановленный после перезапуска, отсчитывает таймаут заново
+            seen = self._last_seen.setdefault(key, now)
+            if now - seen >= self.timeout_for(state):
+                await self.expire(key)
+                expired += 1
+        for key in list(self._last_seen):
+            if key not in conversations and not self.running(key):
+                del self._last_seen[key]
+        return expired
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка при поиске брошенных разговоров: {e}", exc_info=True)
+
+    def start(self):
+        if self._sweeper is None and self.sweep_interval > 0:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
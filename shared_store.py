@@ -0,0 +1,141 @@
+"""
+Общее хранилище для нескольких процессов бота
+
+Когда бот работает несколькими процессами за dispatcher.py, состояние
+разговоров и каталог кэша (file_id загруженных файлов) должны быть общими:
+после перезапуска процесса или изменения их числа разговор пользователя
+продолжается там, где остановился.
+
+Хранилище - ключ-значение по пространствам имен, значения - байты
+(сериализует вызывающий код). write_batch записывает несколько изменений
+одной транзакцией. Выбирается переменной SHARED_STORE:
+    sqlite:///path/to/state.db  - SQLite, общий для процессов на одной машине
+    memory                      - в памяти процесса (один процесс, тесты)
+Без SHARED_STORE бот, как и раньше, хранит все в памяти и в файлах кэша.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SHARED_STORE = os.getenv('SHARED_STORE', '')
+# Сколько ждать, пока другой процесс держит блокировку базы, с
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '5'))
+
+_UPSERT = ('INSERT INTO kv (namespace, key, value, updated) VALUES (?, ?, ?, ?) '
+           'ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, updated = excluded.updated')
+
+
+class MemoryStore:
+    """Хранилище в памяти процесса - локальная замена общего хранилища"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        with self._lock:
+            return self._data.get((namespace, key))
+
+    def set(self, namespace, key, value):
+        with self._lock:
+            self._data[(namespace, key)] = bytes(value)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+    def items(self, namespace):
+        with self._lock:
+            return [(key, value) for (ns, key), value in self._data.items() if ns == namespace]
+
+    def write_batch(self, changes):
+        """Применяет изменения (пространство имен, ключ, значение или None для удаления)"""
+        with self._lock:
+            for namespace, key, value in changes:
+                if value is None:
+                    self._data.pop((namespace, key), None)
+                else:
+                    self._data[(namespace, key)] = bytes(value)
+
+    def close(self):
+        pass
+
+
+class SQLiteStore:
+    """Хранилище в SQLite: одна таблица (пространство имен, ключ) -> значение
+
+    Соединение одно на процесс, обращения из разных потоков сериализуются
+    блокировкой; другие процессы ждут блокировку базы до SQLITE_BUSY_TIMEOUT.
+    База в режиме WAL: чтения не ждут записи, а коммит дописывает журнал
+    вместо перезаписи страниц базы.
+    """
+
+    def __init__(self, path, busy_timeout=SQLITE_BUSY_TIMEOUT):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False,
+                                           isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        # В WAL с NORMAL коммит не ждет fsync; при сбое питания теряются только последние коммиты
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS kv ('
+            'namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, updated REAL NOT NULL, '
+            'PRIMARY KEY (namespace, key))'
+        )
+
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._connection.execute('SELECT value FROM kv WHERE namespace = ? AND key = ?',
+                                           (namespace, key)).fetchone()
+        return row[0] if row else None
+
+    def set(self, namespace, key, value):
+        with self._lock:
+            self._connection.execute(
+                _UPSERT, (namespace, key, bytes(value), time.time()))
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._connection.execute('DELETE FROM kv WHERE namespace = ? AND key = ?', (namespace, key))
+
+    def items(self, namespace):
+        with self._lock:
+            return self._connection.execute('SELECT key, value FROM kv WHERE namespace = ?', (namespace,)).fetchall()
+
+    def write_batch(self, changes):
+        """Применяет изменения (пространство имен, ключ, значение или None для удаления) одной транзакцией"""
+        now = time.time()
+        upserts = [(namespace, key, bytes(value), now) for namespace, key, value in changes if value is not None]
+        deletes = [(namespace, key) for namespace, key, value in changes if value is None]
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._connection.executemany(_UPSERT, upserts)
+                self._connection.executemany('DELETE FROM kv WHERE namespace = ? AND key = ?', deletes)
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def open_store(url=SHARED_STORE):
+    """Открывает хранилище по адресу из SHARED_STORE; без адреса возвращает None"""
+    if not url:
+        return None
+    if url == 'memory':
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    raise ValueError(f"Неизвестное хранилище: {url} (ожидается sqlite:///путь или memory)")
@@ -0,0 +1,263 @@
+"""
+Запуск внешних процессов (komootgpx, дашборд погоды) под присмотром
+
+Каждый процесс:
+    - работает в своей группе процессов, поэтому по таймауту и при отмене
+      вместе с ним завершаются и его дочерние процессы;
+    - ограничен по памяти (RLIMIT_AS) и процессорному времени (RLIMIT_CPU),
+      лимиты ставит rlimit_exec.py до exec команды;
+    - запускается с однопоточными numpy/OpenBLAS (SUBPROCESS_THREAD_ENV);
+    - завершается по истечении времени на стенных часах (timeout);
+    - пишет stdout и stderr в буферы не больше SUBPROCESS_OUTPUT_LIMIT байт,
+      из вывода сверх лимита сохраняется конец (там ошибки и итоги);
+    - всегда дожидается (wait4), чтобы не оставлять зомби, а код выхода,
+      длительность и пиковая память попадают в метрики.
+
+Процесс принадлежит сессии, от имени которой запущен (PROCESS_OWNER,
+переносится и в потоки run_blocking). kill_owned(owner) убивает все
+процессы сессии - так отмена разговора останавливает и работу в потоках,
+которую отменой задачи не прервать.
+"""
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import selectors
+import threading
+import contextvars
+import subprocess
+from collections import namedtuple
+
+from metrics import SUBPROCESS_DURATION, SUBPROCESS_EXITS, SUBPROCESS_PEAK_RSS
+
+try:
+    import resource
+except ImportError:  # не POSIX
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Лимит адресного пространства процесса, МБ (0 - без лимита). Это виртуальная
+# память, а не RSS: numpy и matplotlib резервируют заметно больше, чем реально
+# используют, поэтому лимит защищает от разбежавшегося процесса, а не считает память
+SUBPROCESS_MEMORY_LIMIT_MB = int(os.getenv('SUBPROCESS_MEMORY_LIMIT_MB', '8192'))
+# Лимит процессорного времени, с (0 - без лимита)
+SUBPROCESS_CPU_LIMIT = int(os.getenv('SUBPROCESS_CPU_LIMIT', '120'))
+# Сколько байт stdout и stderr сохранять (каждого)
+SUBPROCESS_OUTPUT_LIMIT = int(os.getenv('SUBPROCESS_OUTPUT_LIMIT', str(256 * 1024)))
+# Время на стенных часах по умолчанию, с
+SUBPROCESS_TIMEOUT = float(os.getenv('SUBPROCESS_TIMEOUT', '300'))
+
+# OpenBLAS резервирует память под каждый поток, а потоков по умолчанию столько же, сколько
+# ядер: на многоядерной машине это упирается в лимит адресного пространства. Дашборду
+# многопоточность BLAS не нужна; переменные, уже заданные в окружении, не меняются
+SUBPROCESS_THREAD_ENV = {'OPENBLAS_NUM_THREADS': '1', 'OMP_NUM_THREADS': '1', 'MKL_NUM_THREADS': '1'}
+
+# Обертка, которая ставит лимиты до exec команды
+RLIMIT_EXEC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rlimit_exec.py')
+
+# Сессия, которой принадлежат запускаемые процессы
+PROCESS_OWNER = contextvars.ContextVar('process_owner', default=None)
+
+ProcessResult = namedtuple('ProcessResult', ['returncode', 'stdout', 'stderr', 'duration', 'peak_rss',
+                                             'timed_out', 'truncated'])
+
+_owned = {}
+_owned_lock = threading.Lock()
+
+
+def kill_group(pid):
+    """Убивает группу процессов pid; уже завершившаяся группа - не ошибка"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _register(pid):
+    owner = PROCESS_OWNER.get()
+    if owner is not None:
+        with _owned_lock:
+            _owned.setdefault(owner, set()).add(pid)
+    return owner
+
+
+def _unregister(owner, pid):
+    if owner is None:
+        return
+    with _owned_lock:
+        pids = _owned.get(owner)
+        if pids is not None:
+            pids.discard(pid)
+            if not pids:
+                del _owned[owner]
+
+
+def kill_owned(owner):
+    """Убивает процессы сессии owner; возвращает их количество"""
+    with _owned_lock:
+        pids = list(_owned.get(owner, ()))
+    for pid in pids:
+        kill_group(pid)
+    return len(pids)
+
+
+def _limited_command(cmd, memory_limit_mb, cpu_limit):
+    """Команда, которая ставит лимиты до exec cmd; без лимитов или вне POSIX - сама cmd"""
+    if resource is None or not (memory_limit_mb or cpu_limit):
+        return list(cmd)
+    # -S: без site, обертка должна запускаться быстро
+    return [sys.executable, '-S', RLIMIT_EXEC, str(memory_limit_mb or 0), str(cpu_limit or 0), '--', *cmd]
+
+
+def _child_env(env):
+    child_env = dict(os.environ if env is None else env)
+    for name, value in SUBPROCESS_THREAD_ENV.items():
+        child_env.setdefault(name, value)
+    return child_env
+
+
+def _collect_output(process, limit, deadline):
+    """Читает stdout и stderr до конца или до deadline; возвращает (stdout, stderr, обрезан, таймаут)"""
+    buffers = {process.stdout: bytearray(), process.stderr: bytearray()}
+    truncated = False
+    with selectors.DefaultSelector() as selector:
+        for pipe in buffers:
+            selector.register(pipe, selectors.EVENT_READ)
+        while selector.get_map():
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                return bytes(buffers[process.stdout]), bytes(buffers[process.stderr]), truncated, True
+            for key, _ in selector.select(remaining):
+                chunk = os.read(key.fd, 65536)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    continue
+                buffer = buffers[key.fileobj]
+                buffer += chunk
+                if len(buffer) > limit:
+                    del buffer[:len(buffer) - limit]
+                    truncated = True
+    return bytes(buffers[process.stdout]), bytes(buffers[process.stderr]), truncated, False
+
+
+def _reap(process, deadline=None):
+    """Дожидается процесса, после deadline убивает его группу; возвращает (код возврата, пиковая память, таймаут)"""
+    timed_out = False
+    while True:
+        # wait4 вместо Popen.wait: он же возвращает использование ресурсов процессом
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG if deadline is not None else 0)
+        if pid:
+            break
+        if time.monotonic() >= deadline:
+            kill_group(process.pid)
+            deadline = None
+            timed_out = True
+        else:
+            time.sleep(0.01)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss в Linux - в килобайтах, в macOS - в байтах
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return process.returncode, peak_rss, timed_out
+
+
+def _record(name, result):
+    if result.timed_out:
+        status = 'timeout'
+    elif result.returncode == 0:
+        status = 'ok'
+    elif result.returncode < 0:
+        status = 'killed'
+    else:
+        status = 'error'
+    SUBPROCESS_EXITS.inc(name=name, status=status)
+    SUBPROCESS_DURATION.observe(result.duration, name=name)
+    SUBPROCESS_PEAK_RSS.observe(result.peak_rss, name=name)
+    if result.returncode in (-signal.SIGXCPU, -signal.SIGKILL) and not result.timed_out:
+        logger.warning(f"Процесс {name} убит сигналом {-result.returncode} "
+                       f"(лимит CPU, отмена или OOM), память {result.peak_rss / 1024 / 1024:.0f} МБ")
+
+
+class _Control:
+    """Связь асинхронной обертки с потоком, который ведет процесс"""
+
+    def __init__(self):
+        self.pid = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def started(self, pid):
+        with self._lock:
+            self.pid = pid
+            return self.cancelled
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            pid = self.pid
+        if pid is not None:
+            kill_group(pid)
+
+
+def run_process_sync(cmd, name, timeout=SUBPROCESS_TIMEOUT, memory_limit_mb=SUBPROCESS_MEMORY_LIMIT_MB,
+                     cpu_limit=SUBPROCESS_CPU_LIMIT, output_limit=SUBPROCESS_OUTPUT_LIMIT, cwd=None, env=None,
+                     control=None):
+    """Запускает процесс и ждет его завершения; возвращает ProcessResult
+
+    name - имя процесса в метриках. По timeout группа процесса убивается,
+    а в результате timed_out=True. Вывод декодируется как UTF-8.
+    """
+    started = time.monotonic()
+    deadline = started + timeout if timeout else None
+    # exec в обертке сохраняет PID: группа и владелец те же, что у самой команды
+    process = subprocess.Popen(_limited_command(cmd, memory_limit_mb, cpu_limit), stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, env=_child_env(env),
+                               start_new_session=True)
+    owner = _register(process.pid)
+    try:
+        if control is not None and control.started(process.pid):
+            kill_group(process.pid)
+        stdout, stderr, truncated, timed_out = _collect_output(process, output_limit, deadline)
+        if timed_out:
+            kill_group(process.pid)
+        # Процесс мог закрыть вывод и продолжить работу - ждем его тоже не дольше deadline
+        returncode, peak_rss, reap_timed_out = _reap(process, None if timed_out else deadline)
+        timed_out = timed_out or reap_timed_out
+        if timed_out:
+            logger.warning(f"Процесс {name} не завершился за {timeout:.0f} с, группа {process.pid} убита")
+    except BaseException:
+        kill_group(process.pid)
+        if process.returncode is None:
+            _reap(process)
+        raise
+    finally:
+        process.stdout.close()
+        process.stderr.close()
+        _unregister(owner, process.pid)
+
+    result = ProcessResult(returncode, stdout.decode('utf-8', errors='replace'),
+                           stderr.decode('utf-8', errors='replace'), time.monotonic() - started, peak_rss,
+                           timed_out, truncated)
+    _record(name, result)
+    return result
+
+
+async def run_process(cmd, name, **options):
+    """Асинхронный run_process_sync: процесс ведет отдельный поток
+
+    При отмене задачи группа процесса убивается, а задача дожидается,
+    пока процесс будет собран.
+    """
+    control = _Control()
+    # to_thread переносит PROCESS_OWNER в поток; отдельный поток, а не run_blocking,
+    # чтобы ожидание процессов не занимало пул для коротких блокирующих операций
+    future = asyncio.ensure_future(asyncio.to_thread(run_process_sync, cmd, name, control=control, **options))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        control.cancel()
+        await asyncio.wait([future])
+        raise
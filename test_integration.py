@@ -1,46 +1,71 @@
 #!/usr/bin/env python3
 """
 Тестовый скрипт для проверки интеграции с внешним модулем weather_dashboard.py
+
+По умолчанию погода берется из локальной заглушки Open-Meteo (fakes/open_meteo.py),
+поэтому сеть не нужна. С --live запросы идут в настоящий Open-Meteo.
+Если GPX файла нет, используется синтетический маршрут (gpx_generator.py).
 """
 
 import os
 import sys
-from datetime import datetime
+import asyncio
+import argparse
+import threading
+from datetime import datetime, timedelta
 
 # Добавляем текущую директорию в путь для импорта
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # Импортируем функцию из bot.py
 from bot import generate_weather_dashboard
+from fakes.open_meteo import FakeOpenMeteo
+from gpx_generator import generate_gpx
+
+
+def start_fake_open_meteo():
+    """Запускает заглушку Open-Meteo в отдельном потоке и направляет на нее внешний модуль дашборда"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    server = asyncio.run_coroutine_threadsafe(FakeOpenMeteo().start(), loop).result(10)
+    # Внешний модуль запускается отдельным процессом и читает адрес из окружения
+    os.environ['OPEN_METEO_URL'] = server.url
+    return server, loop
+
 
-def test_weather_dashboard():
+def stop_fake_open_meteo(server, loop):
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def test_weather_dashboard(gpx_path="cache/Bukovac from flags-2070100198.gpx"):
     """Тестирует генерацию дашборда погоды"""
-    
-    # Тестовые данные
-    gpx_path = "cache/Bukovac from flags-2070100198.gpx"
-    start_datetime = datetime(2025, 9, 6, 8, 30)  # 06.09.2025 08:30
+
+    # Тестовые данные: прогноз есть только на ближайшие дни, поэтому старт - завтра утром
+    start_datetime = (datetime.now() + timedelta(days=1)).replace(hour=8, minute=30, second=0, microsecond=0)
     output_path = "test_dashboard.png"
     speed_kmh = 27
-    
+
+    # Если записанного маршрута нет, берем синтетический
+    if not os.path.exists(gpx_path):
+        print(f"⚠️ GPX файл не найден: {gpx_path}, используем синтетический маршрут")
+        gpx_path = generate_gpx("test_route.gpx", length_km=80, seed=1)
+
     print("🧪 Тестирование интеграции с weather_dashboard.py")
     print(f"📁 GPX файл: {gpx_path}")
     print(f"🕐 Время старта: {start_datetime}")
     print(f"🖼️ Выходной файл: {output_path}")
     print(f"🚗 Скорость: {speed_kmh} км/ч")
+    print(f"🌐 Open-Meteo: {os.getenv('OPEN_METEO_URL', 'https://api.open-meteo.com')}")
     print()
-    
-    # Проверяем, что GPX файл существует
-    if not os.path.exists(gpx_path):
-        print(f"❌ GPX файл не найден: {gpx_path}")
-        return False
-    
+
     # Вызываем функцию генерации дашборда
     print("🌤️ Вызываем generate_weather_dashboard...")
     success = generate_weather_dashboard(gpx_path, start_datetime, output_path, speed_kmh)
-    
+
     if success:
         print("✅ Дашборд успешно создан!")
-        
+
         # Проверяем, что файл создан
         if os.path.exists(output_path):
             file_size = os.path.getsize(output_path)
@@ -54,7 +79,17 @@ def test_weather_dashboard():
         return False
 
 if __name__ == "__main__":
-    success = test_weather_dashboard()
+    parser = argparse.ArgumentParser(description='Проверка интеграции с weather_dashboard.py')
+    parser.add_argument('--gpx', default="cache/Bukovac from flags-2070100198.gpx", help='GPX файл маршрута')
+    parser.add_argument('--live', action='store_true', help='Запрашивать настоящий Open-Meteo (нужна сеть)')
+    args = parser.parse_args()
+
+    fake = None if args.live else start_fake_open_meteo()
+    try:
+        success = test_weather_dashboard(args.gpx)
+    finally:
+        if fake is not None:
+            stop_fake_open_meteo(*fake)
     if success:
         print("\n🎉 Тест прошел успешно!")
         sys.exit(0)
@@ -0,0 +1,176 @@
+"""Тесты для дедлайна дашборда: погода и отрисовка укладываются в заданное время"""
+
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+import bot
+import weather_dashboard
+from fakes.open_meteo import FakeOpenMeteo
+from gpx_generator import generate_gpx
+from metrics import EXTERNAL_DURATION
+from weather_dashboard import (create_weather_dashboard, get_weather_data_for_route, load_weather_data,
+                               missing_spans)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def route_points(count):
+    """Точки маршрута на завтра через каждые 15 минут"""
+    start = pytz.timezone('Europe/Belgrade').localize(datetime.now().replace(hour=8, minute=0) + timedelta(days=1))
+    return [{'lat': 45.25 + i * 0.02, 'lon': 19.83 + i * 0.01, 'time': start + timedelta(minutes=15 * i),
+             'distance_km': 6.0 * (i + 1), 'ele': 80.0 + i} for i in range(count)]
+
+
+def weather(point, temperature=20.0):
+    return {'time': point['time'], 'distance_km': point['distance_km'], 'temperature': temperature,
+            'feels_like': temperature - 1, 'humidity': 60.0, 'wind_speed': 3.0, 'wind_direction': 90.0,
+            'pressure': 1013.0, 'weather_code': 1, 'precipitation_probability': 10.0, 'cloud_cover': 40.0}
+
+
+class TestWeatherDeadline:
+    """Тесты для получения погоды с дедлайном"""
+
+    @pytest.mark.asyncio
+    async def test_fetch_stops_at_deadline(self, tmp_path, monkeypatch):
+        """Медленный Open-Meteo не задерживает дашборд дольше дедлайна, точки после него - без прогноза"""
+        server = await FakeOpenMeteo(latency=0.5).start()
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(weather_dashboard, 'OPEN_METEO_URL', server.url)
+        points = route_points(20)
+        try:
+            started = time.monotonic()
+            data = await asyncio.to_thread(get_weather_data_for_route, points, started + 3)
+            elapsed = time.monotonic() - started
+        finally:
+            await server.stop()
+
+        assert elapsed < 4
+        assert len(data) == len(points)
+        assert data[0] is not None
+        assert data[-1] is None
+        assert server.calls['forecast'] < len(points)
+
+    def test_missing_spans(self):
+        """Соседние точки без прогноза объединяются в один промежуток"""
+        points = route_points(6)
+        data = [weather(points[0]), None, None, weather(points[3]), weather(points[4]), None]
+
+        assert missing_spans(points, data) == [(points[0]['time'], points[3]['time']),
+                                               (points[4]['time'], points[5]['time'])]
+        assert missing_spans(points, [weather(p) for p in points]) == []
+
+    def test_render_with_gaps(self, tmp_path):
+        """Дашборд рисуется по неполным данным"""
+        points = route_points(8)
+        data = [weather(p) if i < 5 else None for i, p in enumerate(points)]
+        output = str(tmp_path / 'dashboard.png')
+
+        assert create_weather_dashboard(points, data, output, route_length_km=48, dpi=40)
+        assert os.path.getsize(output) > 0
+
+
+class TestDashboardWorkerDeadline:
+    """Тесты для дедлайна внешнего модуля дашборда"""
+
+    def test_malformed_timings_line_skipped(self):
+        """Поврежденная строка TIMINGS пропускается, остальные длительности попадают в метрики"""
+        renders = EXTERNAL_DURATION.count(call='render')
+
+        bot.record_dashboard_timings('TIMINGS {"render": \nTIMINGS {"render": 0.5}\n')
+
+        assert EXTERNAL_DURATION.count(call='render') == renders + 1
+
+    @pytest.mark.asyncio
+    async def test_worker_meets_deadline(self, tmp_path, monkeypatch):
+        """Внешний модуль укладывается в дедлайн и рисует дашборд с пропусками"""
+        server = await FakeOpenMeteo(latency=1.0).start()
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv('OPEN_METEO_URL', server.url)
+        os.makedirs('cache')
+        os.symlink(os.path.join(ROOT, 'weather_dashboard.py'), 'weather_dashboard.py')
+        gpx_path = generate_gpx(str(tmp_path / 'route.gpx'), length_km=120, points=1000, seed=3)
+        start = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        weather_json = os.path.join('cache', 'weather.json')
+        try:
+            started = time.monotonic()
+            ok = await asyncio.to_thread(bot.generate_weather_dashboard, gpx_path, start, 'dashboard.png',
+                                         dpi=40, weather_json=weather_json, deadline=12)
+            elapsed = time.monotonic() - started
+        finally:
+            await server.stop()
+
+        assert ok
+        assert os.path.exists('dashboard.png')
+        assert elapsed < 12 + bot.DASHBOARD_DEADLINE_GRACE
+        _, data = load_weather_data(weather_json)
+        assert any(item is not None for item in data)
+        assert any(item is None for item in data)
+
+
+@asynccontextmanager
+async def dashboard_worker(tmp_path, monkeypatch, **options):
+    """Внешний модуль дашборда в tmp_path с заглушкой Open-Meteo; отдает (заглушка, GPX, время старта)"""
+    server = await FakeOpenMeteo(**options).start()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('OPEN_METEO_URL', server.url)
+    os.makedirs('cache')
+    os.symlink(os.path.join(ROOT, 'weather_dashboard.py'), 'weather_dashboard.py')
+    gpx_path = generate_gpx(str(tmp_path / 'route.gpx'), length_km=18, points=200, seed=5)
+    start = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    try:
+        yield server, gpx_path, start
+    finally:
+        await server.stop()
+
+
+class TestWeatherCache:
+    """Тесты для сохранения погоды внешним модулем: сбой Open-Meteo не кэшируется"""
+
+    @pytest.mark.asyncio
+    async def test_failed_fetch_is_not_saved(self, tmp_path, monkeypatch):
+        """Если прогноз не получен ни для одной точки, модуль завершается с ошибкой и ничего не сохраняет"""
+        async with dashboard_worker(tmp_path, monkeypatch, error_rate=1.0) as (server, gpx_path, start):
+            weather_json = os.path.join('cache', 'weather.json')
+            ok = await asyncio.to_thread(bot.generate_weather_dashboard, gpx_path, start,
+                                         weather_json=weather_json, deadline=5, fetch_only=True)
+            assert not ok
+            assert not os.path.exists(weather_json)
+
+            # Сеть вернулась - следующий запуск снова спрашивает Open-Meteo
+            server.error_rate = 0.0
+            calls = server.calls['forecast']
+            ok = await asyncio.to_thread(bot.generate_weather_dashboard, gpx_path, start,
+                                         weather_json=weather_json, deadline=5, fetch_only=True)
+
+        assert ok
+        assert server.calls['forecast'] > calls
+        assert bot.is_weather_data_fresh(weather_json)
+
+    @pytest.mark.asyncio
+    async def test_partial_fetch_is_fetched_again(self, tmp_path, monkeypatch):
+        """Прогноз, обрезанный дедлайном, рисуется с пропусками, но следующий запуск снова спрашивает Open-Meteo"""
+        async with dashboard_worker(tmp_path, monkeypatch, latency=1.5) as (server, gpx_path, start):
+            weather_json = os.path.join('cache', 'weather.json')
+            ok = await asyncio.to_thread(bot.generate_weather_dashboard, gpx_path, start, 'preview.png',
+                                         dpi=40, weather_json=weather_json, deadline=4)
+            assert ok
+            _, data = load_weather_data(weather_json)
+            assert any(item is None for item in data)
+            assert not bot.is_weather_data_fresh(weather_json)
+
+            server.latency = 0.0
+            calls = server.calls['forecast']
+            ok = await asyncio.to_thread(bot.generate_weather_dashboard, gpx_path, start, 'full.png',
+                                         dpi=40, weather_json=weather_json, deadline=20)
+
+        assert ok
+        assert server.calls['forecast'] > calls
+        _, data = load_weather_data(weather_json)
+        assert all(item is not None for item in data)
+        assert bot.is_weather_data_fresh(weather_json)
@@ -0,0 +1,440 @@
+"""Тесты генерации дашборда: сводка погоды, предпросмотр и полное качество"""
+
+import os
+import glob
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+
+import bot
+from fakes.komoot import FakeKomootAPI
+from loadtest.run import LevelStats
+from loadtest.scenario import ANNOUNCE_SCENARIO, NO_DASHBOARD_SCENARIO, SimulatedUser, Step
+from tests.test_sessions import running_bot
+from weather_dashboard import save_weather_data, load_weather_data
+
+
+@pytest.fixture
+def dashboard_user_data(temp_dir):
+    """Данные пользователя с треком и временем старта, файлы пишутся во временную директорию"""
+    original_cwd = os.getcwd()
+    original_cache_dir = bot.CACHE_DIR
+    os.chdir(temp_dir)
+    bot.CACHE_DIR = temp_dir
+    try:
+        yield {
+            'tour_id': '123',
+            'gpx_path': 'route.gpx',
+            'parsed_datetime': datetime(2025, 9, 6, 8, 30, tzinfo=timezone.utc),
+        }
+    finally:
+        os.chdir(original_cwd)
+        bot.CACHE_DIR = original_cache_dir
+
+
+# Сводка погоды, как ее возвращает summarize_weather
+SUMMARY = {'temperature_min': 18.2, 'temperature_max': 23.6, 'precipitation_max': 10.0, 'wind_direction': 225.0,
+           'wind_speed': 5.0, 'weather_code': 1, 'weather_code_worst': 1, 'headwind': [2.0, 0.0], 'missing': 0}
+
+
+def fake_generate(gpx_path, start_datetime, output_path="weather_dashboard.png", speed_kmh=27,
+                  dpi=150, weather_json=None):
+    """Имитирует внешний модуль: пишет картинку и JSON с погодой"""
+    with open(output_path, 'w') as f:
+        f.write(str(dpi))
+    if weather_json and not os.path.exists(weather_json):
+        point = {'lat': 45.0, 'lon': 19.8, 'time': start_datetime, 'distance_km': 0.0}
+        save_weather_data(weather_json, [point], [{'time': start_datetime, 'distance_km': 0.0, 'temperature': 20.0}])
+    return True
+
+
+class TestDashboardQuality:
+    """Тесты для предпросмотра и дашборда в полном качестве"""
+
+    def test_weather_data_roundtrip(self, temp_dir):
+        """Данные о погоде сохраняются и загружаются без потерь"""
+        start = datetime(2025, 9, 6, 8, 30, tzinfo=timezone.utc)
+        route_points = [
+            {'lat': 45.0, 'lon': 19.0, 'time': start, 'distance_km': 6.0, 'ele': 80.0},
+            {'lat': 45.1, 'lon': 19.1, 'time': start + timedelta(minutes=13), 'distance_km': 12.0, 'ele': 90.0},
+        ]
+        weather_data = [
+            {'time': start, 'distance_km': 6.0, 'temperature': 20.5, 'weather_code': 3},
+            None,
+        ]
+        path = os.path.join(temp_dir, 'weather.json')
+
+        save_weather_data(path, route_points, weather_data)
+        loaded_points, loaded_weather = load_weather_data(path)
+
+        assert loaded_points == route_points
+        assert loaded_weather == weather_data
+
+    def test_preview_uses_low_dpi(self, dashboard_user_data):
+        """Предпросмотр рисуется в низком разрешении и сохраняет данные о погоде"""
+        with patch('bot.generate_weather_dashboard', side_effect=fake_generate) as mock_generate:
+            preview_path = bot.generate_preview_dashboard(dashboard_user_data, 42)
+
+        assert preview_path.endswith('_preview.png')
+        assert mock_generate.call_args.kwargs['dpi'] == bot.DASHBOARD_PREVIEW_DPI
+        assert dashboard_user_data['dashboard_path'] == preview_path
+        assert os.path.exists(dashboard_user_data['dashboard_weather_path'])
+
+    def test_preview_reused_when_fresh(self, dashboard_user_data):
+        """Повторный предпросмотр для того же маршрута и времени не перерисовывается"""
+        with patch('bot.generate_weather_dashboard', side_effect=fake_generate) as mock_generate:
+            bot.generate_preview_dashboard(dashboard_user_data, 42)
+            bot.generate_preview_dashboard(dashboard_user_data, 42)
+
+        assert mock_generate.call_count == 1
+
+    def test_publish_renders_full_quality_from_saved_weather(self, dashboard_user_data):
+        """При отправке дашборд рисуется в полном качестве по сохраненной погоде"""
+        with patch('bot.generate_weather_dashboard', side_effect=fake_generate) as mock_generate:
+            bot.generate_preview_dashboard(dashboard_user_data, 42)
+            full_path = bot.get_publish_dashboard(dashboard_user_data)
+            # Второй раз берется готовый файл
+            assert bot.get_publish_dashboard(dashboard_user_data) == full_path
+
+        assert mock_generate.call_count == 2
+        full_call = mock_generate.call_args_list[1]
+        assert full_call.kwargs['dpi'] == bot.DASHBOARD_FULL_DPI
+        assert full_call.kwargs['weather_json'] == dashboard_user_data['dashboard_weather_path']
+        assert not full_path.endswith('_preview.png')
+
+    def test_publish_does_not_reuse_dashboard_with_gaps(self, dashboard_user_data):
+        """Дашборд в полном качестве, нарисованный по прогнозу с пропусками, при публикации рисуется заново"""
+        with patch('bot.generate_weather_dashboard', side_effect=fake_generate) as mock_generate:
+            bot.generate_preview_dashboard(dashboard_user_data, 42)
+            weather_json = dashboard_user_data['dashboard_weather_path']
+            point = {'lat': 45.0, 'lon': 19.8, 'time': dashboard_user_data['parsed_datetime'], 'distance_km': 0.0}
+            save_weather_data(weather_json, [point], [None])
+            bot.get_publish_dashboard(dashboard_user_data)
+            bot.get_publish_dashboard(dashboard_user_data)
+
+        assert mock_generate.call_count == 3
+
+    def test_remove_dashboard_files(self, dashboard_user_data):
+        """Удаление дашборда убирает его картинки, общий JSON с погодой остается"""
+        with patch('bot.generate_weather_dashboard', side_effect=fake_generate):
+            preview_path = bot.generate_preview_dashboard(dashboard_user_data, 42)
+            full_path = bot.get_publish_dashboard(dashboard_user_data)
+        weather_json = dashboard_user_data['dashboard_weather_path']
+
+        bot.remove_dashboard_files(dashboard_user_data)
+
+        assert not os.path.exists(preview_path)
+        assert not os.path.exists(full_path)
+        assert os.path.exists(weather_json)
+        assert dashboard_user_data['dashboard_path'] is None
+
+    def test_weather_with_gaps_is_fetched_again(self, dashboard_user_data):
+        """Прогноз с пропусками годится для одной сводки, но свежим не считается и запрашивается заново"""
+        calls = []
+        with patch('bot.generate_weather_dashboard', side_effect=fake_fetch_worker(calls, missing=1)):
+            summary = bot.fetch_preview_weather(dashboard_user_data, 42)
+        weather_json = dashboard_user_data['dashboard_weather_path']
+        assert summary['missing'] == 1
+        assert not bot.is_weather_data_fresh(weather_json)
+
+        with patch('bot.generate_weather_dashboard', side_effect=fake_fetch_worker(calls)):
+            summary = bot.fetch_preview_weather(dashboard_user_data, 42)
+            bot.fetch_preview_weather(dashboard_user_data, 42)
+
+        assert calls == [True, True]
+        assert summary['missing'] == 0
+        assert bot.is_weather_data_fresh(weather_json)
+
+    def test_organizers_of_same_tour_do_not_share_pictures(self, dashboard_user_data):
+        """Два организатора одного маршрута на одно время: картинки свои, погода общая"""
+        other_user_data = dict(dashboard_user_data)
+        with patch('bot.generate_weather_dashboard', side_effect=fake_generate):
+            preview_path = bot.generate_preview_dashboard(dashboard_user_data, 42)
+            other_preview_path = bot.generate_preview_dashboard(other_user_data, 43)
+            full_path = bot.get_publish_dashboard(dashboard_user_data)
+            other_full_path = bot.get_publish_dashboard(other_user_data)
+
+        assert preview_path != other_preview_path
+        assert full_path != other_full_path
+        assert dashboard_user_data['dashboard_weather_path'] == other_user_data['dashboard_weather_path']
+
+        bot.remove_dashboard_files(dashboard_user_data)
+
+        assert os.path.exists(other_preview_path)
+        assert os.path.exists(other_full_path)
+        assert os.path.exists(other_user_data['dashboard_weather_path'])
+
+    def test_concurrent_weather_saves(self, temp_dir):
+        """Одновременная запись общего JSON с погодой не путает временные файлы"""
+        start = datetime(2025, 9, 6, 8, 30, tzinfo=timezone.utc)
+        route_points = [{'lat': 45.0, 'lon': 19.0, 'time': start, 'distance_km': 0.0}] * 200
+        weather_data = [{'time': start, 'distance_km': 0.0, 'temperature': 20.5}] * 200
+        path = os.path.join(temp_dir, 'weather.json')
+        errors = []
+
+        def save():
+            try:
+                for _ in range(20):
+                    save_weather_data(path, route_points, weather_data)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=save) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors
+        assert load_weather_data(path) == (route_points, weather_data)
+        assert os.listdir(temp_dir) == ['weather.json']
+
+
+@asynccontextmanager
+async def announce_bot(tmp_path, monkeypatch, fake_fetch=True):
+    """Бот в отдельной папке с заглушкой Komoot; отрисовка ждет release (api, application, release)"""
+    komoot = await FakeKomootAPI().start()
+    monkeypatch.setattr(bot, 'KOMOOT_BASE_URL', komoot.url)
+    monkeypatch.setenv('KOMOOT_BASE_URL', komoot.url)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('cache')
+    # Фоновые задачи прошлых тестов остаются в глобальных словарях бота
+    for name in ('DASHBOARD_RENDERS', 'WEATHER_CAPTIONS', 'WEATHER_PREFETCHES', 'WEATHER_PREFETCH_HISTORY'):
+        monkeypatch.setattr(bot, name, {})
+    release = threading.Event()
+
+    def fetch(user_data, owner):
+        return SUMMARY
+
+    def render(user_data, owner):
+        release.wait(10)
+        # Отрисовка может закончиться после теста, когда рабочая папка уже прежняя
+        path = str(tmp_path / 'preview.png')
+        with open(path, 'wb') as f:
+            f.write(b'png')
+        user_data['dashboard_path'] = path
+        return path
+
+    if fake_fetch:
+        monkeypatch.setattr(bot, 'fetch_preview_weather', fetch)
+    monkeypatch.setattr(bot, 'generate_preview_dashboard', render)
+    try:
+        async with running_bot() as (api, application):
+            yield api, application, release
+    finally:
+        release.set()
+        await komoot.stop()
+
+
+class TestProgressiveDashboard:
+    """Тесты для сводки погоды до дашборда и отрисовки в фоне"""
+
+    @staticmethod
+    async def rendering(key):
+        while key not in bot.DASHBOARD_RENDERS:
+            await asyncio.sleep(0.01)
+
+    @pytest.mark.asyncio
+    async def test_summary_before_dashboard(self, tmp_path, monkeypatch):
+        """Сводка погоды приходит, пока дашборд рисуется, а готовый дашборд попадает в предпросмотр"""
+        async with announce_bot(tmp_path, monkeypatch) as (api, application, release):
+            user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+            stats = LevelStats(users=1)
+            assert await user.run(ANNOUNCE_SCENARIO[:10], stats), stats.errors
+            # Сводка отправляется до того, как отрисовка запущена
+            await asyncio.wait_for(self.rendering((42, 42)), 5)
+            photos = api.calls['sendPhoto']
+
+            release.set()
+            assert await user.run(ANNOUNCE_SCENARIO[10:11], stats), stats.errors
+            while bot.SESSIONS.running((42, 42)):
+                await asyncio.sleep(0.01)
+
+            assert api.calls['sendPhoto'] == photos + 1
+            assert application.user_data[42]['dashboard_path'] == str(tmp_path / 'preview.png')
+            assert not bot.DASHBOARD_RENDERS
+
+    @pytest.mark.asyncio
+    async def test_publish_waits_for_dashboard(self, tmp_path, monkeypatch):
+        """Анонс, отправленный до конца отрисовки, дожидается дашборда"""
+        async with announce_bot(tmp_path, monkeypatch) as (api, application, release):
+            user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+            stats = LevelStats(users=1)
+            assert await user.run(ANNOUNCE_SCENARIO[:10], stats), stats.errors
+            await asyncio.wait_for(self.rendering((42, 42)), 5)
+            photos = api.calls['sendPhoto']
+
+            send = asyncio.create_task(user.run(ANNOUNCE_SCENARIO[-1:], stats))
+            await asyncio.sleep(0.3)
+            assert not send.done()
+            release.set()
+            assert await send, stats.errors
+
+            assert api.calls['sendPhoto'] == photos + 1
+
+    @pytest.mark.asyncio
+    async def test_weather_caption(self, tmp_path, monkeypatch):
+        """Сводка погоды текстом попадает в анонс без отрисовки дашборда"""
+        async with announce_bot(tmp_path, monkeypatch) as (api, application, release):
+            user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+            stats = LevelStats(users=1)
+            assert await user.run(ANNOUNCE_SCENARIO[:9], stats), stats.errors
+            caption_step = Step('weather_caption', '📝 Сводка погоды текстом', 'Всё верно?')
+            assert await user.run([caption_step], stats), stats.errors
+            while bot.SESSIONS.running((42, 42)):
+                await asyncio.sleep(0.01)
+
+            preview = application.user_data[42]['preview_caption']
+            assert '🌡 18–24°C, 🌤 преимущественно ясно' in preview
+            assert '💨 ЮЗ 5 м/с (встречный в первой половине)' in preview
+            assert not bot.DASHBOARD_RENDERS
+            assert api.calls['sendPhoto'] == 0
+
+
+class TestWeatherCaption:
+    """Тесты для сводки погоды текстом: организатор не ждет Open-Meteo"""
+
+    CAPTION_STEP = Step('weather_caption', '📝 Сводка погоды текстом', 'Всё верно?')
+
+    @pytest.mark.asyncio
+    async def test_fresh_weather_added_at_once(self, tmp_path, monkeypatch):
+        """Погода, полученная заранее, сразу попадает в сводку без нового запроса"""
+        calls = []
+        monkeypatch.setattr(bot, 'generate_weather_dashboard', fake_fetch_worker(calls))
+        async with announce_bot(tmp_path, monkeypatch, fake_fetch=False) as (api, application, release):
+            user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+            stats = LevelStats(users=1)
+            assert await user.run(ANNOUNCE_SCENARIO[:9], stats), stats.errors
+            assert await user.run([self.CAPTION_STEP], stats), stats.errors
+
+            assert application.user_data[42]['weather_caption']
+            assert not bot.WEATHER_CAPTIONS
+            assert calls == [True]
+
+    @pytest.mark.asyncio
+    async def test_caption_fetched_in_background(self, tmp_path, monkeypatch):
+        """Без свежей погоды шаг отвечает сразу, а сводка появляется в предпросмотре после прогноза"""
+        calls = []
+        fetched = threading.Event()
+        monkeypatch.setattr(bot, 'WEATHER_PREFETCH', 'off')
+        monkeypatch.setattr(bot, 'generate_weather_dashboard', fake_fetch_worker(calls, fetched))
+        async with announce_bot(tmp_path, monkeypatch, fake_fetch=False) as (api, application, release):
+            try:
+                user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+                stats = LevelStats(users=1)
+                assert await user.run(ANNOUNCE_SCENARIO[:9], stats), stats.errors
+                assert await user.run([self.CAPTION_STEP], stats), stats.errors
+                assert not application.user_data[42].get('weather_caption')
+                assert (42, 42) in bot.WEATHER_CAPTIONS
+            finally:
+                fetched.set()
+            while bot.SESSIONS.running((42, 42)):
+                await asyncio.sleep(0.01)
+
+            assert calls == [True]
+            assert '🌤 преимущественно ясно' in application.user_data[42]['preview_caption']
+
+
+def fake_fetch_worker(calls, release=None, missing=0):
+    """Имитирует внешний модуль в режиме fetch_only: сохраняет погоду на трех точках маршрута
+
+    missing - для скольких последних точек прогноз не получен.
+    """
+    def generate(gpx_path, start_datetime, output_path=None, dpi=None, weather_json=None, fetch_only=False,
+                 **kwargs):
+        calls.append(fetch_only)
+        if release is not None:
+            release.wait(10)
+        points = [{'lat': 45.0 + i * 0.05, 'lon': 19.8, 'ele': 80.0, 'distance_km': 6.0 * i,
+                   'time': start_datetime + timedelta(minutes=15 * i)} for i in range(3)]
+        weather = [{'time': point['time'], 'distance_km': point['distance_km'], 'temperature': 20.0,
+                    'feels_like': 19.0, 'humidity': 60.0, 'wind_speed': 18.0, 'wind_direction': 225.0,
+                    'pressure': 1013.0, 'weather_code': 1, 'precipitation_probability': 10.0,
+                    'cloud_cover': 40.0} for point in points]
+        weather[len(weather) - missing:] = [None] * missing
+        save_weather_data(weather_json, points, weather)
+        return True
+
+    return generate
+
+
+class TestWeatherPrefetch:
+    """Тесты для погоды, которая получается заранее, пока организатор заполняет анонс"""
+
+    @staticmethod
+    async def prefetched():
+        while bot.WEATHER_PREFETCHES:
+            await asyncio.sleep(0.01)
+
+    @pytest.mark.asyncio
+    async def test_dashboard_uses_prefetched_weather(self, tmp_path, monkeypatch):
+        """Погода запрашивается сразу после маршрута, и дашборд ее не запрашивает повторно"""
+        calls = []
+        monkeypatch.setattr(bot, 'generate_weather_dashboard', fake_fetch_worker(calls))
+        async with announce_bot(tmp_path, monkeypatch, fake_fetch=False) as (api, application, release):
+            user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+            stats = LevelStats(users=1)
+            assert await user.run(ANNOUNCE_SCENARIO[:4], stats), stats.errors
+            await asyncio.wait_for(self.prefetched(), 5)
+            assert calls == [True]
+
+            assert await user.run(ANNOUNCE_SCENARIO[4:10], stats), stats.errors
+            assert calls == [True]
+
+    @pytest.mark.asyncio
+    async def test_failed_prefetch_does_not_stop_fetch(self, tmp_path, monkeypatch):
+        """Прогноз с пропусками, полученный заранее, не остается в кэше, и дашборд запрашивает погоду заново"""
+        calls = []
+        monkeypatch.setattr(bot, 'generate_weather_dashboard', fake_fetch_worker(calls, missing=2))
+        async with announce_bot(tmp_path, monkeypatch, fake_fetch=False) as (api, application, release):
+            user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+            stats = LevelStats(users=1)
+            assert await user.run(ANNOUNCE_SCENARIO[:4], stats), stats.errors
+            await asyncio.wait_for(self.prefetched(), 5)
+            assert calls == [True]
+            assert not glob.glob(os.path.join('cache', 'dashboard_*.json'))
+
+            monkeypatch.setattr(bot, 'generate_weather_dashboard', fake_fetch_worker(calls))
+            assert await user.run(ANNOUNCE_SCENARIO[4:10], stats), stats.errors
+            assert calls == [True, True]
+            assert bot.is_weather_data_fresh(glob.glob(os.path.join('cache', 'dashboard_*.json'))[0])
+
+    @pytest.mark.asyncio
+    async def test_skip_cancels_prefetch(self, tmp_path, monkeypatch):
+        """Анонс без дашборда отменяет получение погоды заранее"""
+        calls = []
+        fetching = threading.Event()
+        monkeypatch.setattr(bot, 'generate_weather_dashboard', fake_fetch_worker(calls, fetching))
+        async with announce_bot(tmp_path, monkeypatch, fake_fetch=False) as (api, application, release):
+            try:
+                user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+                stats = LevelStats(users=1)
+                assert await user.run(ANNOUNCE_SCENARIO[:4], stats), stats.errors
+                _, prefetch = bot.WEATHER_PREFETCHES[(42, 42)]
+
+                assert await user.run(NO_DASHBOARD_SCENARIO[4:10], stats), stats.errors
+                assert prefetch.cancelled()
+                assert not bot.WEATHER_PREFETCHES
+            finally:
+                fetching.set()
+
+    def test_budget(self, monkeypatch):
+        """Организатор, который часто меняет маршрут или время, не получает погоду заранее сверх бюджета"""
+        monkeypatch.setattr(bot, 'WEATHER_PREFETCH_BUDGET', 2)
+        monkeypatch.setattr(bot, 'WEATHER_PREFETCH_HISTORY', {})
+
+        assert bot.take_prefetch_budget(42, now=0)
+        assert bot.take_prefetch_budget(42, now=10)
+        assert not bot.take_prefetch_budget(42, now=20)
+        assert bot.take_prefetch_budget(7, now=20)
+        assert bot.take_prefetch_budget(42, now=bot.WEATHER_PREFETCH_WINDOW + 1)
+        # Организаторы без получений погоды за окно забываются
+        assert bot.take_prefetch_budget(42, now=2 * bot.WEATHER_PREFETCH_WINDOW + 2)
+        assert list(bot.WEATHER_PREFETCH_HISTORY) == [42]
+        monkeypatch.setattr(bot, 'WEATHER_PREFETCH_BUDGET', 0)
+        assert not bot.take_prefetch_budget(8, now=2 * bot.WEATHER_PREFETCH_WINDOW + 3)
+        assert 8 not in bot.WEATHER_PREFETCH_HISTORY
@@ -0,0 +1,243 @@
+"""Тесты для диспетчера нескольких процессов бота и общего хранилища"""
+
+import os
+import time
+import asyncio
+from collections import Counter, defaultdict
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from dispatcher import Dispatcher, shard_for, update_chat_id
+from file_id_cache import FileIdCache
+from loadtest.run import run
+from loadtest.scenario import NO_DASHBOARD_SCENARIO
+from persistence import StorePersistence
+from shared_store import MemoryStore, SQLiteStore, open_store
+from webhook import SECRET_HEADER
+
+
+def message_update(update_id, chat_id, text='привет'):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text,
+        'chat': {'id': chat_id, 'type': 'private'}, 'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Тест'},
+    }}
+
+
+class StubWorker:
+    """Процесс бота, который обрабатывает апдейты по одному за service_time секунд
+
+    Так ведет себя процесс, занявший свое ядро полностью: следующий апдейт ждет
+    окончания предыдущего. Заглушки работают в одном event loop, поэтому
+    обработка имитируется паузой, а не вычислениями.
+    """
+
+    def __init__(self, service_time=0.0):
+        self.service_time = service_time
+        self.received = []
+        self.headers = []
+        self._lock = asyncio.Lock()
+        self._runner = None
+        self.url = None
+
+    async def _handle(self, request):
+        self.headers.append(request.headers.get(SECRET_HEADER))
+        update = await request.json()
+        async with self._lock:
+            if self.service_time:
+                await asyncio.sleep(self.service_time)
+            self.received.append(update)
+        return web.Response()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/telegram', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/telegram"
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+async def post_updates(dispatcher, updates, secret='public-secret'):
+    async with aiohttp.ClientSession() as session:
+        async def post(update):
+            async with session.post(dispatcher.url, json=update, headers={SECRET_HEADER: secret}) as response:
+                return response.status
+        return await asyncio.gather(*(post(update) for update in updates))
+
+
+class TestSharding:
+    """Тесты для выбора процесса по апдейту"""
+
+    def test_update_chat_id(self):
+        """ID чата берется из сообщения, кнопки или пользователя"""
+        assert update_chat_id(message_update(1, 42)) == 42
+        assert update_chat_id({'update_id': 1, 'callback_query': {'from': {'id': 7}, 'message': {
+            'chat': {'id': 8}}}}) == 8
+        assert update_chat_id({'update_id': 1, 'inline_query': {'from': {'id': 9}}}) == 9
+        assert update_chat_id({'update_id': 1}) is None
+
+    def test_same_chat_same_worker(self):
+        """Все апдейты чата идут в один процесс, чаты распределяются по всем процессам"""
+        shards = {chat_id: {shard_for(message_update(i, chat_id), 4) for i in range(5)} for chat_id in range(1000)}
+        counts = Counter(next(iter(workers)) for workers in shards.values())
+
+        assert all(len(workers) == 1 for workers in shards.values())
+        assert set(counts) == {0, 1, 2, 3}
+        assert min(counts.values()) > 150
+
+
+class TestDispatcher:
+    """Тесты для Dispatcher с заглушками процессов бота"""
+
+    @pytest.mark.asyncio
+    async def test_forwards_by_chat(self):
+        """Апдейты чата попадают в один процесс вместе с внутренним секретом"""
+        workers = [await StubWorker().start() for _ in range(3)]
+        dispatcher = await Dispatcher([w.url for w in workers], 'worker-secret', listen='127.0.0.1', port=0,
+                                      secret='public-secret').start()
+        try:
+            statuses = await post_updates(dispatcher, [message_update(i, 100 + i % 10) for i in range(50)])
+            forbidden = await post_updates(dispatcher, [message_update(99, 1)], secret='wrong')
+        finally:
+            await dispatcher.stop()
+            for worker in workers:
+                await worker.stop()
+
+        chats = defaultdict(set)
+        for index, worker in enumerate(workers):
+            for update in worker.received:
+                chats[update['message']['chat']['id']].add(index)
+        assert statuses == [200] * 50
+        assert forbidden == [403]
+        assert len(chats) == 10
+        assert all(len(indexes) == 1 for indexes in chats.values())
+        assert {header for w in workers for header in w.headers} == {'worker-secret'}
+
+    @pytest.mark.asyncio
+    async def test_unavailable_worker(self):
+        """Если процесс бота недоступен, Telegram получает 503 и повторит апдейт"""
+        worker = await StubWorker().start()
+        url = worker.url
+        await worker.stop()
+        dispatcher = await Dispatcher([url], 'worker-secret', listen='127.0.0.1', port=0,
+                                      secret='public-secret').start()
+        try:
+            statuses = await post_updates(dispatcher, [message_update(1, 42)])
+        finally:
+            await dispatcher.stop()
+
+        assert statuses == [503]
+        assert dispatcher.failed[0] == 1
+
+    @pytest.mark.asyncio
+    async def test_distributes_chats_across_workers(self):
+        """Каждый процесс получает апдейты ровно своих чатов, и чаты делятся между процессами поровну"""
+        workers = [await StubWorker().start() for _ in range(4)]
+        dispatcher = await Dispatcher([w.url for w in workers], 'worker-secret', listen='127.0.0.1', port=0,
+                                      secret='public-secret').start()
+        updates = [message_update(i, 1000 + i) for i in range(400)]
+        try:
+            statuses = await post_updates(dispatcher, updates)
+        finally:
+            await dispatcher.stop()
+            for worker in workers:
+                await worker.stop()
+
+        expected = Counter(shard_for(update, 4) for update in updates)
+        assert statuses == [200] * 400
+        assert {index: len(worker.received) for index, worker in enumerate(workers)} == expected
+        assert dispatcher.forwarded == expected
+        assert min(expected.values()) > 60
+        for index, worker in enumerate(workers):
+            assert {shard_for(update, 4) for update in worker.received} == {index}
+
+    @pytest.mark.asyncio
+    async def test_slow_worker_does_not_block_others(self):
+        """Занятый процесс не задерживает апдейты чатов, которые обслуживают другие процессы"""
+        workers = [await StubWorker(service_time=1.0).start(), await StubWorker().start()]
+        dispatcher = await Dispatcher([w.url for w in workers], 'worker-secret', listen='127.0.0.1', port=0,
+                                      secret='public-secret').start()
+        chats = range(1000, 1100)
+        slow = next(message_update(1, chat) for chat in chats if shard_for(message_update(1, chat), 2) == 0)
+        fast = [message_update(i, chat) for i, chat in enumerate(chats, start=2)
+                if shard_for(message_update(i, chat), 2) == 1][:10]
+        try:
+            busy = asyncio.create_task(post_updates(dispatcher, [slow]))
+            await asyncio.sleep(0.1)
+            started = time.perf_counter()
+            statuses = await post_updates(dispatcher, fast)
+            elapsed = time.perf_counter() - started
+            assert await busy == [200]
+        finally:
+            await dispatcher.stop()
+            for worker in workers:
+                await worker.stop()
+
+        assert statuses == [200] * len(fast)
+        assert elapsed < 0.5
+
+    @pytest.mark.skipif((os.cpu_count() or 1) < 2, reason='Масштабирование процессов бота видно только на 2+ ядрах')
+    @pytest.mark.asyncio
+    async def test_real_bot_workers_scale(self):
+        """Настоящий бот: два процесса за диспетчером обслуживают больше шагов в секунду, чем один"""
+        one = await run([20], scenario=NO_DASHBOARD_SCENARIO, workers=1)
+        two = await run([20], scenario=NO_DASHBOARD_SCENARIO, workers=2)
+
+        assert one['levels'][0]['completed'] == two['levels'][0]['completed'] == 20
+        assert two['levels'][0]['throughput_steps_per_s'] > one['levels'][0]['throughput_steps_per_s']
+
+
+class TestSharedStore:
+    """Тесты для общего хранилища и persistence на нем"""
+
+    def test_sqlite_shared_between_connections(self, tmp_path):
+        """Запись одного процесса видна другому"""
+        path = str(tmp_path / 'state.db')
+        first, second = SQLiteStore(path), SQLiteStore(path)
+        first.set('ns', 'key', b'value')
+
+        assert second.get('ns', 'key') == b'value'
+        assert second.items('ns') == [('key', b'value')]
+        second.delete('ns', 'key')
+        assert first.get('ns', 'key') is None
+
+    def test_open_store(self, tmp_path):
+        """Хранилище выбирается по адресу из SHARED_STORE"""
+        assert open_store('') is None
+        assert isinstance(open_store('memory'), MemoryStore)
+        assert isinstance(open_store(f"sqlite:///{tmp_path / 'state.db'}"), SQLiteStore)
+        with pytest.raises(ValueError):
+            open_store('redis://localhost')
+
+    def test_file_id_cache_in_store(self, tmp_path):
+        """Кэш file_id в общем хранилище не пишет файл и виден другим экземплярам"""
+        store = MemoryStore()
+        path = str(tmp_path / 'file_ids.json')
+        FileIdCache(path, 'token', store=store).set('hash', 'file-id')
+
+        assert FileIdCache(path, 'token', store=store).get('hash') == 'file-id'
+        assert not os.path.exists(path)
+
+    @pytest.mark.asyncio
+    async def test_persistence_roundtrip(self):
+        """Разговоры и user_data восстанавливаются из хранилища"""
+        store = MemoryStore()
+        persistence = StorePersistence(store)
+        await persistence.update_conversation('announce', (42, 42), 3)
+        await persistence.update_conversation('announce', (43, 43), 5)
+        await persistence.update_conversation('announce', (43, 43), None)
+        await persistence.update_user_data(42, {'route_name': 'Фрушка Гора', 'length_km': 80.5})
+        await persistence.flush()
+
+        restored = StorePersistence(store)
+
+        assert await restored.load_conversation('announce', (42, 42)) == 3
+        assert await restored.load_conversation('announce', (43, 43)) is None
+        assert await restored.load_user_data(42) == {'route_name': 'Фрушка Гора', 'length_km': 80.5}
@@ -0,0 +1,131 @@
+"""Тесты для кэша file_id загруженных в Telegram файлов"""
+
+import os
+import threading
+import pytest
+from unittest.mock import AsyncMock, Mock
+from telegram.error import BadRequest
+
+import file_id_cache
+from file_id_cache import FileIdCache, send_file_cached
+
+
+def sent_photo(file_id):
+    """Сообщение Telegram с фото, как его возвращает reply_photo"""
+    message = Mock()
+    message.photo = [Mock(file_id='small'), Mock(file_id=file_id)]
+    return message
+
+
+@pytest.fixture
+def photo_path(temp_dir):
+    path = os.path.join(temp_dir, 'dashboard.png')
+    with open(path, 'wb') as f:
+        f.write(b'png bytes')
+    return path
+
+
+class TestFileIdCache:
+    """Тесты для FileIdCache и send_file_cached"""
+
+    @pytest.mark.asyncio
+    async def test_second_send_reuses_file_id(self, temp_dir, photo_path):
+        """Повторная отправка того же файла идет по file_id без загрузки"""
+        cache = FileIdCache(os.path.join(temp_dir, 'file_ids.json'), 'token')
+        send = AsyncMock(return_value=sent_photo('uploaded-id'))
+
+        await send_file_cached(cache, send, photo_path, caption='1')
+        await send_file_cached(cache, send, photo_path, caption='2')
+
+        first_photo = send.call_args_list[0].kwargs['photo']
+        assert first_photo == b'png bytes'
+        assert send.call_args_list[1].kwargs['photo'] == 'uploaded-id'
+
+    @pytest.mark.asyncio
+    async def test_cache_is_persistent_and_per_token(self, temp_dir, photo_path):
+        """Кэш переживает перезапуск и не смешивает file_id разных ботов"""
+        cache_path = os.path.join(temp_dir, 'file_ids.json')
+        await send_file_cached(FileIdCache(cache_path, 'token'), AsyncMock(return_value=sent_photo('id-1')),
+                               photo_path)
+
+        content_hash = FileIdCache(cache_path, 'token').content_hash(photo_path)
+        assert FileIdCache(cache_path, 'token').get(content_hash) == 'id-1'
+        assert FileIdCache(cache_path, 'other-token').get(content_hash) is None
+        with open(cache_path, encoding='utf-8') as f:
+            assert 'token' not in f.read()
+
+    @pytest.mark.asyncio
+    async def test_rejected_file_id_falls_back_to_upload(self, temp_dir, photo_path):
+        """Если Telegram не принял file_id, файл загружается заново"""
+        cache = FileIdCache(os.path.join(temp_dir, 'file_ids.json'), 'token')
+        cache.set(cache.content_hash(photo_path), 'stale-id')
+        send = AsyncMock(side_effect=[BadRequest('Wrong file identifier'), sent_photo('fresh-id')])
+
+        await send_file_cached(cache, send, photo_path)
+
+        assert send.call_count == 2
+        assert cache.get(cache.content_hash(photo_path)) == 'fresh-id'
+
+    @pytest.mark.asyncio
+    async def test_document_filename_only_on_upload(self, temp_dir, photo_path):
+        """Имя файла передается только при загрузке документа"""
+        cache = FileIdCache(os.path.join(temp_dir, 'file_ids.json'), 'token')
+        message = Mock()
+        message.document.file_id = 'doc-id'
+        send = AsyncMock(return_value=message)
+
+        await send_file_cached(cache, send, photo_path, kind='document', filename='route.gpx')
+        await send_file_cached(cache, send, photo_path, kind='document', filename='route.gpx')
+
+        assert send.call_args_list[0].kwargs['filename'] == 'route.gpx'
+        assert send.call_args_list[1].kwargs == {'document': 'doc-id'}
+
+    def test_hashes_are_bounded(self, temp_dir, monkeypatch):
+        """Кэш хешей помнит только последние файлы и пересчитывает хеш измененного файла"""
+        monkeypatch.setattr(file_id_cache, 'HASH_CACHE_SIZE', 3)
+        cache = FileIdCache(os.path.join(temp_dir, 'file_ids.json'), 'token')
+        paths = []
+        for i in range(5):
+            paths.append(os.path.join(temp_dir, f'dashboard_{i}.png'))
+            with open(paths[-1], 'wb') as f:
+                f.write(b'png %d' % i)
+            cache.content_hash(paths[-1])
+
+        assert list(cache._hashes) == [os.path.abspath(path) for path in paths[-3:]]
+
+        old_hash = cache.content_hash(paths[-1])
+        with open(paths[-1], 'wb') as f:
+            f.write(b'changed png')
+        assert cache.content_hash(paths[-1]) != old_hash
+        assert len(cache._hashes) == 3
+
+        cache.forget(paths[-1])
+        assert os.path.abspath(paths[-1]) not in cache._hashes
+
+    @pytest.mark.asyncio
+    async def test_shared_store_is_used_off_event_loop(self, temp_dir, photo_path):
+        """Запросы к общему хранилищу идут не в потоке цикла событий"""
+        loop_thread = threading.get_ident()
+        threads = []
+
+        class Store:
+            def __init__(self):
+                self.values = {}
+
+            def get(self, namespace, key):
+                threads.append(threading.get_ident())
+                return self.values.get((namespace, key))
+
+            def set(self, namespace, key, value):
+                threads.append(threading.get_ident())
+                self.values[(namespace, key)] = value
+
+        cache = FileIdCache(os.path.join(temp_dir, 'file_ids.json'), 'token', store=Store())
+        send = AsyncMock(return_value=sent_photo('uploaded-id'))
+
+        await send_file_cached(cache, send, photo_path)
+        await send_file_cached(cache, send, photo_path)
+
+        assert send.call_args_list[1].kwargs['photo'] == 'uploaded-id'
+        assert len(threads) == 3
+        assert loop_thread not in threads
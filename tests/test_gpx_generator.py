@@ -0,0 +1,75 @@
+"""Тесты для генератора синтетических GPX треков"""
+
+import os
+import subprocess
+import sys
+import gpxpy
+import pytest
+
+from gpx_generator import generate_gpx, generate_track
+from bot import extract_route_name_from_gpx
+from weather_dashboard import get_route_points_with_time, calculate_distance
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return gpxpy.parse(f)
+
+
+class TestGpxGenerator:
+    """Тесты для gpx_generator"""
+
+    @pytest.mark.parametrize('shape', ['loop', 'out-and-back', 'point-to-point'])
+    def test_length_and_points(self, temp_dir, shape):
+        """Длина и число точек соответствуют заданным"""
+        path = generate_gpx(os.path.join(temp_dir, 'track.gpx'), length_km=40, points=2000, shape=shape, seed=1)
+        gpx = parse(path)
+
+        assert gpx.get_track_points_no() == 2000
+        assert gpx.length_2d() / 1000 == pytest.approx(40, rel=0.02)
+
+    @pytest.mark.parametrize('shape', ['loop', 'out-and-back'])
+    def test_returns_to_start(self, shape):
+        """Кольцо и маршрут туда и обратно заканчиваются в точке старта"""
+        lats, lons, _, _ = generate_track(length_km=60, points=3000, shape=shape, seed=2)
+        assert calculate_distance(lats[0], lons[0], lats[-1], lons[-1]) < 50
+
+    def test_komoot_like_file(self, temp_dir):
+        """Файл читается так же, как выгрузка Komoot: название, время и высота у точек"""
+        path = generate_gpx(os.path.join(temp_dir, 'track.gpx'), length_km=20, points_per_km=10,
+                            name='Фрушка Гора & обратно', tour_id=123456)
+
+        points = get_route_points_with_time(path)
+
+        assert extract_route_name_from_gpx(path) == 'Фрушка Гора & обратно'
+        assert len(points) == 200
+        assert all(b['time'] > a['time'] for a, b in zip(points, points[1:]))
+        assert len({round(p['ele']) for p in points}) > 10
+        with open(path, encoding='utf-8') as f:
+            assert 'https://www.komoot.com/tour/123456' in f.read()
+
+    def test_tracks_and_segments(self, temp_dir):
+        """Трек разбивается на несколько треков и сегментов"""
+        gpx = parse(generate_gpx(os.path.join(temp_dir, 'track.gpx'), length_km=10, points=300, tracks=2,
+                                 segments=3))
+
+        assert len(gpx.tracks) == 2
+        assert [len(track.segments) for track in gpx.tracks] == [3, 3]
+        assert gpx.length_2d() / 1000 == pytest.approx(10, rel=0.02)
+
+    def test_deterministic_with_seed(self):
+        """С одним зерном получается один и тот же трек"""
+        first = generate_track(length_km=10, points=100, shape='point-to-point', seed=7)
+        second = generate_track(length_km=10, points=100, shape='point-to-point', seed=7)
+        assert (first[0] == second[0]).all() and first[3] == second[3]
+
+    def test_cli(self, temp_dir):
+        """Генератор запускается из командной строки"""
+        path = os.path.join(temp_dir, 'cli.gpx')
+        result = subprocess.run([sys.executable, 'gpx_generator.py', path, '--length', '15', '--points', '500',
+                                 '--shape', 'out-and-back'], cwd=ROOT, capture_output=True, text=True)
+
+        assert result.returncode == 0, result.stderr
+        assert parse(path).get_track_points_no() == 500
@@ -0,0 +1,81 @@
+"""Тесты для заглушки Bot API и нагрузочного теста"""
+
+import aiohttp
+import pytest
+
+from bot import build_application
+from fakes.telegram_api import FakeTelegramAPI
+from loadtest.run import LevelStats, format_report, percentile
+from loadtest.scenario import ANNOUNCE_SCENARIO, SimulatedUser
+
+
+class TestStats:
+    """Тесты для подсчета результатов уровня нагрузки"""
+
+    def test_percentile(self):
+        """Перцентиль методом ближайшего ранга"""
+        values = list(range(1, 101))
+
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile(values, 99) == 99
+        assert percentile([], 50) is None
+
+    def test_summary(self):
+        """Сводка считает пропускную способность и долю ошибок"""
+        stats = LevelStats(users=2)
+        for seconds in (0.1, 0.2, 0.3):
+            stats.observe('start', seconds)
+        stats.error('komoot_link', 'нет ответа')
+        stats.completed = 1
+        stats.duration = 2.0
+
+        summary = stats.summary()
+
+        assert summary['steps'] == 3
+        assert summary['throughput_steps_per_s'] == 1.5
+        assert summary['announces_per_min'] == 30.0
+        assert summary['error_rate'] == 0.25
+        assert summary['errors'] == {'komoot_link': ['нет ответа']}
+        assert 'p95, ms' in format_report([summary])
+
+
+class TestFakeTelegramAPI:
+    """Настоящий Application из bot.py против заглушки Bot API"""
+
+    @pytest.mark.asyncio
+    async def test_first_steps(self):
+        """Пользователь проходит выбор даты и времени, бот отвечает через заглушку"""
+        api = await FakeTelegramAPI().start()
+        application = build_application(token='123456:TEST', base_url=api.url)
+        await application.initialize()
+        await application.start()
+        await application.updater.start_polling(poll_interval=0, timeout=1)
+        try:
+            stats = LevelStats(users=1)
+            user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+
+            completed = await user.run(ANNOUNCE_SCENARIO[:3], stats)
+        finally:
+            await application.updater.stop()
+            await application.stop()
+            await application.shutdown()
+            await api.stop()
+
+        assert completed, stats.errors
+        assert set(stats.latencies) == {'start', 'date', 'time'}
+        assert api.calls['sendMessage'] >= 3
+
+    @pytest.mark.asyncio
+    async def test_unknown_method(self):
+        """Неизвестный метод Bot API возвращает 404, как Telegram"""
+        api = await FakeTelegramAPI().start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{api.url}/bot1:x/noSuchMethod") as response:
+                    body = await response.json()
+        finally:
+            await api.stop()
+
+        assert response.status == 404
+        assert body['ok'] is False
@@ -0,0 +1,86 @@
+"""Тесты для вынесения блокирующей работы из event loop и мониторинга его задержки"""
+
+import time
+import asyncio
+import threading
+import contextvars
+import pytest
+
+from executors import run_blocking
+from loop_monitor import LoopLagMonitor
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+async def blocking_handler():
+    """Обработчик, который по ошибке блокирует event loop"""
+    time.sleep(0.3)
+
+
+class TestRunBlocking:
+    """Тесты для run_blocking"""
+
+    @pytest.mark.asyncio
+    async def test_runs_in_worker_thread(self):
+        """Функция выполняется не в потоке event loop"""
+        loop_thread = threading.get_ident()
+
+        worker_thread = await run_blocking(threading.get_ident)
+
+        assert worker_thread != loop_thread
+
+    @pytest.mark.asyncio
+    async def test_keeps_context(self):
+        """contextvars переносятся в поток"""
+        request_id.set('abc')
+
+        assert await run_blocking(request_id.get) == 'abc'
+
+    @pytest.mark.asyncio
+    async def test_loop_stays_responsive(self):
+        """Пока блокирующая функция работает, loop обрабатывает другие задачи"""
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.02)
+
+        await asyncio.gather(run_blocking(time.sleep, 0.2), ticker())
+
+        assert len(ticks) == 5
+        assert ticks[-1] - ticks[0] < 0.2
+
+
+class TestLoopLagMonitor:
+    """Тесты для LoopLagMonitor"""
+
+    @pytest.mark.asyncio
+    async def test_reports_blocking_coroutine(self, caplog):
+        """Монитор замечает блокировку и называет корутину, которая ее вызвала"""
+        monitor = LoopLagMonitor(interval=0.05, threshold=0.1)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.1)
+            await blocking_handler()
+            await asyncio.sleep(0.1)
+        finally:
+            await monitor.stop()
+
+        assert monitor.stalls >= 1
+        assert monitor.last_offender.endswith('blocking_handler')
+        assert monitor.max_lag >= 0.1
+        assert 'blocking_handler' in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_no_stalls_when_idle(self):
+        """Без блокировок монитор ничего не сообщает"""
+        monitor = LoopLagMonitor(interval=0.02, threshold=0.1)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.15)
+        finally:
+            await monitor.stop()
+
+        assert monitor.samples >= 3
+        assert monitor.stalls == 0
@@ -0,0 +1,90 @@
+"""Тесты для диагностики памяти и команды /memory"""
+
+import os
+import pytest
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+import bot
+from memory_diagnostics import MemorySnapshots, deep_sizeof, user_data_sizes, live_conversations, open_files, \
+    format_memory_report
+
+
+class TestAccounting:
+    """Тесты для подсчета размеров и ресурсов"""
+
+    def test_deep_sizeof_counts_nested(self):
+        """Размер учитывает вложенные значения, а общие объекты - один раз"""
+        shared = 'x' * 10000
+        assert deep_sizeof({'a': shared}) > 10000
+        assert deep_sizeof({'a': shared, 'b': shared}) < 2 * 10000
+
+    def test_user_data_sorted_by_size(self):
+        """Самые большие user_data идут первыми"""
+        sizes = user_data_sizes({
+            1: {'date_time': '25.12 10:30'},
+            2: {'parsed_datetime': datetime.now(), 'comment': 'длинный комментарий ' * 100},
+        })
+        assert [user_id for user_id, _ in sizes] == [2, 1]
+
+    def test_live_conversations(self):
+        """Считаются только незавершенные разговоры"""
+        conversation = Mock(_conversations={(1, 1): 3, (2, 2): None, (3, 3): 0})
+        application = Mock(handlers={0: [conversation, Mock(spec=[])]})
+        assert live_conversations(application) == 2
+
+    def test_open_files_sees_leak(self, temp_dir):
+        """Незакрытый файл виден среди открытых дескрипторов"""
+        if not os.path.isdir('/proc/self/fd'):
+            pytest.skip('нужен /proc')
+        path = os.path.join(temp_dir, 'dashboard.png')
+        with open(path, 'wb') as f:
+            f.write(b'png')
+        leaked = open(path, 'rb')
+        try:
+            count, targets = open_files(limit=None)
+        finally:
+            leaked.close()
+
+        assert count > 0
+        assert (os.path.realpath(path), 1) in targets
+
+
+class TestSnapshots:
+    """Тесты для снимков tracemalloc"""
+
+    def test_diff_shows_growth(self):
+        """Второй снимок показывает место, где выросла память"""
+        snapshots = MemorySnapshots()
+        try:
+            assert snapshots.diff() == []
+            leak = [bytearray(1024) for _ in range(1000)]
+            top_stats = snapshots.diff()
+        finally:
+            snapshots.stop()
+
+        assert leak
+        assert any(os.path.basename(stat.traceback[0].filename) == 'test_memory_diagnostics.py'
+                   for stat in top_stats)
+
+    def test_report(self):
+        """Отчет содержит пользователей и незавершенные разговоры"""
+        application = Mock(handlers={}, user_data={1: {'route_name': 'Тест'}})
+        report = format_memory_report(application, MemorySnapshots(), [])
+        assert 'user_data: 1 пользователей' in report
+        assert 'Незавершенных разговоров: 0' in report
+
+
+class TestMemoryCommand:
+    """Тесты для команды /memory"""
+
+    @pytest.mark.asyncio
+    async def test_non_admin_refused(self, mock_update, mock_context):
+        """Обычный пользователь не может включить tracemalloc"""
+        mock_update.effective_user = Mock(id=12345)
+        mock_context.args = []
+
+        with patch.object(bot, 'ADMIN_IDS', set()):
+            await bot.memory_command(mock_update, mock_context)
+
+        assert not bot.MEMORY_SNAPSHOTS.tracing
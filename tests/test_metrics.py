@@ -0,0 +1,133 @@
+"""Тесты для метрик в формате Prometheus"""
+
+import socket
+import pytest
+import aiohttp
+from unittest.mock import Mock
+from telegram.ext import ConversationHandler, CommandHandler, MessageHandler, filters
+
+from metrics import Registry, MetricsServer, HANDLER_DURATION, HANDLER_ERRORS, instrument_callback, \
+    instrument_application, track_external, EXTERNAL_DURATION, EXTERNAL_ERRORS
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class TestRegistry:
+    """Тесты для текстового формата метрик"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Корзины гистограммы накапливаются, есть сумма и количество"""
+        registry = Registry()
+        histogram = registry.histogram('test_seconds', 'Тест', ('call',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, call='a')
+        histogram.observe(0.5, call='a')
+        histogram.observe(5, call='a')
+
+        text = registry.render()
+
+        assert '# TYPE test_seconds histogram' in text
+        assert 'test_seconds_bucket{call="a",le="0.1"} 1' in text
+        assert 'test_seconds_bucket{call="a",le="1.0"} 2' in text
+        assert 'test_seconds_bucket{call="a",le="+Inf"} 3' in text
+        assert 'test_seconds_count{call="a"} 3' in text
+
+    def test_counter_and_function_gauge(self):
+        """Счетчик с метками и вычисляемый gauge"""
+        registry = Registry()
+        counter = registry.counter('test_errors_total', 'Тест', ('call',))
+        counter.inc(call='komootgpx')
+        counter.inc(call='komootgpx')
+        registry.gauge('test_lag_seconds', 'Тест', function=lambda: 0.25)
+
+        text = registry.render()
+
+        assert 'test_errors_total{call="komootgpx"} 2.0' in text
+        assert 'test_lag_seconds 0.25' in text
+
+
+class TestInstrumentation:
+    """Тесты для замеров обработчиков и внешних вызовов"""
+
+    @pytest.mark.asyncio
+    async def test_callback_errors_counted(self):
+        """Исключение в обработчике считается ошибкой и пробрасывается дальше"""
+        async def broken_step(update, context):
+            raise ValueError('boom')
+
+        wrapped = instrument_callback(broken_step)
+        before = HANDLER_ERRORS.value(handler='broken_step')
+
+        with pytest.raises(ValueError):
+            await wrapped(Mock(), Mock())
+
+        assert HANDLER_ERRORS.value(handler='broken_step') == before + 1
+        assert HANDLER_DURATION.count(handler='broken_step') >= 1
+
+    def test_conversation_states_instrumented(self):
+        """Оборачиваются обработчики точек входа и всех состояний разговора"""
+        async def start(update, context):
+            pass
+
+        async def state_step(update, context):
+            pass
+
+        conversation = ConversationHandler(
+            entry_points=[CommandHandler('start', start)],
+            states={1: [MessageHandler(filters.TEXT, state_step)]},
+            fallbacks=[],
+        )
+        application = Mock(handlers={0: [conversation]})
+
+        instrument_application(application)
+        instrument_application(application)
+
+        step = conversation.states[1][0].callback
+        assert step.instrumented
+        assert step.__wrapped__ is state_step
+        assert conversation.entry_points[0].callback.instrumented
+
+    def test_external_call_tracked(self):
+        """Внешний вызов замеряется, а ошибка учитывается"""
+        before = EXTERNAL_ERRORS.value(call='test_call')
+
+        with pytest.raises(RuntimeError):
+            with track_external('test_call'):
+                raise RuntimeError('komootgpx упал')
+
+        assert EXTERNAL_DURATION.count(call='test_call') == 1
+        assert EXTERNAL_ERRORS.value(call='test_call') == before + 1
+
+
+class TestMetricsServer:
+    """Тесты для HTTP-сервера метрик"""
+
+    @pytest.mark.asyncio
+    async def test_scrape(self):
+        """Метрики отдаются по HTTP на /metrics"""
+        registry = Registry()
+        registry.counter('test_scrapes_total', 'Тест').inc()
+        port = free_port()
+        server = MetricsServer('127.0.0.1', port, registry)
+        await server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{port}/metrics') as response:
+                    assert response.status == 200
+                    assert response.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+                    assert 'X-Prometheus-Format' not in response.headers
+                    text = await response.text()
+        finally:
+            await server.stop()
+
+        assert 'test_scrapes_total 1.0' in text
+
+    @pytest.mark.asyncio
+    async def test_disabled_without_port(self):
+        """Без порта сервер не запускается"""
+        server = MetricsServer('127.0.0.1', '')
+        await server.start()
+        assert server._runner is None
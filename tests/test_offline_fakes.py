@@ -0,0 +1,141 @@
+"""Тесты для локальных заглушек Komoot и Open-Meteo"""
+
+import os
+import sys
+import asyncio
+from datetime import datetime, timedelta
+
+import aiohttp
+import gpxpy
+import pytest
+import pytz
+
+import bot
+import weather_dashboard
+from fakes.komoot import FakeKomootAPI
+from fakes.open_meteo import FakeOpenMeteo, request_key
+from komoot_api import rewrite_url
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def route_points(count=3):
+    """Точки маршрута на завтра, как их готовит calculate_route_time_points"""
+    start = pytz.timezone('Europe/Belgrade').localize(datetime.now().replace(hour=8, minute=0) + timedelta(days=1))
+    return [{'lat': 45.25 + i * 0.05, 'lon': 19.83, 'time': start + timedelta(hours=i), 'distance_km': i * 25}
+            for i in range(count)]
+
+
+class TestFakeOpenMeteo:
+    """Тесты для FakeOpenMeteo"""
+
+    @pytest.mark.asyncio
+    async def test_dashboard_weather_offline(self, tmp_path, monkeypatch):
+        """Дашборд получает погоду от заглушки через настоящий клиент openmeteo_requests"""
+        server = await FakeOpenMeteo().start()
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(weather_dashboard, 'OPEN_METEO_URL', server.url)
+        try:
+            first = await asyncio.to_thread(weather_dashboard.get_weather_data_for_route, route_points())
+        finally:
+            await server.stop()
+
+        assert all(item is not None for item in first)
+        assert all(-20 < item['temperature'] < 45 for item in first)
+        assert all(0 <= item['humidity'] <= 100 for item in first)
+        assert server.calls['forecast'] == 3
+
+    @pytest.mark.asyncio
+    async def test_same_request_same_weather(self):
+        """Одинаковые запросы получают одинаковую погоду"""
+        server = await FakeOpenMeteo().start()
+        params = {'latitude': '45.25', 'longitude': '19.83', 'hourly': 'temperature_2m', 'format': 'flatbuffers'}
+        try:
+            async with aiohttp.ClientSession() as session:
+                bodies = []
+                for _ in range(2):
+                    async with session.get(f"{server.url}/v1/forecast", params=params) as response:
+                        bodies.append(await response.read())
+        finally:
+            await server.stop()
+
+        assert bodies[0] == bodies[1]
+
+    @pytest.mark.asyncio
+    async def test_recorded_response(self, tmp_path):
+        """Записанный ответ отдается как есть"""
+        params = {'latitude': '45.25', 'longitude': '19.83', 'hourly': 'temperature_2m'}
+        (tmp_path / f"{request_key(params.items())}.fb").write_bytes(b'recorded')
+        server = await FakeOpenMeteo(recordings=str(tmp_path)).start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{server.url}/v1/forecast", params=dict(params, format='flatbuffers')) as r:
+                    body = await r.read()
+        finally:
+            await server.stop()
+
+        assert body == b'recorded'
+
+    @pytest.mark.asyncio
+    async def test_errors_and_rate_limit(self):
+        """Ошибки и превышение лимита возвращаются с кодами 503 и 429"""
+        failing = await FakeOpenMeteo(error_rate=1.0).start()
+        limited = await FakeOpenMeteo(rate_limit=1).start()
+        params = {'latitude': '45.25', 'longitude': '19.83', 'hourly': 'temperature_2m'}
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{failing.url}/v1/forecast", params=params) as r:
+                    failing_status = r.status
+                statuses = []
+                for _ in range(3):
+                    async with session.get(f"{limited.url}/v1/forecast", params=params) as r:
+                        statuses.append(r.status)
+        finally:
+            await failing.stop()
+            await limited.stop()
+
+        assert failing_status == 503
+        assert statuses[0] == 200
+        assert 429 in statuses[1:]
+
+
+class TestFakeKomoot:
+    """Тесты для FakeKomootAPI и запуска komootgpx через komoot_api.py"""
+
+    def test_rewrite_url(self):
+        """Адрес Komoot API подменяется, остальные адреса остаются"""
+        url = 'https://api.komoot.de/v007/tours/123?_embedded=coordinates'
+
+        assert rewrite_url(url, 'http://127.0.0.1:1') == 'http://127.0.0.1:1/v007/tours/123?_embedded=coordinates'
+        assert rewrite_url(url, '') == url
+        assert rewrite_url('https://example.com/a', 'http://127.0.0.1:1') == 'https://example.com/a'
+
+    def test_bot_command(self, monkeypatch):
+        """С KOMOOT_BASE_URL бот запускает komootgpx через komoot_api.py"""
+        monkeypatch.setattr(bot, 'KOMOOT_BASE_URL', '')
+        assert bot.komootgpx_command('1')[0] == 'komootgpx'
+
+        monkeypatch.setattr(bot, 'KOMOOT_BASE_URL', 'http://127.0.0.1:1')
+
+        assert bot.komootgpx_command('1')[:2] == [sys.executable, bot.KOMOOT_API_SCRIPT]
+
+    @pytest.mark.asyncio
+    async def test_komootgpx_download(self, tmp_path):
+        """Настоящий komootgpx скачивает тур с заглушки и пишет GPX"""
+        server = await FakeKomootAPI(length_km=20, points_per_km=20).start()
+        env = dict(os.environ, KOMOOT_BASE_URL=server.url)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.join(ROOT, 'komoot_api.py'), '-d', '4242', '-o', str(tmp_path), '-e', '-n',
+                env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            output, _ = await asyncio.wait_for(process.communicate(), 60)
+        finally:
+            await server.stop()
+
+        assert process.returncode == 0, output.decode()
+        (path,) = tmp_path.glob('*-4242.gpx')
+        with open(path, 'r', encoding='utf-8') as f:
+            gpx = gpxpy.parse(f)
+        assert gpx.name == 'Fake tour 4242'
+        assert gpx.get_track_points_no() == 400
+        assert 19 < gpx.length_2d() / 1000 < 21
@@ -0,0 +1,188 @@
+"""Тесты для сохранения разговоров и user_data в общем хранилище"""
+
+import json
+import base64
+import pickle
+import sqlite3
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from pathlib import Path
+
+import pytest
+import pytz
+
+from bot import build_application
+from fakes.telegram_api import FakeTelegramAPI
+from loadtest.run import LevelStats
+from loadtest.scenario import ANNOUNCE_SCENARIO, SimulatedUser
+import persistence
+from persistence import StorePersistence, decode, encode
+from shared_store import MemoryStore, SQLiteStore
+from webhook import WebhookServer
+
+
+class CountingStore(MemoryStore):
+    """Хранилище в памяти, которое запоминает каждую пачку записей"""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def write_batch(self, changes):
+        self.batches.append(list(changes))
+        super().write_batch(changes)
+
+
+@asynccontextmanager
+async def persistent_bot(api, store):
+    """Приложение бота с persistence в store, получающее апдейты через вебхук"""
+    application = build_application(token='123456:TEST', base_url=api.url, store=store)
+    server = WebhookServer(application, url='', listen='127.0.0.1', port=0, secret='test-secret')
+    await application.initialize()
+    await application.start()
+    await server.start()
+    try:
+        yield application
+    finally:
+        await server.drain()
+        await application.stop()
+        await server.stop()
+        await application.shutdown()
+
+
+class TestCodec:
+    """Тесты для кодирования значений user_data"""
+
+    def test_roundtrip(self):
+        """Даты с зоной, пути, кортежи и байты восстанавливаются с теми же типами"""
+        tz = pytz.timezone('Europe/Belgrade')
+        value = {
+            'parsed_datetime': tz.localize(datetime(2025, 7, 1, 8, 0)),
+            'naive': datetime(2025, 1, 1, 12, 30),
+            'selected_date': date(2025, 7, 1),
+            'gpx_path': Path('/tmp/cache/route.gpx'),
+            'point': (45.25, 19.85),
+            'thumbnail': b'\x89PNG',
+            'by_id': {1: 'один'},
+            'tag_like': {'$dt': 'строка'},
+            'nested': [{'speed': 25.0, 'ok': True, 'none': None}],
+        }
+
+        restored = decode(encode(value))
+
+        assert restored == value
+        assert restored['parsed_datetime'].tzinfo.zone == 'Europe/Belgrade'
+        assert restored['parsed_datetime'].utcoffset() == value['parsed_datetime'].utcoffset()
+        assert isinstance(restored['point'], tuple)
+
+    def test_compact(self):
+        """Обычный user_data хранится компактнее pickle"""
+        value = {'route_name': 'Фрушка Гора', 'pace': '25-28 км/ч', 'preview_message_id': 123}
+
+        assert len(encode(value)) < len(pickle.dumps(value))
+        assert decode(pickle.dumps(value)) == value
+
+
+    def test_unknown_types_are_not_pickled(self):
+        """Типы без тега не сохраняются, а pickle из хранилища распаковывает только разрешенные классы"""
+        class Custom:
+            pass
+
+        with pytest.raises(TypeError):
+            encode({'value': Custom()})
+
+        tz = pytz.timezone('Europe/Belgrade')
+        allowed = {'parsed_datetime': tz.localize(datetime(2025, 7, 1, 8, 0)), 'gpx_path': Path('/tmp/r.gpx')}
+        assert decode(pickle.dumps(allowed)) == allowed
+        with pytest.raises(pickle.UnpicklingError):
+            decode(pickle.dumps({'value': sqlite3.Row}))
+        class Exploit:
+            def __reduce__(self):
+                return eval, ('1',)
+
+        payload = base64.b64encode(pickle.dumps(Exploit())).decode('ascii')
+        with pytest.raises(pickle.UnpicklingError):
+            decode(json.dumps({'value': {'$pickle': payload}}).encode('utf-8'))
+
+
+class TestStorePersistence:
+    """Тесты для пакетной записи StorePersistence"""
+
+    @pytest.mark.asyncio
+    async def test_batches_only_changed_rows(self):
+        """Изменения уходят одной транзакцией, неизменившиеся строки не пишутся"""
+        store = CountingStore()
+        persistence = StorePersistence(store)
+        await persistence.update_user_data(1, {'step': 1})
+        await persistence.update_user_data(2, {'step': 1})
+        await persistence.update_conversation('announce', (1, 1), 3)
+        await persistence.flush()
+
+        await persistence.update_user_data(1, {'step': 1})
+        await persistence.update_user_data(2, {'step': 2})
+        await persistence.update_conversation('announce', (1, 1), None)
+        await persistence.flush()
+
+        assert [len(batch) for batch in store.batches] == [3, 2]
+        assert ('user_data', '1', encode({'step': 1})) not in store.batches[1]
+        assert store.get('conversation:announce', '[1, 1]') is None
+
+    @pytest.mark.asyncio
+    async def test_known_rows_are_bounded(self, monkeypatch):
+        """Память о записанных строках и поднятых пользователях не растет с числом пользователей"""
+        monkeypatch.setattr(persistence, 'KNOWN_ROWS_LIMIT', 3)
+        store = CountingStore()
+        store_persistence = StorePersistence(store)
+        for user_id in range(10):
+            await store_persistence.update_user_data(user_id, {'step': 1})
+            await store_persistence.flush()
+        assert list(store_persistence._written) == [('user_data', str(user_id)) for user_id in (7, 8, 9)]
+
+        await store_persistence.update_conversation('announce', (1, 1), 3)
+        await store_persistence.flush()
+        await store_persistence.update_conversation('announce', (1, 1), None)
+        await store_persistence.flush()
+        assert ('conversation:announce', '[1, 1]') not in store_persistence._written
+
+        # Еще не записанное завершение разговора не воскрешает его из хранилища
+        await store_persistence.update_conversation('announce', (2, 2), 3)
+        await store_persistence.flush()
+        await store_persistence.update_conversation('announce', (2, 2), None)
+        assert await store_persistence.load_conversation('announce', (2, 2)) is None
+
+    @pytest.mark.asyncio
+    async def test_sqlite_wal(self, tmp_path):
+        """SQLite работает в режиме WAL, пачка записей видна другому соединению"""
+        path = str(tmp_path / 'state.db')
+        store = SQLiteStore(path)
+        persistence = StorePersistence(store)
+        await persistence.update_user_data(42, {'route_name': 'Фрушка Гора'})
+        await persistence.flush()
+
+        connection = sqlite3.connect(path)
+        try:
+            assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            assert connection.execute('SELECT COUNT(*) FROM kv').fetchone()[0] == 1
+        finally:
+            connection.close()
+            store.close()
+
+    @pytest.mark.asyncio
+    async def test_conversation_survives_restart(self, tmp_path):
+        """Разговор, начатый до перезапуска бота, продолжается после него с тем же user_data"""
+        path = str(tmp_path / 'state.db')
+        api = await FakeTelegramAPI().start()
+        try:
+            stats = LevelStats(users=1)
+            async with persistent_bot(api, SQLiteStore(path)):
+                user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+                assert await user.run(ANNOUNCE_SCENARIO[:2], stats), stats.errors
+
+            async with persistent_bot(api, SQLiteStore(path)) as application:
+                # Новый процесс ничего не читает, пока пользователь не напишет
+                assert dict(application.user_data) == {}
+                user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+                assert await user.run(ANNOUNCE_SCENARIO[2:3], stats), stats.errors
+                assert application.user_data[42]['selected_date']
+        finally:
+            await api.stop()
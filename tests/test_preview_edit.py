@@ -0,0 +1,101 @@
+"""Тесты для обновления предпросмотра анонса на месте"""
+
+import pytest
+from unittest.mock import AsyncMock, Mock
+from telegram.error import BadRequest
+
+from bot import update_preview_message, remember_preview_message
+
+
+@pytest.fixture
+def bot_api():
+    """Mock для Bot с асинхронными методами редактирования"""
+    bot = Mock()
+    bot.edit_message_text = AsyncMock()
+    bot.edit_message_caption = AsyncMock()
+    bot.edit_message_media = AsyncMock()
+    bot.delete_message = AsyncMock()
+    return bot
+
+
+class TestPreviewEdit:
+    """Тесты для update_preview_message"""
+
+    @pytest.mark.asyncio
+    async def test_no_previous_preview(self, bot_api):
+        """Первый предпросмотр отправляется новым сообщением"""
+        result = await update_preview_message(bot_api, 1, {}, 'text', None, None)
+
+        assert result is None
+        bot_api.edit_message_text.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_unchanged_preview_is_not_edited(self, bot_api):
+        """Если ничего не изменилось, запросов к Telegram нет"""
+        user_data = {}
+        remember_preview_message(user_data, Mock(message_id=10), 'text', None)
+
+        result = await update_preview_message(bot_api, 1, user_data, 'text', None, None)
+
+        assert result is False
+        bot_api.edit_message_text.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_changed_text_is_edited(self, bot_api):
+        """Изменившийся текст редактируется в том же сообщении"""
+        user_data = {}
+        remember_preview_message(user_data, Mock(message_id=10), 'old', None)
+
+        result = await update_preview_message(bot_api, 1, user_data, 'new', None, None)
+
+        assert result is True
+        assert bot_api.edit_message_text.call_args.kwargs['message_id'] == 10
+        assert user_data['preview_caption'] == 'new'
+
+    @pytest.mark.asyncio
+    async def test_changed_caption_keeps_image(self, bot_api):
+        """Для той же картинки меняется только подпись"""
+        user_data = {}
+        remember_preview_message(user_data, Mock(message_id=10), 'old', 'image:photo-id')
+
+        result = await update_preview_message(bot_api, 1, user_data, 'new', 'photo-id', None)
+
+        assert result is True
+        bot_api.edit_message_caption.assert_called_once()
+        bot_api.edit_message_media.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_new_image_replaces_media(self, bot_api):
+        """Новая картинка заменяется через edit_message_media"""
+        user_data = {}
+        remember_preview_message(user_data, Mock(message_id=10), 'text', 'image:old-id')
+
+        result = await update_preview_message(bot_api, 1, user_data, 'text', 'new-id', None)
+
+        assert result is True
+        assert bot_api.edit_message_media.call_args.kwargs['media'].media == 'new-id'
+        assert user_data['preview_media'] == 'image:new-id'
+
+    @pytest.mark.asyncio
+    async def test_text_to_image_sends_new_message(self, bot_api):
+        """Текстовое сообщение нельзя превратить в фото - старое удаляется"""
+        user_data = {}
+        remember_preview_message(user_data, Mock(message_id=10), 'text', None)
+
+        result = await update_preview_message(bot_api, 1, user_data, 'text', 'photo-id', None)
+
+        assert result is None
+        bot_api.delete_message.assert_called_once_with(chat_id=1, message_id=10)
+        assert 'preview_message_id' not in user_data
+
+    @pytest.mark.asyncio
+    async def test_failed_edit_sends_new_message(self, bot_api):
+        """Если сообщение нельзя отредактировать, предпросмотр отправляется заново"""
+        user_data = {}
+        remember_preview_message(user_data, Mock(message_id=10), 'old', None)
+        bot_api.edit_message_text.side_effect = BadRequest('Message to edit not found')
+
+        result = await update_preview_message(bot_api, 1, user_data, 'new', None, None)
+
+        assert result is None
+        assert 'preview_message_id' not in user_data
@@ -0,0 +1,146 @@
+"""Тесты для сэмплирующего профилировщика и команды /profile"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+
+import bot
+from profiler import SamplingProfiler, ProfileSession, collapse_stack, format_collapsed, read_collapsed, \
+    top_functions, profile_from_env, PROFILE_OUTPUT_ENV
+
+
+def busy_handler(stop):
+    """Горячий путь, который должен попасть в профиль"""
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestSamplingProfiler:
+    """Тесты для SamplingProfiler"""
+
+    def test_busy_function_sampled(self):
+        """Функция, занимающая поток, попадает в стеки"""
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_handler, args=(stop,), name='busy')
+        profiler = SamplingProfiler(interval=0.001)
+        worker.start()
+        profiler.start()
+        time.sleep(0.2)
+        stacks = profiler.stop()
+        stop.set()
+        worker.join()
+
+        busy = [stack for stack in stacks if stack.startswith('busy;')]
+        assert busy
+        assert all('busy_handler' in stack for stack in busy)
+
+    def test_idle_thread_skipped(self):
+        """Поток, ждущий события, не засоряет профиль"""
+        stop = threading.Event()
+        waiter = threading.Thread(target=stop.wait, name='idle')
+        waiter.start()
+        time.sleep(0.05)
+        try:
+            frame = sys._current_frames()[waiter.ident]
+            assert collapse_stack(frame, 'idle') is None
+        finally:
+            stop.set()
+            waiter.join()
+
+    def test_collapsed_roundtrip(self, temp_dir):
+        """Профиль внешнего модуля читается с префиксом"""
+        path = os.path.join(temp_dir, 'worker.folded')
+        with open(path, 'w') as f:
+            f.write(format_collapsed({'MainThread;main;render': 3, 'MainThread;main;fetch': 1}))
+
+        stacks = read_collapsed(path, 'weather_dashboard;')
+
+        assert stacks['weather_dashboard;MainThread;main;render'] == 3
+        assert top_functions(stacks, 1) == [('render', 3)]
+
+    def test_profile_from_env(self, temp_dir):
+        """Внешний модуль пишет свой профиль в файл из PROFILE_OUTPUT"""
+        path = os.path.join(temp_dir, 'worker.folded')
+        with patch.dict(os.environ, {PROFILE_OUTPUT_ENV: path}):
+            with profile_from_env():
+                time.sleep(0.05)
+
+        assert os.path.exists(path)
+
+
+class TestProfileSession:
+    """Тесты для сессии профилирования"""
+
+    @pytest.mark.asyncio
+    async def test_stops_after_n_updates(self):
+        """Сессия заканчивается после N апдейтов, не считая саму команду"""
+        session = ProfileSession(updates=2, seconds=10, after_update_id=100)
+        session.start()
+        session.update_processed(Mock(update_id=100))
+        session.update_processed(Mock(update_id=101))
+        session.update_processed(Mock(update_id=102))
+
+        started = time.monotonic()
+        await session.wait()
+        session.finish()
+
+        assert session.processed == 2
+        assert time.monotonic() - started < 1
+
+    @pytest.mark.asyncio
+    async def test_stops_by_timeout(self):
+        """Без апдейтов сессия заканчивается по времени"""
+        session = ProfileSession(updates=5, seconds=0.1)
+        session.start()
+        await session.wait()
+        session.finish()
+
+        assert session.processed == 0
+        assert not os.path.exists(session.worker_dir)
+
+
+class TestProfileCommand:
+    """Тесты для команды /profile"""
+
+    @pytest.mark.asyncio
+    async def test_non_admin_refused(self, mock_update, mock_context):
+        """Обычный пользователь не может включить профилирование"""
+        mock_update.effective_user = Mock(id=12345)
+        mock_context.args = []
+
+        with patch.object(bot, 'ADMIN_IDS', set()):
+            await bot.profile_command(mock_update, mock_context)
+
+        assert not bot.PROFILER.active
+        assert 'администраторам' in mock_update.message.reply_text.call_args[0][0]
+
+    @pytest.mark.asyncio
+    async def test_admin_gets_profile(self, mock_update, mock_context):
+        """Администратор получает файл с профилем"""
+        mock_update.effective_user = Mock(id=12345)
+        mock_update.effective_chat = Mock(id=12345)
+        mock_update.update_id = 1
+        mock_context.args = ['1', '0.2']
+        mock_context.bot = Mock(send_document=AsyncMock(), send_message=AsyncMock())
+        tasks = []
+        mock_context.application = Mock(create_task=lambda coroutine, update=None: tasks.append(
+            asyncio.ensure_future(coroutine)))
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_handler, args=(stop,), name='busy')
+        worker.start()
+
+        try:
+            with patch.object(bot, 'ADMIN_IDS', {12345}):
+                await bot.profile_command(mock_update, mock_context)
+            await asyncio.gather(*tasks)
+        finally:
+            stop.set()
+            worker.join()
+
+        assert not bot.PROFILER.active
+        document = mock_context.bot.send_document.call_args.kwargs['document']
+        assert b'busy_handler' in document
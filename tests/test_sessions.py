@@ -0,0 +1,153 @@
+"""Тесты для завершения брошенных разговоров"""
+
+import glob
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+import bot
+from bot import ASK_TIME, STATES_BY_NAME, build_application
+from fakes.komoot import FakeKomootAPI
+from fakes.telegram_api import FakeTelegramAPI
+from loadtest.run import LevelStats
+from loadtest.scenario import ANNOUNCE_SCENARIO, SimulatedUser
+from metrics import REGISTRY
+from sessions import SessionManager, parse_state_timeouts
+from supervisor import kill_owned
+from webhook import WebhookServer
+
+
+@asynccontextmanager
+async def running_bot():
+    """Приложение бота против заглушки Bot API (api, application)"""
+    api = await FakeTelegramAPI().start()
+    application = build_application(token='123456:TEST', base_url=api.url)
+    server = WebhookServer(application, url='', listen='127.0.0.1', port=0, secret='test-secret')
+    await application.initialize()
+    await application.start()
+    await server.start()
+    try:
+        yield api, application
+    finally:
+        await server.drain()
+        await application.stop()
+        await server.stop()
+        await application.shutdown()
+        await api.stop()
+
+
+class TestStateTimeouts:
+    """Тесты для настройки таймаутов по состояниям"""
+
+    def test_parse(self):
+        """Таймауты задаются по именам состояний"""
+        assert parse_state_timeouts('ASK_TIME=10, PREVIEW_STEP=7200', STATES_BY_NAME) == {
+            ASK_TIME: 10.0, bot.PREVIEW_STEP: 7200.0}
+        assert parse_state_timeouts('', STATES_BY_NAME) == {}
+        with pytest.raises(ValueError):
+            parse_state_timeouts('ASK_NOTHING=10', STATES_BY_NAME)
+
+    def test_timeout_for(self):
+        """Состояние без своего таймаута использует общий"""
+        sessions = SessionManager(timeout=60, state_timeouts={ASK_TIME: 10})
+
+        assert sessions.timeout_for(ASK_TIME) == 10
+        assert sessions.timeout_for(bot.ASK_PACE) == 60
+
+
+class TestSessionManager:
+    """Тесты для SessionManager"""
+
+    @pytest.mark.asyncio
+    async def test_cancel_tracked_tasks(self):
+        """Задачи сессии отменяются, задачи других сессий продолжают работу"""
+        sessions = SessionManager()
+        own = sessions.track((1, 1), asyncio.create_task(asyncio.sleep(60)))
+        other = sessions.track((2, 2), asyncio.create_task(asyncio.sleep(60)))
+
+        assert await sessions.cancel((1, 1)) == 1
+        assert own.cancelled()
+        assert not other.done()
+        assert sessions.running((1, 1)) == []
+        other.cancel()
+
+    @pytest.mark.asyncio
+    async def test_idle_conversation_expires(self):
+        """Брошенный разговор завершается: состояние и user_data удаляются, организатор предупрежден"""
+        async with running_bot() as (api, application):
+            user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+            stats = LevelStats(users=1)
+            assert await user.run(ANNOUNCE_SCENARIO[:2], stats), stats.errors
+            # Ответ приходит до того, как обработчик вернет следующее состояние
+            while bot.SESSIONS.running((42, 42)):
+                await asyncio.sleep(0.01)
+            assert bot.SESSIONS.live == 1
+            assert application.user_data[42]
+
+            later = time.monotonic() + 11
+            assert await bot.SESSIONS.sweep(now=later) == 0
+            bot.SESSIONS.state_timeouts[ASK_TIME] = 10
+            try:
+                expired_before = bot.SESSIONS.expired
+                assert await bot.SESSIONS.sweep(now=later) == 1
+            finally:
+                del bot.SESSIONS.state_timeouts[ASK_TIME]
+
+            message = await asyncio.wait_for(user.inbox.get(), 5)
+            assert 'неактивности' in message['text']
+            assert bot.SESSIONS.live == 0
+            assert bot.SESSIONS.expired == expired_before + 1
+            assert 42 not in application.user_data
+            assert 'announce_bot_sessions_expired' in REGISTRY.render()
+
+
+class TestInterrupt:
+    """Тесты для отмены работы разговора"""
+
+    def test_is_interrupt(self):
+        """Отменой считаются кнопка отмены, /restart и новый /start"""
+        def update(text):
+            return bot.Update.de_json({'update_id': 1, 'message': {
+                'message_id': 1, 'date': 0, 'text': text, 'chat': {'id': 1, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': False, 'first_name': 'Тест'}}}, None)
+
+        assert bot.is_interrupt(update('❌ Отмена'))
+        assert bot.is_interrupt(update('/restart'))
+        assert bot.is_interrupt(update('/start@announce_bot'))
+        assert not bot.is_interrupt(update('/status'))
+        assert not bot.is_interrupt(update('☀️ 08:00'))
+
+    @pytest.mark.asyncio
+    async def test_restart_cancels_download(self, monkeypatch):
+        """/restart во время скачивания GPX отвечает сразу и убивает komootgpx"""
+        tour_id = 987654321
+        assert not glob.glob(f"{bot.CACHE_DIR}/*-{tour_id}.gpx")
+        komoot = await FakeKomootAPI(latency=8).start()
+        monkeypatch.setattr(bot, 'KOMOOT_BASE_URL', komoot.url)
+        monkeypatch.setenv('KOMOOT_BASE_URL', komoot.url)
+        try:
+            async with running_bot() as (api, application):
+                user = SimulatedUser(api, user_id=42, tour_id=tour_id, step_timeout=10)
+                stats = LevelStats(users=1)
+                assert await user.run(ANNOUNCE_SCENARIO[:3], stats), stats.errors
+
+                api.push_message(42, f"https://www.komoot.com/tour/{tour_id}")
+                while not komoot.calls:
+                    await asyncio.sleep(0.05)
+                started = time.perf_counter()
+                api.push_message(42, '/restart')
+                while True:
+                    message = await asyncio.wait_for(user.inbox.get(), 10)
+                    if 'Состояние сброшено' in message['text']:
+                        break
+
+                assert time.perf_counter() - started < 5
+                assert kill_owned((42, 42)) == 0
+                # Остается только задача самого /restart, которая вот-вот завершится
+                if bot.SESSIONS.running((42, 42)):
+                    await asyncio.wait(bot.SESSIONS.running((42, 42)), timeout=1)
+                assert not bot.SESSIONS.running((42, 42))
+        finally:
+            await komoot.stop()
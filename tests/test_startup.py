@@ -0,0 +1,41 @@
+"""Тесты времени запуска бота"""
+
+import statistics
+
+import pytest
+
+from loadtest.startup import FIRST_UPDATES_BUDGET, IMPORT_BUDGET, measure_first_updates, measure_import
+
+
+class TestStartupBudget:
+    """Импорт бота и первый getUpdates укладываются в бюджет"""
+
+    def test_import_without_heavy_modules(self):
+        """import bot не загружает gpxpy, numpy и matplotlib"""
+        assert measure_import()['heavy_modules'] == []
+
+    def test_import_budget(self):
+        """Медиана времени import bot в пределах бюджета"""
+        seconds = statistics.median(measure_import()['seconds'] for _ in range(3))
+
+        assert seconds < IMPORT_BUDGET
+
+    def test_import_has_no_side_effects(self, tmp_path):
+        """import bot не создает папок в рабочей директории"""
+        measure_import(cwd=tmp_path)
+
+        assert list(tmp_path.iterdir()) == []
+
+    @pytest.mark.asyncio
+    async def test_first_get_updates_budget(self):
+        """Бот начинает получать апдейты, не дожидаясь предзагрузки маршрутов"""
+        seconds = await measure_first_updates()
+
+        assert seconds < FIRST_UPDATES_BUDGET
+
+    @pytest.mark.asyncio
+    async def test_first_webhook_budget(self):
+        """В режиме вебхука бот регистрирует вебхук в пределах того же бюджета"""
+        seconds = await measure_first_updates(webhook=True)
+
+        assert seconds < FIRST_UPDATES_BUDGET
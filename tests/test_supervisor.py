@@ -0,0 +1,181 @@
+"""Тесты для запуска внешних процессов, которые можно прервать"""
+
+import os
+import sys
+import time
+import asyncio
+import signal
+import threading
+import subprocess
+
+import pytest
+
+from metrics import SUBPROCESS_EXITS, SUBPROCESS_PEAK_RSS
+from supervisor import PROCESS_OWNER, RLIMIT_EXEC, kill_owned, run_process, run_process_sync
+
+# Процесс, который запускает долгоживущий дочерний процесс и пишет его PID
+SPAWNING_SCRIPT = (
+    "import subprocess, sys, time\n"
+    "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+    "open(sys.argv[1], 'w').write(str(child.pid))\n"
+    "time.sleep(60)\n"
+)
+
+
+def is_running(pid):
+    """Процесс существует и не зомби"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def zombie_children():
+    """PID дочерних процессов теста, которые завершились, но не дождались"""
+    zombies = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if fields[0] == 'Z' and int(fields[1]) == os.getpid():
+            zombies.append(int(name))
+    return zombies
+
+
+def wait_for_file(path, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path) or not open(path).read():
+        assert time.monotonic() < deadline, 'процесс не запустился'
+        time.sleep(0.02)
+    return int(open(path).read())
+
+
+@pytest.mark.skipif(not os.path.exists('/proc'), reason='Нужен /proc')
+class TestRunProcess:
+    """Тесты для run_process и run_process_sync"""
+
+    @pytest.mark.asyncio
+    async def test_timeout_kills_group(self, tmp_path):
+        """По таймауту убивается вся группа процесса, а сам процесс дожидается"""
+        pid_file = str(tmp_path / 'child.pid')
+        result = await run_process([sys.executable, '-c', SPAWNING_SCRIPT, pid_file], 'test', timeout=1.0)
+
+        assert result.timed_out
+        assert result.returncode == -signal.SIGKILL
+        grandchild = wait_for_file(pid_file)
+        await asyncio.sleep(0.1)
+        assert not is_running(grandchild)
+
+    @pytest.mark.asyncio
+    async def test_cancel_kills_and_reaps(self, tmp_path):
+        """Отмена задачи убивает процесс и не оставляет зомби"""
+        pid_file = str(tmp_path / 'child.pid')
+        task = asyncio.create_task(run_process([sys.executable, '-c', SPAWNING_SCRIPT, pid_file], 'test'))
+        grandchild = await asyncio.to_thread(wait_for_file, pid_file)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        await asyncio.sleep(0.1)
+        assert not is_running(grandchild)
+        assert zombie_children() == []
+
+    def test_kill_owned_from_other_thread(self):
+        """Процесс в потоке убивается по владельцу, поток сразу получает результат"""
+        results = []
+
+        def worker():
+            PROCESS_OWNER.set((42, 42))
+            results.append(run_process_sync([sys.executable, '-c', 'import time; time.sleep(60)'], 'test'))
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        deadline = time.monotonic() + 10
+        while not kill_owned((42, 42)):
+            assert time.monotonic() < deadline, 'процесс не запустился'
+            time.sleep(0.02)
+        thread.join(10)
+
+        assert not thread.is_alive()
+        assert results[0].returncode < 0
+        assert kill_owned((42, 42)) == 0
+
+
+class TestLimits:
+    """Тесты для ограничений внешних процессов"""
+
+    def test_output_keeps_tail(self):
+        """Вывод сверх лимита обрезается с начала, процесс при этом не блокируется"""
+        script = "import sys\nsys.stdout.write('x' * 1000000)\nprint('TIMINGS {}')\nsys.stderr.write('y' * 500000)"
+        result = run_process_sync([sys.executable, '-c', script], 'test', output_limit=1024)
+
+        assert result.returncode == 0
+        assert result.truncated
+        assert len(result.stdout) == 1024
+        assert result.stdout.endswith('TIMINGS {}\n')
+        assert len(result.stderr) == 1024
+
+    @pytest.mark.skipif(not sys.platform.startswith('linux'), reason='prlimit есть только в Linux')
+    def test_memory_limit(self):
+        """Процесс не может занять больше памяти, чем разрешено"""
+        script = "data = bytearray(512 * 1024 * 1024)"
+        result = run_process_sync([sys.executable, '-c', script], 'test', memory_limit_mb=256)
+
+        assert result.returncode != 0
+        assert 'MemoryError' in result.stderr
+
+    @pytest.mark.skipif(not sys.platform.startswith('linux'), reason='prlimit есть только в Linux')
+    def test_cpu_limit(self):
+        """Процесс, исчерпавший процессорное время, останавливается сигналом"""
+        result = run_process_sync([sys.executable, '-c', 'while True: pass'], 'test', cpu_limit=1, timeout=30)
+
+        assert result.returncode in (-signal.SIGXCPU, -signal.SIGKILL)
+        assert not result.timed_out
+        assert result.duration < 10
+
+    @pytest.mark.skipif(not sys.platform.startswith('linux'), reason='prlimit есть только в Linux')
+    def test_limits_set_before_exec(self):
+        """Лимиты действуют с первой инструкции процесса, а не после его запуска"""
+        script = ("import resource\n"
+                  "print(resource.getrlimit(resource.RLIMIT_AS)[0], resource.getrlimit(resource.RLIMIT_CPU)[0])")
+        result = run_process_sync([sys.executable, '-c', script], 'test', memory_limit_mb=512, cpu_limit=7)
+
+        assert result.returncode == 0
+        assert result.stdout.split() == [str(512 * 1024 * 1024), '7']
+
+    @pytest.mark.skipif(not sys.platform.startswith('linux'), reason='prlimit есть только в Linux')
+    def test_failed_limits_do_not_run_command(self, tmp_path):
+        """Если лимит поставить не удалось, обертка не запускает команду"""
+        marker = tmp_path / 'ran'
+        result = subprocess.run([sys.executable, '-S', RLIMIT_EXEC, 'много', '0', '--',
+                                 sys.executable, '-c', f"open({str(marker)!r}, 'w')"],
+                                capture_output=True, text=True, timeout=30)
+
+        assert result.returncode == 126
+        assert 'не удалось ограничить ресурсы' in result.stderr
+        assert not marker.exists()
+
+    def test_single_threaded_blas(self):
+        """numpy в дочернем процессе не заводит поток OpenBLAS на каждое ядро"""
+        script = "import os; print(os.environ['OPENBLAS_NUM_THREADS'])"
+        result = run_process_sync([sys.executable, '-c', script], 'test')
+
+        assert result.stdout.strip() == '1'
+
+    def test_metrics(self):
+        """Статус завершения и пиковая память процесса попадают в метрики"""
+        ok_before = SUBPROCESS_EXITS.value(name='metrics-test', status='ok')
+        error_before = SUBPROCESS_EXITS.value(name='metrics-test', status='error')
+        script = "data = bytearray(64 * 1024 * 1024); data[::4096] = b'x' * len(data[::4096])"
+        result = run_process_sync([sys.executable, '-c', script], 'metrics-test')
+        run_process_sync([sys.executable, '-c', 'raise SystemExit(3)'], 'metrics-test')
+
+        assert result.peak_rss > 64 * 1024 * 1024
+        assert SUBPROCESS_EXITS.value(name='metrics-test', status='ok') == ok_before + 1
+        assert SUBPROCESS_EXITS.value(name='metrics-test', status='error') == error_before + 1
+        assert SUBPROCESS_PEAK_RSS.count(name='metrics-test') == 2
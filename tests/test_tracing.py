@@ -0,0 +1,126 @@
+"""Тесты для трассировки этапов подготовки анонса"""
+
+import os
+import sys
+import threading
+import subprocess
+import pytest
+from unittest.mock import Mock
+
+import tracing
+from tracing import span, trace_env, traced_handler, continue_trace, parse_traceparent, format_trace, \
+    JsonLinesExporter, load_trace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class MemoryExporter:
+    """Собирает спаны в список"""
+
+    def __init__(self):
+        self.records = []
+
+    def export(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def exporter():
+    memory = MemoryExporter()
+    previous = tracing.set_exporter(memory)
+    yield memory
+    tracing.set_exporter(previous)
+
+
+class TestSpans:
+    """Тесты для спанов"""
+
+    def test_nested_spans_share_trace(self, exporter):
+        """Вложенный спан получает trace id и родителя из контекста"""
+        with span('process_gpx', trace_id='a' * 32) as parent:
+            with span('gpx.analyze', points=120) as child:
+                child.set('length_km', 42.0)
+
+        analyze, handler = exporter.records
+        assert analyze['trace_id'] == handler['trace_id'] == 'a' * 32
+        assert analyze['parent_id'] == parent.span_id
+        assert handler['parent_id'] is None
+        assert analyze['attributes'] == {'points': 120, 'length_km': 42.0}
+
+    def test_error_recorded(self, exporter):
+        """Исключение помечает спан ошибкой"""
+        with pytest.raises(RuntimeError):
+            with span('open_meteo.fetch'):
+                raise RuntimeError('429')
+
+        assert exporter.records[0]['status'] == 'error'
+        assert '429' in exporter.records[0]['attributes']['error']
+
+    @pytest.mark.asyncio
+    async def test_handler_uses_conversation_trace(self, exporter):
+        """Все шаги одного разговора попадают в одну трассу"""
+        @traced_handler
+        async def step(update, context):
+            with span('stage'):
+                pass
+
+        context = Mock(user_data={})
+        await step(Mock(), context)
+        await step(Mock(), context)
+
+        trace_ids = {record['trace_id'] for record in exporter.records}
+        assert trace_ids == {context.user_data['trace_id']}
+        assert len(exporter.records) == 4
+
+
+class TestPropagation:
+    """Тесты для передачи трассы во внешний процесс"""
+
+    def test_parse_traceparent(self):
+        """Разбирается только корректный traceparent"""
+        assert parse_traceparent(f"00-{'b' * 32}-{'c' * 16}-01") == ('b' * 32, 'c' * 16)
+        assert parse_traceparent('мусор') is None
+        assert parse_traceparent(None) is None
+
+    def test_child_process_continues_trace(self, temp_dir):
+        """Спаны дочернего процесса становятся потомками спана бота"""
+        trace_file = os.path.join(temp_dir, 'traces.jsonl')
+        script = "from tracing import continue_trace, span\ncontinue_trace()\nwith span('dashboard.render'):\n    pass\n"
+        exporter = JsonLinesExporter(trace_file)
+        previous = tracing.set_exporter(exporter)
+        try:
+            with span('dashboard.worker', trace_id='d' * 32) as worker_span:
+                env = trace_env()
+                env['TRACE_FILE'] = trace_file
+                subprocess.run([sys.executable, '-c', script], env=env, cwd=ROOT, check=True)
+        finally:
+            tracing.set_exporter(previous)
+        assert exporter.flush()
+
+        records = load_trace(trace_file, 'd' * 32)
+        render = next(record for record in records if record['name'] == 'dashboard.render')
+        assert render['parent_id'] == worker_span.span_id
+        assert 'dashboard.render' in format_trace(records).splitlines()[1]
+
+    def test_exporter_writes_in_background(self, temp_dir):
+        """Спаны пишутся в файл фоновым потоком, а не тем, кто их закончил"""
+        trace_file = os.path.join(temp_dir, 'traces', 'spans.jsonl')
+        exporter = JsonLinesExporter(trace_file)
+        writers = []
+        write = exporter._write
+
+        def recording_write(data):
+            writers.append(threading.current_thread().name)
+            write(data)
+
+        exporter._write = recording_write
+        for i in range(100):
+            exporter.export({'trace_id': 'e' * 32, 'span_id': str(i)})
+
+        assert exporter.flush()
+        assert set(writers) == {'trace-writer'}
+        assert [record['span_id'] for record in load_trace(trace_file, 'e' * 32)] == [str(i) for i in range(100)]
+
+    def test_no_parent_without_env(self):
+        """Без TRACEPARENT трасса не продолжается"""
+        assert continue_trace('') is None
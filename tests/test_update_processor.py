@@ -0,0 +1,117 @@
+"""Тесты для параллельной обработки апдейтов с очередью внутри чата"""
+
+import time
+import asyncio
+import pytest
+from telegram import Update
+
+from update_processor import PerChatUpdateProcessor
+
+SLOW_STEP = 0.2
+
+
+def make_update(update_id, chat_id):
+    """Апдейт с текстовым сообщением от пользователя в личном чате"""
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': 'step',
+        },
+    }, None)
+
+
+async def slow_step(log, name):
+    """Медленный шаг разговора, например скачивание GPX"""
+    log.append(f"{name} start")
+    await asyncio.sleep(SLOW_STEP)
+    log.append(f"{name} end")
+
+
+class TestPerChatUpdateProcessor:
+    """Тесты для PerChatUpdateProcessor"""
+
+    @pytest.mark.asyncio
+    async def test_different_users_overlap(self):
+        """Медленные шаги двух пользователей выполняются одновременно"""
+        processor = PerChatUpdateProcessor(max_concurrent_updates=8)
+        log = []
+
+        started = time.monotonic()
+        await asyncio.gather(
+            processor.process_update(make_update(1, 100), slow_step(log, 'user1')),
+            processor.process_update(make_update(2, 200), slow_step(log, 'user2')),
+        )
+        elapsed = time.monotonic() - started
+
+        assert elapsed < SLOW_STEP * 1.5
+        assert log[:2] == ['user1 start', 'user2 start']
+
+    @pytest.mark.asyncio
+    async def test_same_user_steps_stay_ordered(self):
+        """Шаги одного пользователя выполняются по очереди в порядке поступления"""
+        processor = PerChatUpdateProcessor(max_concurrent_updates=8)
+        log = []
+
+        started = time.monotonic()
+        await asyncio.gather(
+            processor.process_update(make_update(1, 100), slow_step(log, 'step1')),
+            processor.process_update(make_update(2, 100), slow_step(log, 'step2')),
+        )
+        elapsed = time.monotonic() - started
+
+        assert elapsed >= SLOW_STEP * 2
+        assert log == ['step1 start', 'step1 end', 'step2 start', 'step2 end']
+
+    @pytest.mark.asyncio
+    async def test_locks_released_after_processing(self):
+        """После обработки блокировки чатов не накапливаются"""
+        processor = PerChatUpdateProcessor(max_concurrent_updates=8)
+
+        await asyncio.gather(*(
+            processor.process_update(make_update(i, i), asyncio.sleep(0)) for i in range(10)
+        ))
+
+        assert processor.active_chats == 0
+
+    @pytest.mark.asyncio
+    async def test_message_after_interrupt_waits(self):
+        """Сообщение сразу после отмены обрабатывается после нее, даже если отмена долго ждет задачи"""
+        log = []
+
+        async def wait_cancelled():
+            await asyncio.sleep(SLOW_STEP)
+
+        def interrupt(update):
+            return wait_cancelled() if update.update_id == 1 else None
+
+        async def handle(name):
+            log.append(name)
+
+        processor = PerChatUpdateProcessor(max_concurrent_updates=8, interrupt=interrupt)
+        await asyncio.gather(
+            processor.process_update(make_update(1, 100), handle('restart')),
+            processor.process_update(make_update(2, 100), handle('message')),
+        )
+
+        assert log == ['restart', 'message']
+
+    @pytest.mark.asyncio
+    async def test_burst_from_one_chat_does_not_block_others(self):
+        """Пачка апдейтов одного чата не занимает все слоты: другой чат обслуживается сразу"""
+        processor = PerChatUpdateProcessor(max_concurrent_updates=2)
+        log = []
+
+        burst = [asyncio.create_task(processor.process_update(make_update(i, 100), slow_step(log, f"burst{i}")))
+                 for i in range(5)]
+        await asyncio.sleep(0)
+        started = time.monotonic()
+        await processor.process_update(make_update(10, 200), slow_step(log, 'other'))
+        elapsed = time.monotonic() - started
+        await asyncio.gather(*burst)
+
+        assert elapsed < SLOW_STEP * 1.5
+        assert log.index('other end') < log.index('burst1 end')
@@ -0,0 +1,140 @@
+"""Тесты для записи апдейтов и их воспроизведения"""
+
+import json
+import threading
+
+import pytest
+
+from update_processor import PerChatUpdateProcessor
+from update_recorder import UpdateRecorder, anonymize, hash_id, read_records
+from loadtest.replay import refresh_dates, update_chat_id, format_report
+from tests.test_update_processor import make_update
+
+UPDATE = {
+    'update_id': 15,
+    'message': {
+        'message_id': 3,
+        'date': 1750000000,
+        'chat': {'id': 42, 'type': 'private', 'first_name': 'Иван', 'username': 'ivan'},
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Иван', 'last_name': 'Петров', 'username': 'ivan'},
+        'text': 'https://www.komoot.com/tour/123',
+    },
+}
+
+
+class TestAnonymize:
+    """Тесты для anonymize"""
+
+    def test_personal_data_removed(self):
+        """Имена и username удаляются, ID заменяются хешами"""
+        result = anonymize(UPDATE, 'salt')
+        message = result['message']
+
+        assert 'Иван' not in json.dumps(result, ensure_ascii=False)
+        assert 'ivan' not in json.dumps(result)
+        assert message['from']['id'] == hash_id(42, 'salt') != 42
+        assert message['text'] == UPDATE['message']['text']
+
+    def test_chat_and_user_stay_linked(self):
+        """В личном чате ID чата и пользователя совпадают и после хеширования"""
+        message = anonymize(UPDATE, 'salt')['message']
+
+        assert message['chat']['id'] == message['from']['id']
+
+    def test_salt_changes_ids(self):
+        """С другой солью получаются другие ID"""
+        assert hash_id(42, 'one') != hash_id(42, 'two')
+
+    def test_dates_removed(self):
+        """Время и номер апдейта не записываются"""
+        result = anonymize(UPDATE, 'salt')
+
+        assert 'update_id' not in result
+        assert 'date' not in result['message']
+
+
+class TestUpdateRecorder:
+    """Тесты для UpdateRecorder"""
+
+    def test_records_gaps(self, tmp_path):
+        """Пауза считается от предыдущего апдейта"""
+        path = tmp_path / 'updates.jsonl'
+        clock = iter([10.0, 12.5])
+        recorder = UpdateRecorder(str(path), 'salt', clock=lambda: next(clock))
+
+        recorder.record(UPDATE)
+        recorder.record(make_update(2, 7))
+
+        assert recorder.flush()
+        records = read_records(str(path))
+        assert [gap for gap, _ in records] == [0.0, 2.5]
+        assert records[1][1]['message']['chat']['id'] == hash_id(7, 'salt')
+
+    def test_written_in_background(self, tmp_path, monkeypatch):
+        """Апдейт пишется в файл фоновым потоком, а не в event loop"""
+        path = tmp_path / 'updates.jsonl'
+        recorder = UpdateRecorder(str(path), 'salt')
+        writers = []
+        write = recorder._writer._write
+
+        def recording_write(data):
+            writers.append(threading.current_thread().name)
+            write(data)
+
+        monkeypatch.setattr(recorder._writer, '_write', recording_write)
+        for update_id in range(50):
+            recorder.record(make_update(update_id, 7))
+
+        assert recorder.flush()
+        assert set(writers) == {'update-recorder'}
+        assert len(read_records(str(path))) == 50
+
+    def test_disabled_without_path(self):
+        """Без файла запись выключена"""
+        recorder = UpdateRecorder('', 'salt')
+
+        recorder.record(UPDATE)
+
+        assert not recorder.enabled
+
+    def test_broken_line_skipped(self, tmp_path):
+        """Поврежденная строка (например, при аварийной остановке) пропускается"""
+        path = tmp_path / 'updates.jsonl'
+        path.write_text('{"gap": 1, "update": {"message": {}}}\n{"gap": 2, "upd', encoding='utf-8')
+
+        assert read_records(str(path)) == [(1.0, {'message': {}})]
+
+    @pytest.mark.asyncio
+    async def test_processor_reports_received(self):
+        """PerChatUpdateProcessor сообщает об апдейте до начала обработки"""
+        received = []
+
+        async def step():
+            assert received
+        processor = PerChatUpdateProcessor(max_concurrent_updates=8, on_received=received.append)
+        update = make_update(1, 7)
+
+        await processor.do_process_update(update, step())
+
+        assert received == [update]
+
+
+class TestReplay:
+    """Тесты для подготовки апдейтов к воспроизведению"""
+
+    def test_refresh_dates(self):
+        """Сообщению из записи возвращается время, без него апдейт не разобрать"""
+        update = refresh_dates(anonymize(UPDATE, 'salt'))
+
+        assert update['message']['date'] > 0
+        assert update_chat_id(update) == hash_id(42, 'salt')
+
+    def test_compare_report(self):
+        """Отчет показывает разницу с прошлым запуском"""
+        result = {'updates': 10, 'duration_s': 5.0, 'answered': 10, 'p50_s': 0.2, 'p95_s': 0.5, 'p99_s': 0.5,
+                  'cpu_seconds': 1.0, 'peak_rss_bytes': 100 * 1024 * 1024}
+        baseline = dict(result, p95_s=0.25)
+
+        report = format_report(result, baseline)
+
+        assert '+100.0%' in report
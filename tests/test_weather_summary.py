@@ -0,0 +1,68 @@
+"""Тесты для текстовой сводки погоды на маршруте"""
+
+from datetime import datetime
+
+import pytest
+
+from weather_summary import (format_weather_summary, headwind_note, route_bearings, summarize_weather,
+                             wind_direction_name)
+
+
+def weather(temperature=20.0, precipitation=10.0, wind_speed=18.0, wind_direction=225.0, code=1):
+    return {'time': datetime(2025, 9, 6, 8, 30), 'distance_km': 6.0, 'temperature': temperature,
+            'feels_like': temperature, 'humidity': 60.0, 'wind_speed': wind_speed,
+            'wind_direction': wind_direction, 'pressure': 1013.0, 'weather_code': code,
+            'precipitation_probability': precipitation, 'cloud_cover': 40.0}
+
+
+def northbound(count):
+    """Точки маршрута строго на север"""
+    return [{'lat': 45.0 + i * 0.05, 'lon': 19.8} for i in range(count)]
+
+
+class TestWeatherSummary:
+    """Тесты для summarize_weather и format_weather_summary"""
+
+    def test_summary(self):
+        """Диапазон температуры, максимум осадков и ветер в м/с"""
+        summary = summarize_weather(northbound(3), [weather(18.2, 10), None, weather(23.6, 40)])
+
+        assert summary['temperature_min'] == pytest.approx(18.2)
+        assert summary['temperature_max'] == pytest.approx(23.6)
+        assert summary['precipitation_max'] == 40
+        assert summary['wind_speed'] == pytest.approx(5.0)
+        assert summary['missing'] == 1
+        assert format_weather_summary(summary).splitlines() == [
+            '🌡 18–24°C, 🌤 преимущественно ясно', '💨 ЮЗ 5 м/с (попутный весь маршрут)', '☔ до 40%',
+            '⚠️ Нет прогноза для 1 точек маршрута']
+
+    def test_wind_direction_wraps_north(self):
+        """Ветер с 350° и 10° - северный, а не южный"""
+        summary = summarize_weather(northbound(2), [weather(wind_direction=350), weather(wind_direction=10)])
+
+        assert wind_direction_name(summary['wind_direction']) == 'С'
+
+    def test_no_data(self):
+        """Без прогноза сводки нет"""
+        assert summarize_weather(northbound(2), [None, None]) is None
+
+    def test_headwind_by_half(self):
+        """Северный ветер встречный, пока едем на север, и попутный на обратном пути"""
+        route = northbound(3) + northbound(3)[::-1]
+        summary = summarize_weather(route, [weather(wind_direction=0) for _ in route])
+
+        assert summary['headwind'][0] > 0 > summary['headwind'][1]
+        assert headwind_note(summary['headwind']) == 'встречный в первой половине, попутный во второй половине'
+        assert headwind_note([0.5, None]) is None
+
+    def test_route_bearings(self):
+        """Направление движения считается к следующей точке, в последней - как у предыдущей"""
+        east = [{'lat': 45.0, 'lon': 19.8 + i * 0.05} for i in range(3)]
+
+        assert route_bearings(east) == pytest.approx([90, 90, 90], abs=0.1)
+
+    def test_worst_weather(self):
+        """Редкий дождь упоминается рядом с преобладающей погодой"""
+        summary = summarize_weather(northbound(3), [weather(code=0), weather(code=0), weather(code=63)])
+
+        assert format_weather_summary(summary).splitlines()[0] == '🌡 20°C, ☀️ ясно, местами 🌧 дождь'
@@ -0,0 +1,106 @@
+"""Тесты для режима вебхука"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiohttp
+import pytest
+
+from bot import build_application
+from fakes.telegram_api import FakeTelegramAPI
+from loadtest.run import LevelStats
+from loadtest.scenario import ANNOUNCE_SCENARIO, SimulatedUser
+from webhook import SECRET_HEADER, WebhookServer
+
+
+@asynccontextmanager
+async def webhook_bot():
+    """Приложение бота в режиме вебхука против заглушки Bot API (api, application, server)"""
+    api = await FakeTelegramAPI().start()
+    application = build_application(token='123456:TEST', base_url=api.url)
+    server = WebhookServer(application, url='', listen='127.0.0.1', port=0, secret='test-secret')
+    await application.initialize()
+    await application.start()
+    await server.start()
+    try:
+        yield api, application, server
+    finally:
+        await server.drain()
+        await application.stop()
+        await server.stop()
+        await application.shutdown()
+        await api.stop()
+
+
+def message_update(update_id, user_id, text):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text,
+        'chat': {'id': user_id, 'type': 'private'}, 'from': {'id': user_id, 'is_bot': False, 'first_name': 'Тест'},
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}] if text.startswith('/') else [],
+    }}
+
+
+class TestWebhookServer:
+    """Тесты для WebhookServer"""
+
+    @pytest.mark.asyncio
+    async def test_registers_webhook_and_handles_updates(self):
+        """Бот регистрирует вебхук, и заглушка доставляет на него апдейты"""
+        async with webhook_bot() as (api, application, server):
+            stats = LevelStats(users=1)
+
+            user = SimulatedUser(api, user_id=42, tour_id=1, step_timeout=10)
+
+            completed = await user.run(ANNOUNCE_SCENARIO[:3], stats)
+
+            assert completed, stats.errors
+            assert api.webhook == {'url': server.webhook_url, 'secret_token': 'test-secret'}
+            assert api.calls['getUpdates'] == 0
+            assert server.accepted == 3
+
+    @pytest.mark.asyncio
+    async def test_rejects_wrong_secret(self):
+        """Запрос без верного секрета отклоняется и не попадает в очередь"""
+        async with webhook_bot() as (api, application, server):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(server.webhook_url, json=message_update(1, 42, '/start'),
+                                        headers={SECRET_HEADER: 'wrong'}) as response:
+                    status = response.status
+                async with session.post(server.webhook_url, data=b'not json',
+                                        headers={SECRET_HEADER: 'test-secret'}) as response:
+                    bad_status = response.status
+
+            assert status == 403
+            assert bad_status == 400
+            assert server.accepted == 0
+
+    @pytest.mark.asyncio
+    async def test_recorded_update_posted_directly(self):
+        """Записанный апдейт, отправленный POST-запросом на вебхук, обрабатывается ботом"""
+        async with webhook_bot() as (api, application, server):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(server.webhook_url, json=message_update(7, 43, '/start'),
+                                        headers={SECRET_HEADER: 'test-secret'}) as response:
+                    status = response.status
+
+            reply = await asyncio.wait_for(api.inbox(43).get(), 10)
+
+            assert status == 200
+            assert reply['chat']['id'] == 43
+
+    @pytest.mark.asyncio
+    async def test_drain_rejects_new_updates(self):
+        """При остановке новые апдейты получают 503, а проверка здоровья падает"""
+        async with webhook_bot() as (api, application, server):
+            await server.drain()
+            health_url = server.webhook_url.replace(server.path, '/healthz')
+            async with aiohttp.ClientSession() as session:
+                async with session.post(server.webhook_url, json=message_update(1, 42, '/start'),
+                                        headers={SECRET_HEADER: 'test-secret'}) as response:
+                    status = response.status
+                async with session.get(health_url) as response:
+                    health = response.status
+
+            assert status == 503
+            assert health == 503
+            assert server.rejected == 1
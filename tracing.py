@@ -0,0 +1,229 @@
+"""
+Трассировка этапов подготовки анонса
+
+Каждый разговор получает trace id, а каждый этап (скачивание GPX, анализ,
+запрос погоды, отрисовка, отправка в Telegram) записывает спан с
+длительностью и атрибутами. Спаны пишутся строками JSON в TRACE_FILE,
+дочерние процессы продолжают трассу через переменную окружения TRACEPARENT.
+
+Посмотреть одну трассу: python3 tracing.py <trace_id>
+"""
+
+import os
+import sys
+import json
+import time
+import secrets
+import logging
+import functools
+import contextvars
+from collections import namedtuple
+from contextlib import contextmanager
+
+from jsonl_writer import JsonLinesWriter
+
+logger = logging.getLogger(__name__)
+
+# Файл со спанами (JSON lines); пустой TRACE_FILE - трассы никуда не пишутся
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+
+# Переменная окружения с контекстом трассы для дочерних процессов (формат W3C traceparent)
+TRACEPARENT_ENV = 'TRACEPARENT'
+
+# Имя процесса в спанах: bot или weather_dashboard
+PROCESS_NAME = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+
+# Родительский спан из другого процесса: сам не записывается, только задает trace id и родителя
+RemoteParent = namedtuple('RemoteParent', ['trace_id', 'span_id'])
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def new_trace_id():
+    return secrets.token_hex(16)
+
+
+class Span:
+    """Один этап трассы"""
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+
+    def set(self, key, value):
+        """Добавляет атрибут спана, например количество точек"""
+        self.attributes[key] = value
+
+    def end(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'process': PROCESS_NAME,
+            'start': self.start_time,
+            'duration_ms': round((self.duration or 0) * 1000, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class JsonLinesExporter(JsonLinesWriter):
+    """Дописывает спаны в файл по одному JSON на строку из фонового потока (см. jsonl_writer.py)
+
+    Бот и внешний модуль дашборда могут писать в один файл одновременно.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, thread_name='trace-writer', kind='трассы')
+
+    def export(self, record):
+        self.write(record)
+
+
+_exporter = JsonLinesExporter(TRACE_FILE) if TRACE_FILE else None
+
+
+def set_exporter(exporter):
+    """Заменяет получателя спанов (None - не записывать) и возвращает прежнего"""
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, trace_id=None, **attributes):
+    """Записывает этап трассы
+
+    Вложенные спаны наследуют trace id и родителя из контекста, поэтому
+    trace_id нужно передавать только на верхнем уровне (в обработчике).
+    """
+    parent = _current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent is not None else new_trace_id()
+    parent_id = parent.span_id if parent is not None and parent.trace_id == trace_id else None
+    current = Span(name, trace_id, parent_id, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = 'error'
+        current.set('error', f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.end()
+        _current_span.reset(token)
+        if _exporter is not None:
+            _exporter.export(current.to_dict())
+
+
+def conversation_trace_id(user_data):
+    """Возвращает trace id разговора, создавая его при первом обращении"""
+    trace_id = user_data.get('trace_id')
+    if not trace_id:
+        trace_id = user_data['trace_id'] = new_trace_id()
+    return trace_id
+
+
+def traced_handler(callback):
+    """Оборачивает обработчик разговора в спан с trace id этого разговора"""
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user = getattr(update, 'effective_user', None)
+        with span(callback.__name__, trace_id=conversation_trace_id(context.user_data),
+                  user_id=getattr(user, 'id', None)):
+            return await callback(update, context)
+
+    return wrapper
+
+
+def trace_env(env=None):
+    """Возвращает окружение для дочернего процесса с контекстом текущего спана"""
+    env = dict(os.environ if env is None else env)
+    current = _current_span.get()
+    if current is not None:
+        env[TRACEPARENT_ENV] = current.traceparent()
+    return env
+
+
+def parse_traceparent(value):
+    """Разбирает traceparent вида 00-<trace_id>-<span_id>-01"""
+    parts = (value or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    return RemoteParent(parts[1], parts[2])
+
+
+def continue_trace(value=None):
+    """Продолжает трассу родительского процесса (по умолчанию из переменной TRACEPARENT)"""
+    parent = parse_traceparent(os.environ.get(TRACEPARENT_ENV) if value is None else value)
+    if parent is not None:
+        _current_span.set(parent)
+    return parent
+
+
+def load_trace(path, trace_id):
+    """Читает из файла все спаны одной трассы"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('trace_id') == trace_id:
+                records.append(record)
+    return records
+
+
+def format_trace(records):
+    """Форматирует спаны трассы деревом с длительностями"""
+    known = {record['span_id'] for record in records}
+    children = {}
+    for record in sorted(records, key=lambda r: r['start']):
+        parent_id = record['parent_id'] if record['parent_id'] in known else None
+        children.setdefault(parent_id, []).append(record)
+
+    lines = []
+
+    def walk(parent_id, depth):
+        for record in children.get(parent_id, []):
+            attributes = ' '.join(f"{key}={value}" for key, value in record['attributes'].items())
+            status = '' if record['status'] == 'ok' else f" [{record['status']}]"
+            lines.append(f"{'  ' * depth}{record['name']} ({record['process']}) "
+                         f"{record['duration_ms']:.0f} мс{status} {attributes}".rstrip())
+            walk(record['span_id'], depth + 1)
+
+    walk(None, 0)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or not TRACE_FILE:
+        print("Использование: TRACE_FILE=<файл> python3 tracing.py <trace_id>")
+        sys.exit(1)
+    print(format_trace(load_trace(TRACE_FILE, sys.argv[1])))
@@ -0,0 +1,115 @@
+"""
+Параллельная обработка апдейтов с последовательной обработкой внутри одного чата
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Сколько апдейтов принимается от PTB одновременно, включая ждущие очереди своего чата
+MAX_PENDING_UPDATES = 10000
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает апдейты разных чатов параллельно, а апдейты одного чата - по очереди
+
+    ConversationHandler рассчитывает, что апдейты одного разговора приходят
+    строго друг за другом: состояние разговора меняется только после того,
+    как обработчик вернет следующий шаг. Поэтому апдейты одного чата ждут
+    друг друга на блокировке чата, а медленный шаг одного организатора
+    (скачивание GPX, дашборд) больше не задерживает остальных.
+
+    PTB занимает слот семафора еще до того, как апдейт встанет в очередь
+    чата, поэтому его семафор ограничивает только принятые апдейты
+    (max_pending_updates). Одновременную обработку ограничивает свой
+    семафор на max_concurrent_updates, который берется уже в очереди чата:
+    пачка апдейтов одного чата ждет своей очереди, не занимая слоты
+    остальных чатов.
+    """
+
+    __slots__ = ('_locks', '_waiters', '_slots', 'on_received', 'on_processed', 'interrupt')
+
+    def __init__(self, max_concurrent_updates, on_processed=None, on_received=None, interrupt=None,
+                 max_pending_updates=MAX_PENDING_UPDATES):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = {}
+        self._waiters = {}
+        # Вызывается с апдейтом сразу после получения, до ожидания очереди чата
+        self.on_received = on_received
+        # Вызывается с апдейтом после окончания его обработки
+        self.on_processed = on_processed
+        # Вызывается с апдейтом сразу после получения, до ожидания очереди чата:
+        # отмена не должна ждать, пока закончится шаг, который она отменяет.
+        # Может вернуть awaitable - его апдейт дождется уже в очереди чата
+        self.interrupt = interrupt
+
+    @staticmethod
+    def chat_key(update):
+        """Возвращает ключ для очереди апдейтов или None, если апдейт не привязан к чату"""
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        if self.on_received is not None:
+            self.on_received(update)
+        try:
+            await self._process_in_chat_order(update, coroutine)
+        finally:
+            if self.on_processed is not None:
+                self.on_processed(update)
+
+    async def _process_in_chat_order(self, update, coroutine):
+        # Отмена начинается синхронно, до первого await: апдейт встает в очередь
+        # чата в том же порядке, в котором пришел, и следующие апдейты его не обгонят
+        cancelled = self.interrupt(update) if self.interrupt is not None else None
+        key = self.chat_key(update)
+        if key is None:
+            if cancelled is not None:
+                await cancelled
+            async with self._slots:
+                await coroutine
+            return
+
+        async with self.chat_turn(key):
+            if cancelled is not None:
+                await cancelled
+            async with self._slots:
+                await coroutine
+
+    @asynccontextmanager
+    async def chat_turn(self, key):
+        """Очередь чата key для работы вне апдейтов
+
+        Фоновая задача, которая пишет в чат (например, дорисованный дашборд),
+        дожидается конца текущего шага разговора, а следующие апдейты чата
+        ждут ее.
+        """
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                # Никто больше не ждет этот чат - не храним блокировку впустую
+                del self._waiters[key]
+                del self._locks[key]
+
+    @property
+    def active_chats(self):
+        """Количество чатов, апдейты которых сейчас обрабатываются или ждут очереди"""
+        return len(self._locks)
+
+    async def initialize(self):
+        """Ничего не делает"""
+
+    async def shutdown(self):
+        """Ничего не делает"""
@@ -0,0 +1,119 @@
+"""
+Запись входящих апдейтов для воспроизведения в нагрузочных тестах
+
+Включается переменной UPDATE_RECORD_FILE. Каждый апдейт пишется в файл
+одной JSON строкой вместе с паузой после предыдущего апдейта. ID
+пользователей и чатов заменяются хешами с солью, имена и username
+удаляются; текст сообщений остается, потому что от него зависит ход
+разговора. Воспроизводит запись loadtest/replay.py.
+"""
+
+import os
+import json
+import time
+import hmac
+import hashlib
+import logging
+import secrets
+import threading
+
+from jsonl_writer import JsonLinesWriter
+
+logger = logging.getLogger(__name__)
+
+# Файл для записи апдейтов (JSON lines); пустое значение - запись выключена
+UPDATE_RECORD_FILE = os.getenv('UPDATE_RECORD_FILE', '')
+# Соль для хешей ID. Без нее каждый запуск бота берет случайную соль,
+# и один пользователь в записях разных запусков получает разные ID
+UPDATE_RECORD_SALT = os.getenv('UPDATE_RECORD_SALT', '')
+
+# Объекты, в которых лежат данные пользователя или чата
+PERSON_KEYS = ('from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat', 'contact')
+# Поля, по которым можно узнать человека
+PERSONAL_FIELDS = ('first_name', 'last_name', 'username', 'title', 'phone_number', 'language_code',
+                   'is_premium', 'vcard')
+# ID после хеширования остаются положительными числами, как настоящие ID Telegram
+HASHED_ID_BASE = 10 ** 9
+HASHED_ID_RANGE = 9 * 10 ** 9
+
+
+def hash_id(value, salt):
+    """Стабильно заменяет ID на другое положительное число"""
+    digest = hmac.new(salt.encode('utf-8'), str(value).encode('utf-8'), hashlib.sha256).digest()
+    return HASHED_ID_BASE + int.from_bytes(digest[:8], 'big') % HASHED_ID_RANGE
+
+
+def anonymize(data, salt):
+    """Возвращает копию апдейта без личных данных"""
+    if isinstance(data, list):
+        return [anonymize(item, salt) for item in data]
+    if not isinstance(data, dict):
+        return data
+    result = {}
+    for key, value in data.items():
+        if key in PERSON_KEYS and isinstance(value, dict):
+            person = {k: anonymize(v, salt) for k, v in value.items() if k not in PERSONAL_FIELDS}
+            for id_key in ('id', 'user_id'):
+                if isinstance(person.get(id_key), int):
+                    person[id_key] = hash_id(person[id_key], salt)
+            if key != 'chat' or person.get('type') == 'private':
+                person.setdefault('first_name', 'Организатор')
+            result[key] = person
+        elif key in ('date', 'edit_date', 'update_id'):
+            # Время и номер апдейта при воспроизведении ставятся заново
+            continue
+        else:
+            result[key] = anonymize(value, salt)
+    return result
+
+
+class UpdateRecorder:
+    """Пишет анонимизированные апдейты с паузами между ними
+
+    record вызывается в event loop для каждого апдейта, поэтому в файл
+    строки пишет фоновый поток (jsonl_writer.py).
+    """
+
+    def __init__(self, path=UPDATE_RECORD_FILE, salt=UPDATE_RECORD_SALT, clock=time.monotonic):
+        self.path = path
+        self.salt = salt or secrets.token_hex(16)
+        self._clock = clock
+        self._last = None
+        self._lock = threading.Lock()
+        self._writer = JsonLinesWriter(path, thread_name='update-recorder', kind='апдейта') if path else None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def record(self, update):
+        """Записывает апдейт (telegram.Update или словарь из Bot API)"""
+        if not self.enabled:
+            return
+        data = update.to_dict() if hasattr(update, 'to_dict') else update
+        now = self._clock()
+        with self._lock:
+            gap = 0.0 if self._last is None else now - self._last
+            self._last = now
+        self._writer.write({'gap': round(gap, 3), 'update': anonymize(data, self.salt)})
+
+    def flush(self, timeout=5.0):
+        """Дожидается записи всех апдейтов в файл; False - не дождались за timeout"""
+        return self._writer.flush(timeout) if self._writer is not None else True
+
+
+def read_records(path):
+    """Читает запись: список пар (пауза в секундах, апдейт)"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Пропущена поврежденная строка записи: {line[:80]}")
+                continue
+            records.append((float(record.get('gap', 0)), record['update']))
+    return records
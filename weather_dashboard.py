@@ -4,6 +4,7 @@
 """
 
 import sys
+import time
 import argparse
 import gpxpy
 import openmeteo_requests
@@ -11,13 +12,23 @@ import requests_cache
 from retry_requests import retry
 from datetime import datetime, timedelta
 import os
+import json
 import math
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from matplotlib.patches import FancyBboxPatch
 import numpy as np
-from PIL import Image, ImageDraw
 import pytz
+from tracing import continue_trace, span
+from weather_summary import is_weather_complete, load_weather_data, save_weather_data
+from profiler import profile_from_env
+
+# Адрес Open-Meteo; для офлайн тестов - локальная заглушка fakes/open_meteo.py
+OPEN_METEO_URL = os.getenv('OPEN_METEO_URL', 'https://api.open-meteo.com').rstrip('/')
+# Таймаут запроса к Open-Meteo, с (при дедлайне - не дольше оставшегося времени)
+OPEN_METEO_TIMEOUT = float(os.getenv('OPEN_METEO_TIMEOUT', '10'))
+# Повторы запроса к Open-Meteo при ошибке и пауза перед ними (растет вдвое с каждым повтором), с
+OPEN_METEO_RETRIES = 3
+OPEN_METEO_BACKOFF = 0.2
+# Сколько секунд дедлайна оставлять на отрисовку (не больше половины дедлайна)
+RENDER_RESERVE = 10.0
 
 def get_timezone():
     """Получает временную зону из переменной окружения или возвращает Белград по умолчанию"""
@@ -137,10 +148,32 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     
     return R * c
 
-def get_weather_data_for_route(route_points):
-    """Получает данные о погоде для всех точек маршрута"""
+def request_forecast(openmeteo, url, params, deadline=None):
+    """Запрашивает прогноз; с дедлайном ни запрос, ни повторы с паузами не выходят за него"""
+    if deadline is None:
+        return openmeteo.weather_api(url, params=params, timeout=OPEN_METEO_TIMEOUT)
+    for attempt in range(OPEN_METEO_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Дедлайн запроса прогноза истек")
+        try:
+            return openmeteo.weather_api(url, params=params, timeout=min(OPEN_METEO_TIMEOUT, remaining))
+        except Exception:
+            pause = OPEN_METEO_BACKOFF * 2 ** attempt
+            if attempt == OPEN_METEO_RETRIES or time.monotonic() + pause >= deadline:
+                raise
+            time.sleep(pause)
+
+def get_weather_data_for_route(route_points, deadline=None):
+    """Получает данные о погоде для всех точек маршрута
+
+    deadline - момент по time.monotonic(), к которому запросы должны
+    закончиться: точки, для которых прогноз не успели получить, остаются None.
+    """
     cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
-    retry_session = retry(cache_session, retries=3, backoff_factor=0.2)
+    # С дедлайном запрос повторяет request_forecast, чтобы повторы не выходили за дедлайн
+    retries = 0 if deadline is not None else OPEN_METEO_RETRIES
+    retry_session = retry(cache_session, retries=retries, backoff_factor=OPEN_METEO_BACKOFF)
     openmeteo = openmeteo_requests.Client(session=retry_session)
     
     weather_data = []
@@ -157,7 +190,12 @@ def get_weather_data_for_route(route_points):
     for i, point in enumerate(route_points):
         # print(f"🌪️  Получение данных о погоде {i+1}/{len(route_points)}...")  # Убрано для чистоты вывода
         
-        url = "https://api.open-meteo.com/v1/forecast"
+        if deadline is not None and time.monotonic() >= deadline:
+            # Время вышло - остальные точки остаются без прогноза
+            weather_data.extend([None] * (len(route_points) - i))
+            break
+        
+        url = f"{OPEN_METEO_URL}/v1/forecast"
         params = {
             "latitude": point['lat'],
             "longitude": point['lon'],
@@ -178,7 +216,7 @@ def get_weather_data_for_route(route_points):
         }
         
         try:
-            responses = openmeteo.weather_api(url, params=params)
+            responses = request_forecast(openmeteo, url, params, deadline)
             response = responses[0]
             
             hourly = response.Hourly()
@@ -230,8 +268,27 @@ def get_weather_data_for_route(route_points):
     
     return weather_data
 
-def create_weather_dashboard(route_points, weather_data, output_path="weather_dashboard.png", route_length_km=None):
+def missing_spans(route_points, weather_data):
+    """Промежутки времени без прогноза: [(начало, конец)] от соседней точки с данными до следующей"""
+    spans = []
+    last = len(route_points) - 1
+    for i, weather in enumerate(weather_data):
+        if weather is not None:
+            continue
+        start = route_points[max(i - 1, 0)]['time']
+        end = route_points[min(i + 1, last)]['time']
+        if spans and spans[-1][1] >= start:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    return spans
+
+def create_weather_dashboard(route_points, weather_data, output_path="weather_dashboard.png", route_length_km=None,
+                             dpi=150):
     """Создает дашборд с графиками погоды в стиле Epic Ride Weather"""
+    # matplotlib нужен только для отрисовки: --fetch-only обходится без него
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
     
     # Настройка стиля matplotlib для светлой темы
     plt.style.use('default')
@@ -264,6 +321,15 @@ def create_weather_dashboard(route_points, weather_data, output_path="weather_da
         return False
     
     route_points_clean, weather_data_clean = zip(*valid_data)
+    # Точки без прогноза (не успели получить к дедлайну) отмечаются серым
+    missing_count = len(route_points) - len(valid_data)
+    gaps = missing_spans(route_points, weather_data)
+    ride_start = min(p['time'] for p in route_points)
+    ride_end = max(p['time'] for p in route_points)
+
+    def mark_gaps(ax):
+        for start, end in gaps:
+            ax.axvspan(start, end, color='#bbbbbb', alpha=0.4, linewidth=0, zorder=0)
     
     # Вычисляем длину маршрута, если не передана
     if route_length_km is None:
@@ -291,7 +357,8 @@ def create_weather_dashboard(route_points, weather_data, output_path="weather_da
     ax1.legend(loc='upper left', fontsize=8)
     ax1.grid(True, alpha=0.3, linewidth=0.5)
     ax1.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-    ax1.set_xlim(min(times), max(times))  # Ограничиваем ось X только временем заезда
+    ax1.set_xlim(ride_start, ride_end)  # Ограничиваем ось X только временем заезда
+    mark_gaps(ax1)
     ax1.tick_params(colors='#333333')
     plt.setp(ax1.xaxis.get_majorticklabels(), rotation=45, fontsize=8)
     
@@ -303,13 +370,14 @@ def create_weather_dashboard(route_points, weather_data, output_path="weather_da
     # График осадков (столбчатая диаграмма)
     ax2.bar(times, precipitation_prob, alpha=0.7, color='#87ceeb', label='Вероятность (%)', width=0.8, zorder=5)
     ax2.set_ylim(0, 100)  # Ограничиваем от 0 до 100%
-    ax2.set_xlim(min(times), max(times))  # Ограничиваем ось X только временем заезда
+    ax2.set_xlim(ride_start, ride_end)  # Ограничиваем ось X только временем заезда
+    mark_gaps(ax2)
     
     # График облачности (линия на правой оси)
     ax2_twin = ax2.twinx()
     ax2_twin.plot(times, cloud_cover, color='#808080', linewidth=4, label='Облачность (%)', zorder=1)
     ax2_twin.set_ylim(0, 100)  # Ограничиваем от 0 до 100%
-    ax2_twin.set_xlim(min(times), max(times))  # Ограничиваем ось X только временем заезда
+    ax2_twin.set_xlim(ride_start, ride_end)  # Ограничиваем ось X только временем заезда
     
     ax2.set_title('Осадки и Облачность', fontweight='bold', color='#333333')
     # Объединяем легенды на одной оси
@@ -326,9 +394,9 @@ def create_weather_dashboard(route_points, weather_data, output_path="weather_da
     # 3. Wind Direction Map (занимает 2 строки - средний и нижний левый)
     ax3 = plt.subplot(3, 2, (3, 5))
     
-    # Получаем границы маршрута
-    lats = [p['lat'] for p in route_points_clean]
-    lons = [p['lon'] for p in route_points_clean]
+    # Получаем границы маршрута (весь маршрут, включая точки без прогноза)
+    lats = [p['lat'] for p in route_points]
+    lons = [p['lon'] for p in route_points]
     
     min_lat, max_lat = min(lats), max(lats)
     min_lon, max_lon = min(lons), max(lons)
@@ -424,6 +492,12 @@ def create_weather_dashboard(route_points, weather_data, output_path="weather_da
                       color='black', linewidth=4, alpha=0.8, zorder=5,
                       scale=1, scale_units='xy', angles='xy', width=arrow_scale)
     
+    # Точки без прогноза
+    if missing_count:
+        ax3.plot([p['lon'] for p, w in zip(route_points, weather_data) if w is None],
+                 [p['lat'] for p, w in zip(route_points, weather_data) if w is None],
+                 'x', color='#888888', markersize=8, markeredgewidth=2, label='Нет прогноза', zorder=10)
+    
     # Точки начала и конца
     ax3.plot(lons[0], lats[0], 'go', markersize=8, label='Старт', zorder=15)
     ax3.plot(lons[-1], lats[-1], 'ro', markersize=8, label='Финиш', zorder=15)
@@ -445,21 +519,25 @@ def create_weather_dashboard(route_points, weather_data, output_path="weather_da
               framealpha=0.9, facecolor='white', edgecolor='gray')
     ax4.grid(True, alpha=0.3, linewidth=0.5)
     ax4.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-    ax4.set_xlim(min(times), max(times))  # Ограничиваем ось X только временем заезда
+    ax4.set_xlim(ride_start, ride_end)  # Ограничиваем ось X только временем заезда
+    mark_gaps(ax4)
     ax4.tick_params(colors='#333333')
     plt.setp(ax4.xaxis.get_majorticklabels(), rotation=45, fontsize=8)
     
     # 5. Elevation (нижний правый)
     ax5 = plt.subplot(3, 2, 6)
-    elevations = [p['ele'] for p in route_points_clean]
+    # Высота известна и для точек без прогноза
+    ride_times = [p['time'] for p in route_points]
+    elevations = [p.get('ele', 0) for p in route_points]
     
-    ax5.fill_between(times, elevations, alpha=0.7, color='#ff7f0e')
-    ax5.plot(times, elevations, color='#ff6b6b', linewidth=4)
+    ax5.fill_between(ride_times, elevations, alpha=0.7, color='#ff7f0e')
+    ax5.plot(ride_times, elevations, color='#ff6b6b', linewidth=4)
     ax5.set_title('Высота', fontweight='bold', color='#333333')
     ax5.set_ylim(0, None)  # Минимальное значение высоты = 0
     ax5.grid(True, alpha=0.3, linewidth=0.5)
     ax5.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-    ax5.set_xlim(min(times), max(times))  # Ограничиваем ось X только временем заезда
+    ax5.set_xlim(ride_start, ride_end)  # Ограничиваем ось X только временем заезда
+    mark_gaps(ax5)
     ax5.tick_params(colors='#333333')
     plt.setp(ax5.xaxis.get_majorticklabels(), rotation=45, fontsize=8)
     
@@ -467,13 +545,17 @@ def create_weather_dashboard(route_points, weather_data, output_path="weather_da
     
     plt.tight_layout()
     plt.subplots_adjust(top=0.92, bottom=0.05)
-    plt.savefig(output_path, dpi=150, bbox_inches='tight', facecolor='white')
+    if missing_count:
+        fig.text(0.5, -0.02, f"Нет прогноза для {missing_count} из {len(route_points)} точек маршрута "
+                             f"(отмечены серым)", ha='center', va='top', fontsize=10, color='#888888')
+    plt.savefig(output_path, dpi=dpi, bbox_inches='tight', facecolor='white')
     plt.close()
     
     print(f"✅ Дашборд сохранен в: {output_path}")
     return True
 
 def main():
+    started = time.monotonic()
     parser = argparse.ArgumentParser(description='Дашборд погоды для велосипедного маршрута')
     parser.add_argument('gpx_file', help='Путь к GPX файлу')
     parser.add_argument('-o', '--output', default='weather_dashboard.png',
@@ -484,9 +566,22 @@ def main():
                        help='Дата старта в формате ДД.ММ.ГГГГ (по умолчанию: 06.09.2025)')
     parser.add_argument('-t', '--time', default='08:30',
                        help='Время старта в формате ЧЧ:ММ (по умолчанию: 08:30)')
+    parser.add_argument('--dpi', type=int, default=150,
+                       help='Разрешение картинки (по умолчанию: 150)')
+    parser.add_argument('--weather-json',
+                       help='JSON с данными о погоде: если файл есть, рисуем по нему без запросов в сеть, '
+                            'иначе сохраняем туда полученные данные')
+    parser.add_argument('--fetch-only', action='store_true',
+                       help='Только получить погоду и сохранить ее в --weather-json, не рисуя дашборд')
+    parser.add_argument('--deadline', type=float,
+                       help='За сколько секунд получить погоду и нарисовать дашборд: точки, прогноз для '
+                            'которых не успели получить, рисуются как пропуски')
     
     args = parser.parse_args()
     
+    if args.fetch_only and not args.weather_json:
+        parser.error('--fetch-only требует --weather-json')
+    
     if not os.path.exists(args.gpx_file):
         print(f"❌ Файл {args.gpx_file} не найден!")
         sys.exit(1)
@@ -497,40 +592,85 @@ def main():
     print(f"🚗 Скорость: {args.speed} км/ч")
     print()
     
-    # Получаем точки маршрута
-    points = get_route_points_with_time(args.gpx_file)
-    if not points:
-        print("❌ Не удалось загрузить точки маршрута")
-        sys.exit(1)
-    
-    # Парсим дату и время из аргументов
-    try:
-        date_parts = args.date.split('.')
-        if len(date_parts) != 3:
-            raise ValueError("Неверный формат даты")
-        
-        day, month, year = int(date_parts[0]), int(date_parts[1]), int(date_parts[2])
-        
-        time_parts = args.time.split(':')
-        if len(time_parts) != 2:
-            raise ValueError("Неверный формат времени")
+    # Длительность этапов для метрик бота (печатается последней строкой)
+    timings = {}
+
+    weather_data = None
+    if args.weather_json and os.path.exists(args.weather_json):
+        route_points, weather_data = load_weather_data(args.weather_json)
+        if is_weather_complete(weather_data):
+            # Данные о погоде уже получены - перерисовываем дашборд без запросов в сеть
+            print(f"📦 Данные о погоде загружены из: {args.weather_json}")
+        else:
+            # Прогноз с пропусками (сбой сети или дедлайн) не кэшируется - получаем заново
+            print(f"🔄 В {args.weather_json} прогноз с пропусками, получаем погоду заново")
+            weather_data = None
+    if weather_data is None:
+        # Получаем точки маршрута
+        with span('gpx.read') as read_span:
+            points = get_route_points_with_time(args.gpx_file)
+            read_span.set('points', len(points) if points else 0)
+        if not points:
+            print("❌ Не удалось загрузить точки маршрута")
+            sys.exit(1)
         
-        hour, minute = int(time_parts[0]), int(time_parts[1])
+        # Парсим дату и время из аргументов
+        try:
+            date_parts = args.date.split('.')
+            if len(date_parts) != 3:
+                raise ValueError("Неверный формат даты")
+            
+            day, month, year = int(date_parts[0]), int(date_parts[1]), int(date_parts[2])
+            
+            time_parts = args.time.split(':')
+            if len(time_parts) != 2:
+                raise ValueError("Неверный формат времени")
+            
+            hour, minute = int(time_parts[0]), int(time_parts[1])
+            
+            start_time = datetime(year, month, day, hour, minute, 0)
+            print(f"🕐 Время старта: {start_time.strftime('%Y-%m-%d %H:%M')}")
+            
+        except (ValueError, IndexError) as e:
+            print(f"❌ Ошибка в формате даты/времени: {e}")
+            print("Используйте формат: -d ДД.ММ.ГГГГ -t ЧЧ:ММ")
+            sys.exit(1)
         
-        start_time = datetime(year, month, day, hour, minute, 0)
-        print(f"🕐 Время старта: {start_time.strftime('%Y-%m-%d %H:%M')}")
+        # Вычисляем точки маршрута через равные интервалы
+        with span('route.time_points', speed_kmh=args.speed) as points_span:
+            route_points = calculate_route_time_points(points, start_time, args.speed)
+            points_span.set('points', len(route_points))
+        print(f"📍 Точки для проверки погоды: {len(route_points)} (каждые 6 км)")
         
-    except (ValueError, IndexError) as e:
-        print(f"❌ Ошибка в формате даты/времени: {e}")
-        print("Используйте формат: -d ДД.ММ.ГГГГ -t ЧЧ:ММ")
-        sys.exit(1)
-    
-    # Вычисляем точки маршрута через равные интервалы
-    route_points = calculate_route_time_points(points, start_time, args.speed)
-    print(f"📍 Точки для проверки погоды: {len(route_points)} (каждые 6 км)")
-    
-    # Получаем данные о погоде
-    weather_data = get_weather_data_for_route(route_points)
+        # Получаем данные о погоде; при дедлайне часть времени остается на отрисовку
+        fetch_deadline = None
+        if args.deadline:
+            reserve = 0 if args.fetch_only else min(RENDER_RESERVE, args.deadline / 2)
+            fetch_deadline = started + args.deadline - reserve
+        fetch_started = time.perf_counter()
+        with span('open_meteo.fetch', samples=len(route_points)) as fetch_span:
+            weather_data = get_weather_data_for_route(route_points, deadline=fetch_deadline)
+            timings['open_meteo_missing'] = sum(1 for w in weather_data if w is None)
+            fetch_span.set('missing', timings['open_meteo_missing'])
+            if fetch_deadline is not None and time.monotonic() >= fetch_deadline:
+                timings['open_meteo_deadline'] = True
+                fetch_span.set('deadline', True)
+                print(f"⏱️  Дедлайн {args.deadline:.0f} с: прогноза нет для "
+                      f"{timings['open_meteo_missing']} из {len(route_points)} точек")
+        timings['open_meteo'] = time.perf_counter() - fetch_started
+
+        if not any(item is not None for item in weather_data):
+            # Ни одного прогноза: не сохраняем, иначе бот принял бы пустые данные за полученные
+            print("❌ Не удалось получить прогноз погоды ни для одной точки")
+            print(f"TIMINGS {json.dumps(timings)}")
+            sys.exit(1)
+        if args.weather_json:
+            save_weather_data(args.weather_json, route_points, weather_data)
+    
+    if args.fetch_only:
+        print(f"💾 Данные о погоде сохранены в: {args.weather_json}")
+        print(f"TIMINGS {json.dumps(timings)}")
+        return
     
     # Вычисляем длину маршрута
     total_distance = 0
@@ -542,7 +682,11 @@ def main():
     route_length_km = total_distance / 1000
     
     # Создаем дашборд
-    success = create_weather_dashboard(route_points, weather_data, args.output, route_length_km)
+    render_started = time.perf_counter()
+    with span('dashboard.render', points=len(route_points), dpi=args.dpi) as render_span:
+        success = create_weather_dashboard(route_points, weather_data, args.output, route_length_km, dpi=args.dpi)
+        render_span.set('success', success)
+    timings['render'] = time.perf_counter() - render_started
     
     if success:
         print("\n🎉 Готово! Дашборд погоды создан.")
@@ -552,6 +696,11 @@ def main():
         print("   🗺️  Карта маршрута с направлением ветра")
     else:
         print("\n❌ Ошибка при создании дашборда")
+    print(f"TIMINGS {json.dumps(timings)}")
 
 if __name__ == "__main__":
-    main()
+    # Продолжаем трассу бота, если он передал ее контекст
+    continue_trace()
+    # Если бот профилирует себя, профилируем и внешний модуль
+    with profile_from_env(), span('weather_dashboard'):
+        main()
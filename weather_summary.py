@@ -0,0 +1,218 @@
+"""
+Погода на маршруте без matplotlib: данные о погоде в JSON и текстовая сводка
+
+Модуль нужен и внешнему модулю дашборда (weather_dashboard.py), и самому
+боту: бот показывает сводку сразу, как только погода получена, пока
+дашборд еще рисуется, и добавляет ее к тексту анонса вместо дашборда.
+numpy импортируется внутри функций, чтобы не замедлять запуск бота.
+"""
+
+import os
+import json
+import tempfile
+from datetime import datetime
+
+# Румбы для направления ветра (откуда дует), по 45° начиная с севера
+WIND_DIRECTIONS = ('С', 'СВ', 'В', 'ЮВ', 'Ю', 'ЮЗ', 'З', 'СЗ')
+
+# Значок и описание погоды по коду WMO, который возвращает Open-Meteo
+WEATHER_CODES = {
+    0: ('☀️', 'ясно'),
+    1: ('🌤', 'преимущественно ясно'),
+    2: ('⛅', 'переменная облачность'),
+    3: ('☁️', 'пасмурно'),
+    45: ('🌫', 'туман'),
+    48: ('🌫', 'туман с изморозью'),
+    51: ('🌦', 'слабая морось'),
+    53: ('🌦', 'морось'),
+    55: ('🌧', 'сильная морось'),
+    56: ('🌧', 'ледяная морось'),
+    57: ('🌧', 'ледяная морось'),
+    61: ('🌦', 'небольшой дождь'),
+    63: ('🌧', 'дождь'),
+    65: ('🌧', 'сильный дождь'),
+    66: ('🌧', 'ледяной дождь'),
+    67: ('🌧', 'ледяной дождь'),
+    71: ('🌨', 'небольшой снег'),
+    73: ('🌨', 'снег'),
+    75: ('🌨', 'сильный снег'),
+    77: ('🌨', 'снежная крупа'),
+    80: ('🌦', 'ливень'),
+    81: ('🌧', 'ливень'),
+    82: ('⛈', 'сильный ливень'),
+    85: ('🌨', 'снегопад'),
+    86: ('🌨', 'сильный снегопад'),
+    95: ('⛈', 'гроза'),
+    96: ('⛈', 'гроза с градом'),
+    99: ('⛈', 'гроза с сильным градом'),
+}
+# Коды WMO с осадками, туманом и грозой начинаются с 45
+SIGNIFICANT_WEATHER_CODE = 45
+# Средняя составляющая ветра вдоль маршрута, с которой он считается встречным или попутным, м/с
+HEADWIND_THRESHOLD = 1.0
+
+
+def save_weather_data(path, route_points, weather_data):
+    """Сохраняет точки маршрута и данные о погоде в JSON, чтобы перерисовать дашборд без сети"""
+    import numpy as np
+
+    def serialize(item):
+        if item is None:
+            return None
+        return {key: value.isoformat() if isinstance(value, datetime) else
+                (value.item() if isinstance(value, np.generic) else value)
+                for key, value in item.items()}
+
+    data = {
+        'route_points': [serialize(p) for p in route_points],
+        'weather_data': [serialize(w) for w in weather_data],
+    }
+    # Файл общий для всех организаторов анонса: у каждого процесса свой
+    # временный файл, а читатели видят только целый JSON
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_weather_data(path):
+    """Загружает точки маршрута и данные о погоде, сохраненные save_weather_data"""
+    def deserialize(item):
+        if item is None:
+            return None
+        item = dict(item)
+        item['time'] = datetime.fromisoformat(item['time'])
+        return item
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return ([deserialize(p) for p in data['route_points']],
+            [deserialize(w) for w in data['weather_data']])
+
+
+def is_weather_complete(weather_data):
+    """Прогноз получен для всех точек маршрута
+
+    Прогноз с пропусками (ошибка сети, дедлайн) годится для одного дашборда,
+    но не как сохраненные данные: их нужно получить заново.
+    """
+    return all(item is not None for item in weather_data)
+
+
+def wind_direction_name(degrees):
+    """Румб (С, СВ, ...) для направления ветра в градусах"""
+    return WIND_DIRECTIONS[int((degrees % 360) / 45 + 0.5) % 8]
+
+
+def route_bearings(route_points):
+    """Направление движения в каждой точке маршрута (к следующей точке), градусы от севера"""
+    import numpy as np
+
+    lat = np.radians([p['lat'] for p in route_points])
+    lon = np.radians([p['lon'] for p in route_points])
+    if len(lat) < 2:
+        return np.zeros(len(lat))
+    d_lon = np.diff(lon)
+    bearings = np.degrees(np.arctan2(np.sin(d_lon) * np.cos(lat[1:]),
+                                     np.cos(lat[:-1]) * np.sin(lat[1:]) -
+                                     np.sin(lat[:-1]) * np.cos(lat[1:]) * np.cos(d_lon))) % 360
+    # В последней точке едем туда же, куда ехали к ней
+    return np.append(bearings, bearings[-1])
+
+
+def summarize_weather(route_points, weather_data):
+    """Сводные показатели погоды на маршруте или None, если данных нет
+
+    Возвращает словарь: температура min/max, максимальная вероятность
+    осадков, преобладающая и самая значимая погода (коды WMO),
+    преобладающий ветер (направление, откуда дует, и средняя скорость в
+    м/с), средний встречный ветер в первой и второй половине маршрута
+    (отрицательный - попутный, None - нет данных) и число точек без прогноза.
+    """
+    import numpy as np
+
+    valid = [w for w in weather_data if w is not None]
+    if not valid:
+        return None
+    has_data = np.array([w is not None for w in weather_data])
+    temperature = np.array([w['temperature'] for w in valid], dtype=float)
+    precipitation = np.array([w['precipitation_probability'] for w in valid], dtype=float)
+    # Open-Meteo отдает скорость ветра в км/ч
+    wind_speed = np.array([w['wind_speed'] for w in valid], dtype=float) / 3.6
+    wind_direction = np.radians([w['wind_direction'] for w in valid])
+    codes = np.array([w['weather_code'] for w in valid], dtype=int)
+    common_code = int(np.bincount(codes).argmax())
+    worst_code = int(codes.max())
+
+    # Встречная составляющая: ветер дует оттуда, куда едем
+    bearings = np.radians(route_bearings(route_points))[has_data]
+    headwind = wind_speed * np.cos(wind_direction - bearings)
+    half = np.arange(len(weather_data))[has_data] < len(weather_data) / 2
+    halves = [float(headwind[mask].mean()) if mask.any() else None for mask in (half, ~half)]
+
+    # Направление - среднее векторов ветра, чтобы 350° и 10° давали север, а не юг
+    wind_angle = np.degrees(np.arctan2((wind_speed * np.sin(wind_direction)).sum(),
+                                       (wind_speed * np.cos(wind_direction)).sum())) % 360
+    return {
+        'temperature_min': float(np.nanmin(temperature)),
+        'temperature_max': float(np.nanmax(temperature)),
+        'precipitation_max': float(max(np.nanmax(precipitation), 0)),
+        'wind_direction': float(wind_angle),
+        'wind_speed': float(np.nanmean(wind_speed)),
+        'weather_code': common_code,
+        'weather_code_worst': worst_code,
+        'headwind': halves,
+        'missing': len(weather_data) - len(valid),
+    }
+
+
+def weather_description(code):
+    """Значок и описание погоды по коду WMO"""
+    return WEATHER_CODES.get(code, ('🌡', 'погода'))
+
+
+def headwind_note(halves):
+    """Где на маршруте ветер встречный или попутный: "встречный в первой половине" или None"""
+    def kind(value):
+        if value is None or abs(value) < HEADWIND_THRESHOLD:
+            return None
+        return 'встречный' if value > 0 else 'попутный'
+
+    first, second = (kind(value) for value in halves)
+    if first and first == second:
+        return f"{first} весь маршрут"
+    parts = []
+    if first:
+        parts.append(f"{first} в первой половине")
+    if second:
+        parts.append(f"{second} во второй половине")
+    return ', '.join(parts) or None
+
+
+def format_weather_summary(summary):
+    """Короткая сводка погоды в HTML для Telegram, она же блок погоды в тексте анонса"""
+    low, high = round(summary['temperature_min']), round(summary['temperature_max'])
+    temperature = f"{low}°C" if low == high else f"{low}–{high}°C"
+    emoji, description = weather_description(summary['weather_code'])
+    weather = f"{emoji} {description}"
+    worst = summary['weather_code_worst']
+    if worst != summary['weather_code'] and worst >= SIGNIFICANT_WEATHER_CODE:
+        worst_emoji, worst_description = weather_description(worst)
+        weather += f", местами {worst_emoji} {worst_description}"
+    wind = f"💨 {wind_direction_name(summary['wind_direction'])} {summary['wind_speed']:.0f} м/с"
+    note = headwind_note(summary['headwind'])
+    if note:
+        wind += f" ({note})"
+    lines = [
+        f"🌡 {temperature}, {weather}",
+        wind,
+        f"☔ до {summary['precipitation_max']:.0f}%",
+    ]
+    if summary['missing']:
+        lines.append(f"⚠️ Нет прогноза для {summary['missing']} точек маршрута")
+    return '\n'.join(lines)
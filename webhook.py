@@ -0,0 +1,207 @@
+"""
+Режим вебхука: Telegram присылает апдейты POST-запросами на встроенный HTTP-сервер
+
+Включается переменной WEBHOOK_URL (публичный адрес бота без пути, например
+https://bot.example.com); без нее бот, как и раньше, получает апдейты через
+getUpdates. Обычно TLS завершает обратный прокси (nginx, Caddy, балансировщик),
+а бот слушает обычный HTTP на WEBHOOK_LISTEN:WEBHOOK_PORT. Если прокси нет,
+WEBHOOK_TLS_CERT и WEBHOOK_TLS_KEY включают TLS на самом сервере, а с
+WEBHOOK_SELF_SIGNED сертификат передается Telegram при setWebhook.
+
+Запросы принимаются только на WEBHOOK_PATH и только с заголовком
+X-Telegram-Bot-Api-Secret-Token, равным WEBHOOK_SECRET (без него секрет
+генерируется при каждом запуске). При остановке сервер перестает принимать
+апдейты (отвечает 503 - Telegram повторит их позже, уже новому процессу),
+дожидается обработки принятых и только потом закрывается. Вебхук при этом
+не удаляется, чтобы апдейты не терялись между перезапусками.
+
+Проверить режим локально можно, отправив записанные апдейты на адрес
+вебхука: python3 -m loadtest.replay logs/updates.jsonl --webhook
+"""
+
+import os
+import ssl
+import hmac
+import signal
+import asyncio
+import logging
+import secrets
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = '/' + os.getenv('WEBHOOK_PATH', '/telegram').strip('/')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_TLS_CERT = os.getenv('WEBHOOK_TLS_CERT', '')
+WEBHOOK_TLS_KEY = os.getenv('WEBHOOK_TLS_KEY', '')
+WEBHOOK_SELF_SIGNED = os.getenv('WEBHOOK_SELF_SIGNED', '').lower() in ('1', 'true', 'yes')
+# Сколько одновременных соединений Telegram открывает к вебхуку (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+# Регистрировать ли вебхук в Telegram; процессы за dispatcher.py не регистрируют - это делает он
+WEBHOOK_REGISTER = os.getenv('WEBHOOK_REGISTER', '1').lower() not in ('0', 'false', 'no')
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+async def register_webhook(bot, url, secret, max_connections=WEBHOOK_MAX_CONNECTIONS, certificate_path=None):
+    """Регистрирует вебхук в Telegram; certificate_path - самоподписанный сертификат сервера"""
+    certificate = None
+    if certificate_path:
+        with open(certificate_path, 'rb') as f:
+            certificate = f.read()
+    await bot.set_webhook(url=url, certificate=certificate, max_connections=max_connections,
+                          allowed_updates=Update.ALL_TYPES, secret_token=secret)
+    logger.info(f"Вебхук зарегистрирован: {url}")
+
+
+def ssl_context(cert, key=None):
+    """TLS для сервера вебхука, если его не завершает прокси"""
+    if not cert:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key or None)
+    return context
+
+
+class WebhookServer:
+    """HTTP-сервер на aiohttp, который кладет апдейты из вебхука в очередь приложения
+
+    Обработка апдейта идет в приложении как при getUpdates, поэтому Telegram
+    получает ответ 200 сразу после постановки апдейта в очередь.
+    """
+
+    def __init__(self, application, url=WEBHOOK_URL, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 secret=WEBHOOK_SECRET, tls_cert=WEBHOOK_TLS_CERT, tls_key=WEBHOOK_TLS_KEY,
+                 self_signed=WEBHOOK_SELF_SIGNED, max_connections=WEBHOOK_MAX_CONNECTIONS,
+                 register=WEBHOOK_REGISTER):
+        self.application = application
+        self.url = url
+        self.listen = listen
+        self.port = int(port)
+        self.path = path
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.tls_cert = tls_cert
+        self.tls_key = tls_key
+        self.self_signed = self_signed
+        self.max_connections = max_connections
+        self.register = register
+        self.draining = False
+        self.accepted = 0
+        self.rejected = 0
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._runner = None
+
+    @property
+    def webhook_url(self):
+        # Без публичного адреса - адрес самого сервера (локальные проверки)
+        base = self.url or f"{'https' if self.tls_cert else 'http'}://{self.listen}:{self.port}"
+        return f"{base}{self.path}"
+
+    async def _handle_update(self, request):
+        from aiohttp import web
+        if self.draining:
+            self.rejected += 1
+            return web.Response(status=503, headers={'Retry-After': '1'}, text='Shutting down')
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            logger.warning(f"Запрос к вебхуку без верного секрета с {request.remote}")
+            return web.Response(status=403)
+
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            try:
+                data = await request.json()
+                update = Update.de_json(data, self.application.bot)
+            except Exception as e:
+                logger.error(f"Не удалось разобрать апдейт из вебхука: {e}")
+                return web.Response(status=400)
+            await self.application.update_queue.put(update)
+            self.accepted += 1
+            return web.Response()
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def _handle_health(self, request):
+        from aiohttp import web
+        # Балансировщик перестает слать запросы процессу, который останавливается
+        if self.draining:
+            return web.Response(status=503, text='draining')
+        return web.Response(text='ok')
+
+    async def start(self):
+        """Запускает сервер и регистрирует вебхук в Telegram"""
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get('/healthz', self._handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port, ssl_context=ssl_context(self.tls_cert, self.tls_key))
+        await site.start()
+        # При port=0 система выбирает свободный порт
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Вебхук слушает {self.listen}:{self.port}{self.path}")
+
+        if self.register:
+            await register_webhook(self.application.bot, self.webhook_url, self.secret, self.max_connections,
+                                   self.tls_cert if self.self_signed else None)
+
+    async def drain(self):
+        """Перестает принимать апдейты и ждет, пока принятые попадут в очередь"""
+        self.draining = True
+        await self._idle.wait()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def serve(application, server, stop_signals=(signal.SIGINT, signal.SIGTERM)):
+    """Работает в режиме вебхука до сигнала остановки, затем корректно завершается
+
+    Повторяет жизненный цикл run_polling: initialize, post_init, start, ...,
+    stop, post_stop, shutdown, post_shutdown.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in stop_signals:
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        try:
+            await server.start()
+            await stop.wait()
+            logger.info("Останавливаемся: дообрабатываем принятые апдейты")
+            await server.drain()
+        finally:
+            # stop() ждет, пока приложение обработает все апдейты из очереди
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+            await server.stop()
+        logger.info(f"Вебхук остановлен, принято апдейтов: {server.accepted}, "
+                    f"отклонено при остановке: {server.rejected}")
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        for sig in stop_signals:
+            loop.remove_signal_handler(sig)
+
+
+def run_webhook(application, server=None):
+    """Запускает бота в режиме вебхука (аналог application.run_polling())"""
+    asyncio.run(serve(application, server or WebhookServer(application)))